@@ -0,0 +1,409 @@
+#
+# Medidas de rendimiento de Villarbolsillo
+# ----------------------------------------
+#
+# Genera clases sintéticas en la base de datos en memoria y mide el tiempo,
+# el número de peticiones que se harían a Airtable y la memoria máxima de
+# las operaciones con movimientos. Los resultados se guardan en JSON para
+# compararlos entre versiones.
+#
+# Uso: python RENDIMIENTO.py --participantes 30 500 --movimientos 10 5000
+#
+
+
+#
+# Importación de módulos
+# ----------------------
+#
+
+import argparse, builtins, contextlib, datetime, io, json, math, os, platform, random, statistics, sys, threading, time, tracemalloc
+
+import VILLARBOLSILLO as V
+
+
+#
+# Clases
+# ------
+#
+
+# Tabla que cuenta peticiones
+class TablaContada:
+    ''' Envuelve una tabla y cuenta las peticiones que costaría cada llamada
+        en Airtable: una por escritura o lectura de un registro y una por
+        cada página de 100 registros en all e iterate. Las cargas en
+        paralelo la usan desde varios hilos. '''
+
+    def __init__(self, tabla):
+        self.tabla = tabla
+        self.peticiones = 0
+        self.cerrojo = threading.Lock()
+
+    def contar(self, peticiones):
+        with self.cerrojo:
+            self.peticiones += peticiones
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self.tabla, nombre)
+
+        if nombre == "iterate":
+            def paginas(*args, **kwargs):
+                for pagina in metodo(*args, **kwargs):
+                    self.contar(1)
+                    yield pagina
+            return paginas
+
+        def contado(*args, **kwargs):
+            resultado = metodo(*args, **kwargs)
+            if nombre == "all":
+                self.contar(max(1, math.ceil(len(resultado) / 100)))
+            else:
+                self.contar(1)
+            return resultado
+
+        return contado
+
+
+#
+# Globales
+#
+
+# Comercios y productos de las clases sintéticas: (nombre, precio, gestión)
+COMERCIOS = {
+    "SUPERMERCADO": [("PAN", -2.5, "PEQUEÑA"), ("FRUTA", -6, "PEQUEÑA"), ("CARNE", -15, "MEDIANA"), ("COMPRA SEMANAL", -80, "GRANDE")],
+    "ELECTRODOMÉSTICOS": [("TOSTADORA", -30, "MEDIANA"), ("LAVADORA", -450, "GRANDE"), ("PILAS", -5, "PEQUEÑA")],
+    "LIBRERÍA": [("CUADERNO", -3, "PEQUEÑA"), ("NOVELA", -18, "PEQUEÑA"), ("ENCICLOPEDIA", -120, "GRANDE")],
+    "CINE": [("ENTRADA", -8, "PEQUEÑA"), ("PALOMITAS", -4, "PEQUEÑA"), ("ABONO MENSUAL", -25, "MEDIANA")],
+}
+
+# Profesiones de los personajes: (nombre, salario, deuda de la tarjeta)
+PROFESIONES = [("MÉDICO", 3200, 900), ("MAESTRA", 1900, 400), ("FONTANERO", 1700, 300), ("INGENIERA", 2600, 700)]
+
+# Conceptos periódicos sin personaje: (nombre, precio, frecuencia)
+PERIODICOS = [("ALQUILER", -600, "MENSUAL")]
+
+# Tipos de cuenta además de la corriente y la de tarjeta, cada cuántos personajes
+CUENTAS_EXTRA = {"AHORRO": 2, "JUBILACIÓN": 3}
+
+# Respuestas a las preguntas de cada operación, por texto de la pregunta
+RESPUESTAS = {
+    "referencia del comercio": "1",
+    "número de concepto": "1",
+    "medio de pago": "2",
+    "elegir cuenta": "1",
+    "elegir movimiento": "-1",
+    "siguiente página": "",
+}
+
+
+#
+# Funciones
+# ---------
+#
+
+
+def generarClase(numParticipantes, numMovimientos, semilla=0):
+    '''Genera los registros de una clase sintética
+
+    Argumentos:
+    - numParticipantes: int
+    - numMovimientos: int
+        Movimientos de la cuenta corriente de cada participante, repartidos
+        en el último año e incluidas las mensualidades
+    - semilla: int
+
+    Retorna: {tabla: [Record]} para BaseMemoria.cargar'''
+
+    azar = random.Random(semilla)
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    datos = {nombre: [] for nombre in V.TABLAS}
+
+    def registro(tabla, campos, dias=0):
+        idReg = f"rec{tabla[:3]}{len(datos[tabla]):011d}"
+        datos[tabla].append({
+            "id": idReg,
+            "createdTime": V.marcaDeTiempo(ahora - datetime.timedelta(days=dias)),
+            "fields": campos,
+        })
+        return idReg
+
+    profesiones = [
+        registro("PROFESIONES", {"NOMBRE": nombre, "SALARIO": salario, "DEUDA-TARJETA-CRÉDITO": deuda})
+        for nombre, salario, deuda in PROFESIONES
+    ]
+
+    productos = []
+    for comercio, lista in COMERCIOS.items():
+        idComercio = registro("COMERCIOS", {"NOMBRE": comercio, "REGLAS": "Sin devoluciones después de una semana."})
+        for nombre, precio, gestion in lista:
+            productos.append(registro("PRODUCTOS-SERVICIOS", {
+                "NOMBRE": nombre, "PRECIO": precio, "GESTIÓN": gestion, "COMERCIO": [idComercio],
+            }))
+
+    idPagoDeuda = registro("PRODUCTOS-SERVICIOS", {"NOMBRE": "PAGO DEUDA TARJETA", "GESTIÓN": "PEQUEÑA"})
+    periodicos = {
+        nombre: registro("PRODUCTOS-SERVICIOS", {
+            "NOMBRE": nombre, "PRECIO": precio, "GESTIÓN": "PEQUEÑA", "PERIÓDICO": True, "FRECUENCIA": frecuencia,
+        })
+        for nombre, precio, frecuencia in PERIODICOS
+    }
+
+    for i in range(numParticipantes):
+
+        numProfesion = i % len(PROFESIONES)
+        profesion, salario, deuda = PROFESIONES[numProfesion]
+
+        idPersonaje = registro("PERSONAJES", {
+            "PERSONAJE": f"{i + 1}. {profesion.capitalize()}",
+            "REFERENCIA": i + 1,
+            "DENOMINACIÓN": f"{profesion.capitalize()} {i + 1}",
+            "PROFESIÓN": profesion,
+            "SALARIO": salario,
+            "PAGO-MÍNIMO-TARJETA-CRÉDITO": round(deuda * 0.05, 2),
+            "DEUDA-TARJETA-CRÉDITO": deuda,
+            "OCUPACIÓN1": [profesiones[numProfesion]],
+        })
+
+        registro("PERSONAS", {
+            "NOMBRE": f"NOMBRE{i + 1}",
+            "APELLIDO1": f"APELLIDO{azar.randrange(1000)}",
+            "APELLIDO2": f"APELLIDO{azar.randrange(1000)}",
+            "TIPO": "ESTUDIANTE",
+            "PERSONAJE": [idPersonaje],
+        })
+
+        idMensualidad = registro("PRODUCTOS-SERVICIOS", {
+            "NOMBRE": "MENSUALIDAD", "PERSONAJE": [idPersonaje], "PERIÓDICO": True, "FRECUENCIA": "MENSUAL",
+        })
+
+        idCorriente = registro("CUENTAS", {"PERSONAJE": [idPersonaje], "TIPO-CUENTA": "CORRIENTE"}, 365)
+        idTarjeta = registro("CUENTAS", {"PERSONAJE": [idPersonaje], "PERSONAJE-TARJETA": [idPersonaje], "TIPO-CUENTA": "TARJETA"}, 365)
+        for tipo, cada in CUENTAS_EXTRA.items():
+            if i % cada == 0:
+                registro("CUENTAS", {"PERSONAJE": [idPersonaje], f"PERSONAJE-{tipo}": [idPersonaje], "TIPO-CUENTA": tipo}, 365)
+
+        registro("MOVIMIENTOS", {
+            "CUENTA": [idTarjeta], "CONCEPTO": [idPagoDeuda], "MEDIO": "TARJETA-CRÉDITO", "IMPORTE-PARTICULAR": -deuda,
+        }, 365)
+
+        # Una mensualidad y un alquiler al mes hasta el mes pasado, para que
+        # queden movimientos periódicos pendientes del mes actual
+        meses = min(12, max(1, numMovimientos // 10))
+        for mes in range(meses, 0, -1):
+            registro("MOVIMIENTOS", {"CUENTA": [idCorriente], "CONCEPTO": [idMensualidad], "MEDIO": "INGRESO"}, 30 * mes)
+            registro("MOVIMIENTOS", {"CUENTA": [idCorriente], "CONCEPTO": [periodicos["ALQUILER"]], "MEDIO": "TALÓN"}, 30 * mes)
+
+        for j in range(max(0, numMovimientos - 2 * meses)):
+            registro("MOVIMIENTOS", {
+                "CUENTA": [idCorriente], "CONCEPTO": [azar.choice(productos)], "MEDIO": azar.choice(["TALÓN", "TARJETA-DÉBITO"]),
+            }, azar.randrange(7, 30 * meses + 1))
+
+    # Los números de movimiento siguen el orden de creación
+    datos["MOVIMIENTOS"].sort(key=lambda r: r["createdTime"])
+    for numero, reg in enumerate(datos["MOVIMIENTOS"]):
+        reg["fields"]["MOVIMIENTO"] = numero + 1
+    for numero, reg in enumerate(datos["CUENTAS"]):
+        reg["fields"]["NÚMERO-CUENTA"] = numero + 1
+
+    return datos
+
+
+def entradaSimulada(respuestas):
+    '''Sustituto de input que contesta según el texto de la pregunta'''
+
+    def entrada(pregunta=""):
+        for texto, respuesta in respuestas.items():
+            if texto in pregunta.lower():
+                return respuesta
+        raise RuntimeError(f"Pregunta sin respuesta simulada: {pregunta!r}")
+
+    return entrada
+
+
+def prepararTablas(datos):
+    '''Carga la clase en una base en memoria y la sirve como cargarBase
+
+    Retorna: tablas envueltas en la caché y tablas contadas'''
+
+    baseMemoria = V.BaseMemoria()
+    baseMemoria.cargar(datos)
+
+    contadas = {nombre: TablaContada(tabla) for nombre, tabla in baseMemoria.tablas().items()}
+
+    V.base.clear()
+    V.instantaneas.clear()
+    V.base.update(V.envolverConCache(contadas, V.cargarConfiguracion().get("cache", dict())))
+
+    return (V.base, contadas)
+
+
+def medir(operacion, contadas, conMemoria):
+    '''Ejecuta una operación sin salida por pantalla y con las preguntas contestadas
+
+    Retorna: {"segundos", "peticiones", "memoriaPico"}'''
+
+    antes = sum(t.peticiones for t in contadas.values())
+    inputOriginal = builtins.input
+    builtins.input = entradaSimulada(RESPUESTAS)
+
+    if conMemoria:
+        tracemalloc.start()
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            operacion()
+            segundos = time.perf_counter() - inicio
+    finally:
+        builtins.input = inputOriginal
+        memoriaPico = tracemalloc.get_traced_memory()[1] if conMemoria else None
+        if conMemoria:
+            tracemalloc.stop()
+
+    return {
+        "segundos": segundos,
+        "peticiones": sum(t.peticiones for t in contadas.values()) - antes,
+        "memoriaPico": memoriaPico,
+    }
+
+
+def operaciones(tablas, idParticipante):
+    '''Operaciones que se miden para un participante: nombre: función'''
+
+    reg = [idParticipante]
+
+    def corriente():
+        datos = V.prepararCuentas(tablas, reg)
+        return datos["CUENTA-CORRIENTE"]
+
+    def registrarPendientes():
+        datos = V.prepararCuentas(tablas, reg)
+        V.registrarMovPeriodicosPendientes(tablas, datos)
+
+    return {
+        "registrarMovPeriodicosPendientes": registrarPendientes,
+        "nuevoMovimiento": lambda: V.nuevoMovimiento(tablas, reg),
+        "listaMovimientos": lambda: V.listaMovimientos(tablas, reg),
+        "elegirMovimiento": lambda: V.elegirMovimiento(tablas, corriente()),
+    }
+
+
+def medirEscenario(numParticipantes, numMovimientos, muestra, repeticiones, conMemoria):
+    '''Mide todas las operaciones en una clase sintética
+
+    Retorna: lista de resultados, uno por operación'''
+
+    datos = generarClase(numParticipantes, numMovimientos)
+    tablas, contadas = prepararTablas(datos)
+
+    elegidos = [reg["id"] for reg in datos["PERSONAS"][:muestra]]
+    medidas = dict()
+
+    for repeticion in range(repeticiones):
+        # Cada repetición empieza sin instantáneas, como una sesión nueva
+        V.instantaneas.clear()
+        for idParticipante in elegidos:
+            for nombre, operacion in operaciones(tablas, idParticipante).items():
+                medidas.setdefault(nombre, []).append(medir(operacion, contadas, conMemoria))
+
+    resultados = []
+
+    for nombre, lista in medidas.items():
+        segundos = [m["segundos"] for m in lista]
+        picos = [m["memoriaPico"] for m in lista if m["memoriaPico"] is not None]
+        resultados.append({
+            "participantes": numParticipantes,
+            "movimientos": numMovimientos,
+            "operacion": nombre,
+            "llamadas": len(lista),
+            "segundosMediana": statistics.median(segundos),
+            "segundosMaximo": max(segundos),
+            "peticionesMedia": statistics.mean(m["peticiones"] for m in lista),
+            "memoriaPicoMaxima": max(picos) if picos else None,
+        })
+
+    return resultados
+
+
+def compararConReferencia(resultados, referencia, tolerancia):
+    '''Lista las operaciones más lentas o con más peticiones que en la referencia
+
+    Retorna: [str] con una línea por regresión'''
+
+    anteriores = {
+        (r["participantes"], r["movimientos"], r["operacion"]): r for r in referencia["resultados"]
+    }
+    regresiones = []
+
+    for r in resultados:
+        anterior = anteriores.get((r["participantes"], r["movimientos"], r["operacion"]))
+        if not anterior:
+            continue
+        escenario = f'{r["operacion"]} ({r["participantes"]} participantes, {r["movimientos"]} movimientos)'
+        if r["segundosMediana"] > anterior["segundosMediana"] * (1 + tolerancia):
+            regresiones.append(f'{escenario}: {anterior["segundosMediana"]:.4f} s -> {r["segundosMediana"]:.4f} s')
+        if r["peticionesMedia"] > anterior["peticionesMedia"]:
+            regresiones.append(f'{escenario}: {anterior["peticionesMedia"]:.1f} -> {r["peticionesMedia"]:.1f} peticiones')
+
+    return regresiones
+
+
+def argumentos():
+
+    analizador = argparse.ArgumentParser(description="Medidas de rendimiento de Villarbolsillo con clases sintéticas.")
+    analizador.add_argument("--participantes", type=int, nargs="+", default=[30], help="Tamaños de clase.")
+    analizador.add_argument("--movimientos", type=int, nargs="+", default=[10, 1000], help="Movimientos por participante.")
+    analizador.add_argument("--muestra", type=int, default=3, help="Participantes en los que se mide cada operación.")
+    analizador.add_argument("--repeticiones", type=int, default=3)
+    analizador.add_argument("--sin-memoria", action="store_true", help="No medir la memoria (tracemalloc ralentiza las operaciones).")
+    analizador.add_argument("--salida", default="rendimiento.json")
+    analizador.add_argument("--referencia", help="JSON de una medida anterior con el que comparar.")
+    analizador.add_argument("--tolerancia", type=float, default=0.2, help="Aumento de tiempo admitido respecto a la referencia.")
+
+    return analizador.parse_args()
+
+
+#
+# Ejecución principal
+# -------------------
+#
+
+if __name__ == "__main__":
+
+    args = argumentos()
+    resultados = []
+
+    # Los ficheros indicados son relativos al directorio desde el que se
+    # lanza; el guión lee conf.toml del suyo
+    args.salida = os.path.abspath(args.salida)
+    if args.referencia:
+        args.referencia = os.path.abspath(args.referencia)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    for numParticipantes in args.participantes:
+        for numMovimientos in args.movimientos:
+            print(f"Midiendo {numParticipantes} participantes con {numMovimientos} movimientos...")
+            resultados += medirEscenario(numParticipantes, numMovimientos, args.muestra, args.repeticiones, not args.sin_memoria)
+
+    informe = {
+        "fecha": V.marcaDeTiempo(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "resultados": resultados,
+    }
+
+    with open(args.salida, "w", encoding="utf-8") as fichero:
+        json.dump(informe, fichero, ensure_ascii=False, indent=2)
+
+    for r in resultados:
+        print(f'{r["operacion"]:<34} {r["participantes"]:>5} {r["movimientos"]:>6} {r["segundosMediana"]:>9.4f} s {r["peticionesMedia"]:>7.1f} pet.')
+
+    print(f"\nResultados guardados en {args.salida}.")
+
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as fichero:
+            regresiones = compararConReferencia(resultados, json.load(fichero), args.tolerancia)
+        if regresiones:
+            print("\nRegresiones respecto a la referencia:")
+            for linea in regresiones:
+                print(linea)
+            sys.exit(1)
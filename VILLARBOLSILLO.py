@@ -12,13 +12,18 @@
 #
 
 
-import os, time
+import time
+
+# Instante de inicio para medir el tiempo de arranque
+INICIO = time.perf_counter()
+
+import bisect, concurrent.futures, contextlib, copy, csv, datetime, functools, itertools, json, operator, os, random, re, threading
 import tomllib
-import getch
-import numpy as np
-import pandas as pd
-from pyairtable import Table
-from prettytable import PLAIN_COLUMNS, PrettyTable
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# getch, prettytable y pyairtable se importan la primera vez
+# que se necesitan para que el arranque sea rápido en equipos modestos
 
 
 #
@@ -27,34 +32,6 @@ from prettytable import PLAIN_COLUMNS, PrettyTable
 #
 
 
-# Pila
-class Pila:
-    """ Representa una pila con operaciones de apilar, desapilar y
-        verificar si está vacía. """
-
-    def __init__(self):
-        """ Crea una pila vacía. """
-        # La pila vacía se representa con una lista vacía
-        self.items=[]
-
-    def apilar(self, x):
-        """ Agrega el elemento x a la pila. """
-        # Apilar es agregar al final de la lista.
-        self.items.append(x)
-
-    def desapilar(self):
-        """ Devuelve el elemento tope y lo elimina de la pila.
-            Si la pila está vacía levanta una excepción. """
-        try:
-            return self.items.pop()
-        except IndexError:
-            raise ValueError("La pila está vacía")
-
-    def es_vacia(self):
-        """ Devuelve True si la lista está vacía, False si no. """
-        return self.items == []
-
-
 # Validación de campos
 class Validacion:
 
@@ -71,6 +48,11 @@ class Validacion:
             raise ValueError(f'El primer apellido debe tener como mínimo 2 caractares y un máximo de 50 caracteres, tamaño actual: {len(dato)}')
         return True
 
+    def validarTipo(self, dato):
+        if dato not in TIPOS_PARTICIPANTE:
+            raise ValueError(f'El tipo debe ser {" o ".join(TIPOS_PARTICIPANTE)}, valor actual: {dato or "vacío"}')
+        return True
+
 
 # Menú de opciones
 class Menu:
@@ -80,11 +62,1570 @@ class Menu:
         self.titulo = "" # Título del menú
         self.listaOpciones = dict() # Diccionario con opciones
     
+# Contador de conceptos periódicos
+class ContadorConceptos:
+    ''' Agrupa los movimientos periódicos por (concepto, frecuencia) a medida
+        que se cargan, contando cuántos hay y el número máximo de períodos
+        transcurridos. '''
+
+    def __init__(self):
+        self.conceptos = dict() # (concepto, frecuencia): {"CUENTA": int, "PENDIENTES": int}
+
+    def agregar(self, concepto, frecuencia, periodos):
+        ''' Suma un movimiento periódico al contador. '''
+        datos = self.conceptos.get((concepto, frecuencia))
+        if datos is None:
+            self.conceptos[(concepto, frecuencia)] = {"CUENTA": 1, "PENDIENTES": periodos}
+        else:
+            datos["CUENTA"] += 1
+            datos["PENDIENTES"] = max(datos["PENDIENTES"], periodos)
+
+    def distintos(self):
+        ''' Conceptos cuyo número de movimientos no coincide con los períodos transcurridos. '''
+        return {
+            clave: dict(datos) for clave, datos in self.conceptos.items()
+            if datos["CUENTA"] != datos["PENDIENTES"]
+        }
+
+
+# Instantánea de una cuenta
+class InstantaneaCuenta:
+    ''' Estado calculado de una cuenta a partir de sus movimientos: gestiones
+        que quedan esta semana y movimientos periódicos por concepto. Guarda
+        solo los contadores y los id ya incluidos (la marca de agua), no los
+        registros, para que al volver a calcularla solo haya que traer los
+        movimientos nuevos sin retener todos en memoria. '''
+
+    def __init__(self, idCuenta):
+        self.idCuenta = idCuenta
+        self.periodo = periodoActual() # Semana y mes en que se calcula
+        # Número máximo de gestiones disponibles esta semana
+        # Grandes, 2; Medianas, 4; Pequeñas, 8
+        self.gestionabilidad = {
+            "GRANDE": int(2),
+            "MEDIANA": int(4),
+            "PEQUEÑA": int(8),
+        }
+        self.periodicos = ContadorConceptos()
+        self.vistos = set() # id de los movimientos ya incluidos
+
+    def vigente(self, listaMovimientos):
+        ''' La instantánea sirve si no ha cambiado la semana ni el mes (los campos
+            MISMA-SEMANA y TIEMPO-DESDE-MOVIMIENTO dependen de la fecha) y no se
+            ha borrado ninguno de los movimientos incluidos. '''
+        return self.periodo == periodoActual() and self.vistos.issubset(listaMovimientos)
+
+    def agregar(self, registro):
+        ''' Incluye un movimiento en la instantánea. '''
+        self.vistos.add(registro["id"])
+
+        try:
+            # Calcular número de gestiones que queda en la semana
+            # (los periódicos, como la MENSUALIDAD, no tienen gestión)
+            if registro["fields"].get("MISMA-SEMANA") == 1:
+                gestion = (registro["fields"].get("GESTIÓN") or [None])[0]
+                if gestion in self.gestionabilidad:
+                    self.gestionabilidad[gestion] -= 1
+
+            frec = registro["fields"].get("FRECUENCIA")[0]
+            concepto = registro["fields"].get("CONCEPTO-LITERAL")[0]
+            numPeriodos = int(registro["fields"].get("TIEMPO-DESDE-MOVIMIENTO"))
+
+            # Contar movimientos periódicos registrados mientras se cargan
+            if frec:
+                self.periodicos.agregar(concepto, frec, numPeriodos)
+
+        except TypeError:
+            pass
+
+
+# Índice de registros
+class IndiceTabla:
+    ''' Índice hash de los registros de una tabla por uno o varios campos.
+        Las búsquedas por valor son O(1) y el índice se actualiza al añadir
+        o quitar registros. '''
+
+    def __init__(self, registros, campos):
+        self.campos = list(campos)
+        self.registros = dict() # id: registro
+        self.valores = {campo: dict() for campo in self.campos} # campo: {valor: [id]}
+        for registro in registros:
+            self.anadir(registro)
+
+    def claves(self, valor):
+        ''' Valores indexables de un campo, uno por elemento si es una lista. '''
+        if valor is None:
+            return []
+        elif type(valor) == type(list()):
+            return [v for v in valor if not isinstance(v, (list, dict))]
+        else:
+            return [valor]
+
+    def anadir(self, registro):
+        ''' Añade o sustituye un registro en el índice. '''
+        self.quitar(registro["id"])
+        self.registros[registro["id"]] = registro
+        for campo in self.campos:
+            for valor in self.claves(registro["fields"].get(campo)):
+                self.valores[campo].setdefault(valor, []).append(registro["id"])
+
+    def quitar(self, idReg):
+        ''' Quita un registro del índice si está. '''
+        registro = self.registros.pop(idReg, None)
+        if not registro:
+            return
+        for campo in self.campos:
+            for valor in self.claves(registro["fields"].get(campo)):
+                ids = self.valores[campo].get(valor, [])
+                if idReg in ids:
+                    ids.remove(idReg)
+                if not ids:
+                    self.valores[campo].pop(valor, None)
+
+    def buscar(self, campo, dato):
+        ''' Lista con los id de los registros que tienen el dato en el campo. '''
+        return list(self.valores[campo].get(dato, []))
+
+    def registro(self, idReg):
+        ''' Registro indexado con ese id o None. '''
+        return self.registros.get(idReg)
+
+
+# Tabla con caché de lectura
+class TablaEnCache:
+    ''' Envuelve una tabla de Airtable y guarda en memoria los resultados
+        de get y all durante ttl segundos, con expulsión LRU cuando se
+        supera la capacidad. Las escrituras invalidan las entradas
+        afectadas y las de las tablas dependientes. Se puede usar desde
+        varios hilos a la vez. '''
+
+    def __init__(self, tabla, nombre, ttl=0, capacidad=256):
+        self.tabla = tabla
+        self.nombre = nombre
+        self.ttl = ttl # Segundos de validez, 0 desactiva la caché
+        self.capacidad = capacidad # Número máximo de entradas
+        self.entradas = OrderedDict() # clave: (instante, datos)
+        self.dependientes = [] # Tablas a invalidar al escribir en esta
+        self.indices = dict() # tuple(campos): (instante, IndiceTabla)
+        self.cerrojo = threading.RLock()
+
+    def __getattr__(self, nombre):
+        # Resto de métodos (iterate, first...) sin caché
+        return getattr(self.tabla, nombre)
+
+    def leer(self, clave):
+        ''' Devuelve una copia de la entrada si sigue vigente, None si no. '''
+        with self.cerrojo:
+            if self.ttl <= 0 or clave not in self.entradas:
+                return None
+            instante, datos = self.entradas[clave]
+            if time.monotonic() - instante > self.ttl:
+                del self.entradas[clave]
+                return None
+            self.entradas.move_to_end(clave)
+        return copy.deepcopy(datos)
+
+    def guardar(self, clave, datos):
+        ''' Guarda una copia de los datos y expulsa la entrada más antigua si no caben. '''
+        if self.ttl <= 0:
+            return
+        datos = copy.deepcopy(datos)
+        with self.cerrojo:
+            self.entradas[clave] = (time.monotonic(), datos)
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+
+    def buscarEnCache(self, idReg):
+        ''' Devuelve el registro completo guardado con ese id o None. '''
+        return self.leer(("get", idReg))
+
+    def guardarEnCache(self, registro):
+        ''' Guarda un registro completo para servir futuras lecturas por id. '''
+        self.guardar(("get", registro["id"]), registro)
+
+    def invalidar(self, idReg=None):
+        ''' Borra las consultas guardadas y, si se indica, el registro idReg.
+            Sin idReg borra todas las entradas. '''
+        with self.cerrojo:
+            if idReg is None:
+                self.entradas.clear()
+            else:
+                for clave in [c for c in self.entradas if c[0] != "get" or c[1] == idReg]:
+                    del self.entradas[clave]
+        # Fuera del cerrojo propio, para no bloquear dos tablas que dependan entre sí
+        for tabla in self.dependientes:
+            with tabla.cerrojo:
+                tabla.entradas.clear()
+                tabla.indices.clear()
+
+    def indice(self, campos):
+        ''' Devuelve un IndiceTabla de la tabla por los campos indicados.
+            Se construye con una sola consulta y se reutiliza mientras dure
+            el ttl; las escrituras posteriores lo mantienen al día. '''
+        clave = tuple(campos)
+        with self.cerrojo:
+            if clave in self.indices:
+                instante, indice = self.indices[clave]
+                if time.monotonic() - instante <= self.ttl:
+                    return indice
+        indice = IndiceTabla(self.all(fields=list(campos)), campos)
+        with self.cerrojo:
+            self.indices[clave] = (time.monotonic(), indice)
+        return indice
+
+    def actualizarIndices(self, registros=(), borrados=()):
+        ''' Añade los registros escritos y quita los borrados de los índices. '''
+        with self.cerrojo:
+            for instante, indice in self.indices.values():
+                for registro in registros:
+                    indice.anadir(registro)
+                for idReg in borrados:
+                    indice.quitar(idReg)
+
+    def get(self, record_id, **options):
+        clave = ("get", record_id) if not options else ("get", record_id, repr(sorted(options.items())))
+        registro = self.leer(clave)
+        if registro is None:
+            registro = self.tabla.get(record_id, **options)
+            self.guardar(clave, registro)
+        return registro
+
+    def all(self, **options):
+        clave = ("all", repr(sorted(options.items())))
+        registros = self.leer(clave)
+        if registros is None:
+            registros = self.tabla.all(**options)
+            self.guardar(clave, registros)
+            if not options.get("fields"):
+                for registro in registros:
+                    self.guardarEnCache(registro)
+        return registros
+
+    def create(self, fields, **options):
+        registro = self.tabla.create(fields, **options)
+        self.invalidar(registro["id"])
+        self.actualizarIndices(registros=[registro])
+        return registro
+
+    def batch_create(self, records, **options):
+        registros = self.tabla.batch_create(records, **options)
+        self.invalidar()
+        self.actualizarIndices(registros=registros)
+        return registros
+
+    def update(self, record_id, fields, **options):
+        registro = self.tabla.update(record_id, fields, **options)
+        self.invalidar(record_id)
+        self.actualizarIndices(registros=[registro])
+        return registro
+
+    def batch_update(self, records, **options):
+        registros = self.tabla.batch_update(records, **options)
+        self.invalidar()
+        self.actualizarIndices(registros=registros)
+        return registros
+
+    def delete(self, record_id):
+        resultado = self.tabla.delete(record_id)
+        self.invalidar(record_id)
+        self.actualizarIndices(borrados=[record_id])
+        return resultado
+
+    def batch_delete(self, record_ids):
+        resultado = self.tabla.batch_delete(record_ids)
+        self.invalidar()
+        self.actualizarIndices(borrados=[r["id"] for r in resultado if r.get("deleted")])
+        return resultado
+
+
+# Métricas de las peticiones
+class Metricas:
+    ''' Acumula, por acción del menú, tabla y método, el número de llamadas,
+        los errores, un histograma de latencias y los bytes enviados y
+        recibidos. La acción activa es propia de cada hilo. '''
+
+    def __init__(self):
+        self.inicio = time.time()
+        self.datos = dict() # (acción, tabla, método): dict
+        self.cerrojo = threading.Lock()
+        self.local = threading.local()
+
+    def accionActual(self):
+        accion = getattr(self.local, "accion", None)
+        if accion:
+            return accion
+        if threading.current_thread() is threading.main_thread():
+            return "sesión"
+        return threading.current_thread().name
+
+    @contextlib.contextmanager
+    def enAccion(self, accion):
+        ''' Atribuye a la acción las llamadas que se hagan dentro del bloque. '''
+        anterior = getattr(self.local, "accion", None)
+        self.local.accion = accion
+        try:
+            yield
+        finally:
+            self.local.accion = anterior
+
+    def anotar(self, tabla, metodo, segundos, enviados, recibidos, error=None):
+        clave = (self.accionActual(), tabla, metodo)
+        with self.cerrojo:
+            datos = self.datos.get(clave)
+            if datos is None:
+                datos = {
+                    "llamadas": 0, "errores": 0, "tiposError": dict(), "segundos": 0.0, "maximo": 0.0,
+                    "enviados": 0, "recibidos": 0, "histograma": [0] * (len(LIMITES_LATENCIA) + 1),
+                }
+                self.datos[clave] = datos
+            datos["llamadas"] += 1
+            datos["segundos"] += segundos
+            datos["maximo"] = max(datos["maximo"], segundos)
+            datos["enviados"] += enviados
+            datos["recibidos"] += recibidos
+            datos["histograma"][bisect.bisect_left(LIMITES_LATENCIA, segundos)] += 1
+            if error is not None:
+                datos["errores"] += 1
+                tipo = describirError(error)
+                datos["tiposError"][tipo] = datos["tiposError"].get(tipo, 0) + 1
+
+    def resumen(self):
+        ''' Métricas en una lista ordenada por acción y número de llamadas. '''
+        with self.cerrojo:
+            filas = [
+                {"accion": accion, "tabla": tabla, "metodo": metodo, **copy.deepcopy(datos)}
+                for (accion, tabla, metodo), datos in self.datos.items()
+            ]
+        for fila in filas:
+            fila["histograma"] = {
+                etiqueta: n for etiqueta, n in zip(
+                    [f"<={limite}s" for limite in LIMITES_LATENCIA] + [f">{LIMITES_LATENCIA[-1]}s"],
+                    fila["histograma"],
+                )
+            }
+        return sorted(filas, key=lambda f: (f["accion"], -f["llamadas"]))
+
+    def volcar(self, ruta, extra=None):
+        ''' Guarda las métricas de la sesión, y las secciones de extra, en un fichero JSON. '''
+        inicio = datetime.datetime.fromtimestamp(self.inicio, datetime.timezone.utc)
+        informe = {"inicio": marcaDeTiempo(inicio), "fin": marcaDeTiempo(), "metricas": self.resumen(), **(extra or dict())}
+        with open(ruta, "w", encoding="utf-8") as fichero:
+            json.dump(informe, fichero, ensure_ascii=False, indent=2)
+
+
+# Tabla con métricas
+class TablaInstrumentada:
+    ''' Envuelve una tabla y anota en las métricas cada llamada a sus métodos
+        de METODOS_ALMACEN: latencia, bytes enviados y recibidos y errores. '''
+
+    def __init__(self, tabla, nombre, metricas):
+        self.tabla = tabla
+        self.nombre = nombre
+        self.metricas = metricas
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self.tabla, nombre)
+        if nombre not in METODOS_ALMACEN:
+            return metodo
+        if nombre == "iterate":
+            return functools.partial(self.paginas, metodo)
+        return functools.partial(self.llamar, nombre, metodo)
+
+    def llamar(self, nombreMetodo, metodo, *args, **kwargs):
+        enviados = tamanoJson([args, kwargs])
+        inicio = time.perf_counter()
+        try:
+            resultado = metodo(*args, **kwargs)
+        except Exception as error:
+            self.metricas.anotar(self.nombre, nombreMetodo, time.perf_counter() - inicio, enviados, 0, error)
+            raise
+        self.metricas.anotar(self.nombre, nombreMetodo, time.perf_counter() - inicio, enviados, tamanoJson(resultado))
+        return resultado
+
+    def paginas(self, metodo, *args, **kwargs):
+        # Cada página de iterate es una petición
+        enviados = tamanoJson([args, kwargs])
+        paginas = metodo(*args, **kwargs)
+        while True:
+            inicio = time.perf_counter()
+            try:
+                pagina = next(paginas)
+            except StopIteration:
+                return
+            except Exception as error:
+                self.metricas.anotar(self.nombre, "iterate", time.perf_counter() - inicio, enviados, 0, error)
+                raise
+            self.metricas.anotar(self.nombre, "iterate", time.perf_counter() - inicio, enviados, tamanoJson(pagina))
+            yield pagina
+
+
+# Planificador de peticiones
+class Planificador:
+    ''' Reparte las peticiones a Airtable con un cubo de fichas (5 por segundo
+        por base) y repite con espera exponencial y aleatoria las que reciben
+        429 o un error 5xx. Las escrituras solo se repiten tras un 429: con un
+        5xx Airtable puede haberlas guardado ya. Tras un 429 todos los hilos
+        esperan. Lleva la cuenta de las peticiones en cola para las métricas. '''
+
+    def __init__(self, tasa=5, rafaga=5):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.fichas = rafaga
+        self.ultimo = time.monotonic()
+        self.pausaHasta = 0.0
+        self.cerrojo = threading.Lock()
+        self.enCola = 0
+        self.colaMaxima = 0
+        self.peticiones = 0
+        self.esperas = 0
+        self.segundosEsperando = 0.0
+        self.reintentos = 0
+        self.limitesDeTasa = 0
+
+    def ajustar(self, tasa, rafaga):
+        with self.cerrojo:
+            self.tasa = tasa
+            self.rafaga = rafaga
+            self.fichas = min(self.fichas, rafaga)
+
+    def tomarFicha(self):
+        ''' Espera hasta que haya una ficha libre y la gasta. '''
+        with self.cerrojo:
+            self.enCola += 1
+            self.colaMaxima = max(self.colaMaxima, self.enCola)
+        try:
+            while True:
+                with self.cerrojo:
+                    ahora = time.monotonic()
+                    self.fichas = min(self.rafaga, self.fichas + (ahora - self.ultimo) * self.tasa)
+                    self.ultimo = ahora
+                    espera = self.pausaHasta - ahora
+                    if espera <= 0:
+                        if self.fichas >= 1:
+                            self.fichas -= 1
+                            self.peticiones += 1
+                            return
+                        espera = (1 - self.fichas) / self.tasa
+                    self.esperas += 1
+                    self.segundosEsperando += espera
+                time.sleep(espera)
+        finally:
+            with self.cerrojo:
+                self.enCola -= 1
+
+    def ejecutar(self, operacion, *args, escritura=False, **kwargs):
+        for intento in range(REINTENTOS + 1):
+            self.tomarFicha()
+            try:
+                return operacion(*args, **kwargs)
+            except Exception as error:
+                if intento == REINTENTOS or not esReintentable(error, escritura):
+                    raise
+                espera = min(ESPERA_MAXIMA, ESPERA_INICIAL * 2 ** intento) * random.uniform(0.5, 1.5)
+                with self.cerrojo:
+                    self.reintentos += 1
+                    if esLimiteDeTasa(error):
+                        # Airtable bloquea la base entera: paran todos los hilos
+                        self.limitesDeTasa += 1
+                        self.pausaHasta = max(self.pausaHasta, time.monotonic() + espera)
+                time.sleep(espera)
+
+    def estado(self):
+        ''' Situación de la cola para las métricas. '''
+        with self.cerrojo:
+            return {
+                "peticiones": self.peticiones,
+                "enCola": self.enCola,
+                "colaMaxima": self.colaMaxima,
+                "esperas": self.esperas,
+                "segundosEsperando": round(self.segundosEsperando, 3),
+                "reintentos": self.reintentos,
+                "limitesDeTasa": self.limitesDeTasa,
+            }
+
+
+# Tabla planificada
+class TablaPlanificada:
+    ''' Envuelve una tabla para que cada llamada a sus métodos de METODOS_ALMACEN
+        pase por el planificador. Cada página de iterate gasta una ficha, pero
+        no se repite: volver a pedirla obligaría a empezar de nuevo. '''
+
+    def __init__(self, tabla, planificador):
+        self.tabla = tabla
+        self.planificador = planificador
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self.tabla, nombre)
+        if nombre not in METODOS_ALMACEN:
+            return metodo
+        if nombre == "iterate":
+            return functools.partial(self.paginas, metodo)
+        return functools.partial(self.planificador.ejecutar, metodo, escritura=nombre in METODOS_ESCRITURA)
+
+    def paginas(self, metodo, *args, **kwargs):
+        self.planificador.tomarFicha()
+        paginas = metodo(*args, **kwargs)
+        while True:
+            try:
+                pagina = next(paginas)
+            except StopIteration:
+                return
+            yield pagina
+            self.planificador.tomarFicha()
+
+
+# Precarga de catálogos
+class PrecargaCatalogo:
+    ''' Trae en segundo plano los productos de cada comercio mientras se
+        elige uno. Las peticiones pasan por las tablas recibidas, así que lo
+        traído queda también en su caché. Solo se precargan comercios
+        mientras el total de productos no pase de la capacidad, y lo que no
+        se ha empezado a traer se puede cancelar. '''
+
+    def __init__(self, tablas, comercios, capacidad, hilos):
+        self.tablas = tablas
+        self.futuros = dict() # id del comercio: Future
+        self.grupo = concurrent.futures.ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="precarga")
+        accion = metricas.accionActual()
+        total = 0
+        for regComercio in comercios:
+            productos = len(regComercio["fields"].get("PRODUCTOS-SERVICIOS") or [])
+            if not productos:
+                continue
+            if total + productos > capacidad:
+                break
+            total += productos
+            self.futuros[regComercio["id"]] = self.grupo.submit(self.traer, accion, regComercio)
+
+    def traer(self, accion, regComercio):
+        with metricas.enAccion(accion):
+            return cargarCatalogo(self.tablas, regComercio)
+
+    def cancelar(self):
+        ''' Descarta los comercios que aún no se han empezado a traer. '''
+        self.grupo.shutdown(wait=False, cancel_futures=True)
+
+    def catalogo(self, regComercio):
+        ''' Productos del comercio: los precargados, esperando si se están
+            trayendo, o pedidos en el momento si no se llegaron a pedir. '''
+        futuro = self.futuros.pop(regComercio["id"], None)
+        if futuro is not None and not futuro.cancel():
+            try:
+                return futuro.result()
+            except concurrent.futures.CancelledError:
+                pass
+        return cargarCatalogo(self.tablas, regComercio)
+
+
+# Espejo local de la base de datos
+class EspejoLocal:
+    ''' Copia local en SQLite de las tablas de Airtable. Las lecturas se
+        hacen sobre la copia; las escrituras se aplican en la copia (con
+        sus enlaces contrarios y campos calculados, como en BaseMemoria), se
+        apuntan en un diario y un hilo en segundo plano las envía a Airtable.
+        Antes de enviar una modificación o un borrado se compara la marca de
+        modificación del registro remoto con la que tenía al editarlo: si
+        no coinciden, la entrada queda en CONFLICTO y gana la versión remota.
+        Lo que Airtable rechaza queda en ERROR y se avisa con tomarAvisos. '''
+
+    def __init__(self, ruta, tablasRemotas, campoModificado="", intervalo=30, intervaloDescarga=300):
+        import sqlite3
+
+        self.tablasRemotas = tablasRemotas # nombre: Table
+        self.campoModificado = campoModificado # Campo LAST_MODIFIED_TIME() de Airtable
+        self.intervalo = intervalo # Segundos entre envíos del diario
+        self.intervaloDescarga = intervaloDescarga # Segundos entre descargas completas
+        self.ultimaDescarga = 0
+        self.enLinea = False
+        self.cerrojo = threading.RLock()
+        self.aviso = threading.Event()
+        self.enviado = threading.Condition(self.cerrojo)
+        self.hilo = None
+        self.parar = False
+        self.calculos = CalculosEspejo(self)
+        self.avisos = [] # Escrituras rechazadas por Airtable sin comunicar
+        self.rechazos = dict() # num del diario: error con el que Airtable la ha rechazado
+
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        with self.cerrojo, self.conexion:
+            self.conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS registros (
+                    tabla TEXT, id TEXT, creado TEXT, modificado TEXT, campos TEXT,
+                    PRIMARY KEY (tabla, id));
+                CREATE TABLE IF NOT EXISTS diario (
+                    num INTEGER PRIMARY KEY AUTOINCREMENT, tabla TEXT, operacion TEXT,
+                    id TEXT, campos TEXT, modificado TEXT, estado TEXT DEFAULT 'PENDIENTE');
+                CREATE TABLE IF NOT EXISTS equivalencias (
+                    local TEXT PRIMARY KEY, remoto TEXT);
+            """)
+
+    def marcaModificacion(self, registro):
+        ''' Marca de modificación de un registro remoto (campo campoModificado). '''
+        return registro["fields"].get(self.campoModificado, "")
+
+    def tablasSinMarca(self):
+        ''' Tablas de la copia con registros de Airtable que no traen el campo
+            campoModificado, sin el que no se pueden detectar conflictos. '''
+        return [
+            tabla for tabla in self.tablasRemotas
+            if any(
+                not registro["id"].startswith("loc") and self.campoModificado not in registro["fields"]
+                for registro in self.leerTabla(tabla)
+            )
+        ]
+
+    def vacio(self):
+        ''' True si todavía no se ha descargado ninguna tabla. '''
+        with self.cerrojo:
+            return self.conexion.execute("SELECT COUNT(*) FROM registros").fetchone()[0] == 0
+
+    def guardarRegistro(self, tabla, registro, modificado=None):
+        ''' Escribe un registro en la copia local. '''
+        with self.cerrojo, self.conexion:
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO registros VALUES (?, ?, ?, ?, ?)",
+                (tabla, registro["id"], registro.get("createdTime", ""),
+                 modificado if modificado is not None else self.marcaModificacion(registro),
+                 json.dumps(registro["fields"])),
+            )
+
+    def leerRegistro(self, tabla, idReg):
+        ''' Registro de la copia local con su marca de modificación, o (None, None). '''
+        with self.cerrojo:
+            fila = self.conexion.execute(
+                "SELECT id, creado, modificado, campos FROM registros WHERE tabla = ? AND id = ?",
+                (tabla, idReg),
+            ).fetchone()
+        if not fila:
+            return (None, None)
+        return ({"id": fila[0], "createdTime": fila[1], "fields": json.loads(fila[3])}, fila[2])
+
+    def leerTabla(self, tabla):
+        ''' Todos los registros de una tabla de la copia local. '''
+        with self.cerrojo:
+            filas = self.conexion.execute(
+                "SELECT id, creado, campos FROM registros WHERE tabla = ? ORDER BY rowid", (tabla,)
+            ).fetchall()
+        return [{"id": f[0], "createdTime": f[1], "fields": json.loads(f[2])} for f in filas]
+
+    def borrarRegistro(self, tabla, idReg):
+        with self.cerrojo, self.conexion:
+            self.conexion.execute("DELETE FROM registros WHERE tabla = ? AND id = ?", (tabla, idReg))
+
+    def cambiarEnlace(self, tabla, idReg, campo, idEnlazado, quitar=False):
+        ''' Añade (o quita) idEnlazado en un campo enlazado de un registro de la copia. '''
+        with self.cerrojo:
+            registro, modificado = self.leerRegistro(tabla, self.idRemoto(idReg))
+            if not registro:
+                return
+            actuales = [i for i in registro["fields"].get(campo) or [] if i != idEnlazado]
+            if not quitar:
+                actuales.append(idEnlazado)
+            if actuales:
+                registro["fields"][campo] = actuales
+            else:
+                registro["fields"].pop(campo, None)
+            self.guardarRegistro(tabla, registro, modificado)
+
+    def aplicarEnlaces(self, tabla, idReg, antes, despues):
+        ''' Hace en la copia lo que haría Airtable al escribir un registro:
+            actualiza los campos contrarios de los enlaces que cambian y
+            recalcula los campos calculados del registro y, mientras cambien,
+            los de los registros que dependen de él (cuenta, personaje,
+            participante...). antes y despues son los campos del registro;
+            None si no existía o se ha borrado. '''
+        antes = antes or dict()
+        cola = [(tabla, idReg)] if despues is not None else []
+        with self.cerrojo:
+            for (origen, campo), (destino, inverso) in self.calculos.enlaces.items():
+                if origen != tabla:
+                    continue
+                viejos = antes.get(campo) or []
+                nuevos = (despues or dict()).get(campo) or []
+                for idEnlazado in viejos:
+                    if idEnlazado not in nuevos:
+                        self.cambiarEnlace(destino, idEnlazado, inverso, idReg, quitar=True)
+                        cola.append((destino, self.idRemoto(idEnlazado)))
+                for idEnlazado in nuevos:
+                    if idEnlazado not in viejos:
+                        self.cambiarEnlace(destino, idEnlazado, inverso, idReg)
+                        cola.append((destino, self.idRemoto(idEnlazado)))
+
+            vistos = set()
+            while cola:
+                clave = cola.pop(0)
+                if clave in vistos:
+                    continue
+                vistos.add(clave)
+                registro, modificado = self.leerRegistro(*clave)
+                if not registro:
+                    continue
+                campos = self.calculos.campos(clave[0], registro)
+                if campos == registro["fields"] and clave != (tabla, idReg):
+                    continue
+                registro["fields"] = campos
+                self.guardarRegistro(clave[0], registro, modificado)
+                for (dependiente, enlace) in DEPENDENCIAS_MEMORIA:
+                    destino, contrario = self.calculos.enlaces[(dependiente, enlace)]
+                    if destino == clave[0]:
+                        cola += [(dependiente, i) for i in campos.get(contrario) or []]
+
+    def apuntar(self, tabla, operacion, idReg, campos, modificado):
+        ''' Añade una escritura al diario y avisa al hilo de sincronización.
+            Retorna: número de la entrada del diario. '''
+        with self.cerrojo, self.conexion:
+            cursor = self.conexion.execute(
+                "INSERT INTO diario (tabla, operacion, id, campos, modificado) VALUES (?, ?, ?, ?, ?)",
+                (tabla, operacion, idReg, json.dumps(campos), modificado),
+            )
+        self.aviso.set()
+        return cursor.lastrowid
+
+    def idRemoto(self, idReg):
+        ''' Traduce un id provisional local al id que le ha dado Airtable. '''
+        with self.cerrojo:
+            fila = self.conexion.execute("SELECT remoto FROM equivalencias WHERE local = ?", (idReg,)).fetchone()
+        return fila[0] if fila else idReg
+
+    def traducirCampos(self, campos):
+        ''' Sustituye los id provisionales de los campos enlazados por los remotos. '''
+        traducidos = dict()
+        for campo, valor in campos.items():
+            if type(valor) == type(list()):
+                valor = [self.idRemoto(v) if isinstance(v, str) and v.startswith("loc") else v for v in valor]
+            traducidos[campo] = valor
+        return traducidos
+
+    def esperar(self, num, segundos):
+        ''' Espera a que se envíe la entrada num del diario como mucho los segundos indicados.
+            Retorna: id remoto si se ha enviado, None si no. '''
+        limite = time.monotonic() + segundos
+        with self.enviado:
+            while True:
+                fila = self.conexion.execute("SELECT estado, id FROM diario WHERE num = ?", (num,)).fetchone()
+                if fila[0] != "PENDIENTE":
+                    return self.idRemoto(fila[1]) if fila[0] == "ENVIADO" else None
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return None
+                self.enviado.wait(restante)
+
+    def pendientes(self):
+        ''' Entradas del diario que faltan por enviar. '''
+        with self.cerrojo:
+            return self.conexion.execute(
+                "SELECT num, tabla, operacion, id, campos, modificado FROM diario WHERE estado = 'PENDIENTE' ORDER BY num"
+            ).fetchall()
+
+    def conflictos(self):
+        ''' Entradas del diario que no se han enviado por conflicto con Airtable
+            o porque Airtable las ha rechazado. '''
+        with self.cerrojo:
+            return self.conexion.execute(
+                "SELECT num, tabla, operacion, id FROM diario WHERE estado IN ('CONFLICTO', 'ERROR') ORDER BY num"
+            ).fetchall()
+
+    def marcar(self, num, estado):
+        with self.enviado, self.conexion:
+            self.conexion.execute("UPDATE diario SET estado = ? WHERE num = ?", (estado, num))
+            self.enviado.notify_all()
+
+    def fallar(self, entrada, motivo):
+        ''' Deja en ERROR una entrada del diario que Airtable ha rechazado y
+            lo apunta en los avisos. Si era una creación, quita de la copia los
+            registros provisionales y deja también en ERROR las entradas
+            pendientes que los usan, que ya no se podrían enviar. Todo se hace
+            con el cerrojo para que esperar no vea la entrada en ERROR con sus
+            registros todavía en la copia. '''
+        num, tabla, operacion, idReg, campos, modificado = entrada
+        verbos = {
+            "create": "crear un registro",
+            "batch_create": "crear un lote de registros",
+            "update": "modificar un registro",
+            "delete": "borrar un registro",
+        }
+        with self.cerrojo:
+            self.marcar(num, "ERROR")
+            self.avisos.append(f"No se ha podido {verbos[operacion]} de {tabla} en Airtable ({motivo}).")
+            idsLocales = self.idsCreados(entrada)
+            for idLocal in idsLocales:
+                registro, marca = self.leerRegistro(tabla, idLocal)
+                if registro:
+                    self.borrarRegistro(tabla, idLocal)
+                    self.aplicarEnlaces(tabla, idLocal, registro["fields"], None)
+            # Se relee el diario porque cada llamada puede dejar otras entradas en ERROR
+            while True:
+                dependientes = [
+                    (d, idLocal) for d in self.pendientes() for idLocal in idsLocales
+                    if idLocal in d[3] or idLocal in d[4]
+                ]
+                if not dependientes:
+                    return
+                dependiente, idLocal = dependientes[0]
+                self.fallar(dependiente, f"usa el registro {idLocal} de {tabla}, que no se ha creado")
+
+    def idsCreados(self, entrada):
+        ''' Ids provisionales de los registros que crea una entrada del diario. '''
+        num, tabla, operacion, idReg, campos, modificado = entrada
+        if operacion == "create":
+            return [idReg]
+        if operacion == "batch_create":
+            return json.loads(idReg)
+        return []
+
+    def tomarAvisos(self):
+        ''' Retorna los avisos de escrituras rechazadas y los olvida. '''
+        with self.cerrojo:
+            avisos, self.avisos = self.avisos, []
+        return avisos
+
+    def refrescarEnlazados(self, campos):
+        ''' Vuelve a leer de Airtable los registros enlazados desde los campos
+            indicados, para que sus campos calculados y enlaces inversos
+            reflejen la escritura recién enviada. '''
+        for valor in campos.values():
+            if type(valor) != type(list()):
+                continue
+            for idReg in valor:
+                if not isinstance(idReg, str) or not idReg.startswith("rec"):
+                    continue
+                with self.cerrojo:
+                    fila = self.conexion.execute("SELECT tabla FROM registros WHERE id = ?", (idReg,)).fetchone()
+                try:
+                    if fila:
+                        self.guardarRegistro(fila[0], self.tablasRemotas[fila[0]].get(idReg))
+                except Exception:
+                    # Se corregirá en la siguiente descarga completa
+                    pass
+
+    def enviarEntrada(self, entrada):
+        ''' Envía a Airtable una entrada del diario. Los errores de conexión se
+            propagan para reintentar más tarde. '''
+        num, tabla, operacion, idReg, campos, modificado = entrada
+        remota = self.tablasRemotas[tabla]
+
+        if operacion in ("create", "batch_create"):
+            lote = json.loads(campos)
+            if operacion == "create":
+                lote = [lote]
+            lote = [self.traducirCampos(c) for c in lote]
+            # Un lote va en un solo batch_create: Airtable lo crea entero o nada
+            if operacion == "batch_create":
+                registros = remota.batch_create(lote)
+            else:
+                registros = [remota.create(lote[0])]
+            idsLocales = self.idsCreados(entrada)
+            with self.cerrojo, self.conexion:
+                self.conexion.executemany(
+                    "INSERT OR REPLACE INTO equivalencias VALUES (?, ?)",
+                    [(idLocal, registro["id"]) for idLocal, registro in zip(idsLocales, registros)],
+                )
+            for idLocal, registro in zip(idsLocales, registros):
+                self.borrarRegistro(tabla, idLocal)
+                self.guardarRegistro(tabla, registro)
+            self.marcar(num, "ENVIADO")
+            for campos in lote:
+                self.refrescarEnlazados(campos)
+            return
+
+        campos = self.traducirCampos(json.loads(campos))
+
+        idReg = self.idRemoto(idReg)
+
+        # Detección de conflictos por id y marca de modificación
+        if not idReg.startswith("loc") and modificado:
+            actual = remota.get(idReg)
+            if self.marcaModificacion(actual) != modificado:
+                self.guardarRegistro(tabla, actual)
+                self.marcar(num, "CONFLICTO")
+                return
+
+        if operacion == "update":
+            registro = remota.update(idReg, campos)
+            self.guardarRegistro(tabla, registro)
+            # Las siguientes modificaciones del mismo registro parten de esta
+            with self.cerrojo, self.conexion:
+                self.conexion.execute(
+                    "UPDATE diario SET modificado = ? WHERE id = ? AND num > ? AND estado = 'PENDIENTE'",
+                    (self.marcaModificacion(registro), idReg, num),
+                )
+        elif operacion == "delete":
+            remota.delete(idReg)
+        self.marcar(num, "ENVIADO")
+        self.refrescarEnlazados(campos)
+
+    def enviarDiario(self):
+        ''' Envía las entradas pendientes en orden; se detiene si se pierde la
+            conexión o Airtable no está disponible (429, o 5xx salvo en las
+            creaciones). Las demás entradas que fallan quedan en ERROR, con las
+            que dependen de ellas, para no bloquear las siguientes. '''
+        while True:
+            # Se relee el diario porque fallar puede dejar otras entradas en ERROR
+            pendientes = self.pendientes()
+            if not pendientes:
+                return
+            entrada = pendientes[0]
+            try:
+                self.enviarEntrada(entrada)
+                self.enLinea = True
+            except Exception as error:
+                if esErrorDeConexion(error):
+                    # Sin conexión: se reintenta en el siguiente ciclo
+                    self.enLinea = False
+                    return
+                # Una modificación repetida se detecta por su marca; una
+                # creación que recibe un 5xx puede estar ya en Airtable
+                if esReintentable(error, escritura=entrada[2] in ("create", "batch_create")):
+                    return
+                self.rechazos[entrada[0]] = error
+                self.fallar(entrada, describirError(error))
+
+    def descargar(self):
+        ''' Descarga todas las tablas de Airtable sin pisar los registros que
+            tienen escrituras pendientes en el diario. '''
+        for tabla, remota in self.tablasRemotas.items():
+            try:
+                registros = remota.all()
+                self.enLinea = True
+            except Exception as error:
+                # Se vuelve a intentar en el siguiente ciclo
+                if esErrorDeConexion(error):
+                    self.enLinea = False
+                return
+            with self.cerrojo:
+                conPendientes = {fila[3] for fila in self.pendientes() if fila[1] == tabla}
+                with self.conexion:
+                    self.conexion.execute(
+                        "DELETE FROM registros WHERE tabla = ? AND id NOT LIKE 'loc%'", (tabla,)
+                    )
+                for registro in registros:
+                    if registro["id"] not in conPendientes:
+                        self.guardarRegistro(tabla, registro)
+        # Los registros descargados aún no enlazan lo creado sin enviar
+        for entrada in self.pendientes():
+            for idLocal in self.idsCreados(entrada):
+                registro, marca = self.leerRegistro(entrada[1], idLocal)
+                if registro:
+                    self.aplicarEnlaces(entrada[1], idLocal, None, registro["fields"])
+        self.ultimaDescarga = time.monotonic()
+
+    def sincronizar(self):
+        ''' Envía el diario y, si toca, vuelve a descargar las tablas. '''
+        self.enviarDiario()
+        if time.monotonic() - self.ultimaDescarga >= self.intervaloDescarga:
+            self.descargar()
+
+    def bucle(self):
+        while not self.parar:
+            self.aviso.wait(self.intervalo)
+            self.aviso.clear()
+            try:
+                self.sincronizar()
+            except Exception:
+                # El hilo no debe morir por un error puntual
+                pass
+
+    def arrancar(self):
+        ''' Arranca el hilo de sincronización en segundo plano. '''
+        if not self.hilo:
+            self.hilo = threading.Thread(target=self.bucle, name="espejo", daemon=True)
+            self.hilo.start()
+
+    def detener(self):
+        ''' Detiene el hilo e intenta enviar lo que quede en el diario. '''
+        self.parar = True
+        self.aviso.set()
+        if self.hilo:
+            self.hilo.join(timeout=5)
+        self.enviarDiario()
+
+
+# Tabla del espejo local
+class TablaEspejo:
+    ''' Tabla con los mismos métodos que pyairtable.Table que lee y escribe
+        en un EspejoLocal. '''
+
+    def __init__(self, espejo, nombre, espera=5):
+        self.espejo = espejo
+        self.nombre = nombre
+        self.espera = espera # Segundos que create espera a que Airtable confirme
+
+    def all(self, **options):
+        registros = self.espejo.leerTabla(self.nombre)
+        return seleccionarRegistros(registros, **options)
+
+    def iterate(self, **options):
+        registros = self.all(**options)
+        tamano = options.get("page_size") or 100
+        for i in range(0, len(registros), tamano):
+            yield registros[i:i + tamano]
+
+    def first(self, **options):
+        registros = self.all(max_records=1, **options)
+        return registros[0] if registros else None
+
+    def get(self, record_id, **options):
+        registro, modificado = self.espejo.leerRegistro(self.nombre, self.espejo.idRemoto(record_id))
+        if not registro:
+            raise LookupError(f"No existe el registro {record_id} en {self.nombre}")
+        return registro
+
+    def create(self, fields, **options):
+        idLocal = self.crearEnCopia(fields)
+        num = self.espejo.apuntar(self.nombre, "create", idLocal, fields, "")
+        self.esperarCreacion(num)
+        return self.get(idLocal)
+
+    def batch_create(self, records, **options):
+        # Como en Airtable, el lote se crea entero o no se crea: va en una
+        # sola entrada del diario, y si Airtable la rechaza se quitan de la
+        # copia todos sus registros
+        idsLocales = [self.crearEnCopia(fields) for fields in records]
+        num = self.espejo.apuntar(self.nombre, "batch_create", json.dumps(idsLocales), list(records), "")
+        self.esperarCreacion(num)
+        return [self.get(idLocal) for idLocal in idsLocales]
+
+    def esperarCreacion(self, num):
+        ''' Con conexión, espera a que Airtable confirme una creación y, si la
+            rechaza, lanza su error como lo haría Table. Sin conexión no se
+            espera y valen los campos calculados en la copia. '''
+        if self.espejo.enLinea:
+            self.espejo.esperar(num, self.espera)
+        error = self.espejo.rechazos.pop(num, None)
+        if error:
+            raise error
+
+    def crearEnCopia(self, fields):
+        ''' Crea un registro con id provisional en la copia local.
+            Retorna: id provisional. '''
+        idLocal = "loc" + os.urandom(7).hex()
+        registro = {"id": idLocal, "createdTime": marcaDeTiempo(), "fields": dict(fields)}
+        self.espejo.guardarRegistro(self.nombre, registro, modificado="")
+        self.espejo.aplicarEnlaces(self.nombre, idLocal, None, registro["fields"])
+        return idLocal
+
+    def update(self, record_id, fields, **options):
+        registro, modificado = self.espejo.leerRegistro(self.nombre, self.espejo.idRemoto(record_id))
+        if not registro:
+            raise LookupError(f"No existe el registro {record_id} en {self.nombre}")
+        antes = copy.deepcopy(registro["fields"])
+        registro["fields"].update(fields)
+        self.espejo.guardarRegistro(self.nombre, registro, modificado=modificado)
+        self.espejo.apuntar(self.nombre, "update", registro["id"], fields, modificado)
+        self.espejo.aplicarEnlaces(self.nombre, registro["id"], antes, registro["fields"])
+        return self.get(registro["id"])
+
+    def batch_update(self, records, **options):
+        return [self.update(r["id"], r["fields"]) for r in records]
+
+    def delete(self, record_id):
+        registro, modificado = self.espejo.leerRegistro(self.nombre, self.espejo.idRemoto(record_id))
+        if not registro:
+            raise LookupError(f"No existe el registro {record_id} en {self.nombre}")
+        self.espejo.borrarRegistro(self.nombre, registro["id"])
+        # Se apuntan sus campos para refrescar después los registros enlazados
+        self.espejo.apuntar(self.nombre, "delete", registro["id"], registro["fields"], modificado)
+        self.espejo.aplicarEnlaces(self.nombre, registro["id"], registro["fields"], None)
+        return {"id": record_id, "deleted": True}
+
+    def batch_delete(self, record_ids):
+        return [self.delete(record_id) for record_id in record_ids]
+
+
+# Base de datos en memoria
+class BaseMemoria:
+    ''' Base de datos completa en memoria que imita la de Airtable: enlaces
+        entre tablas en los dos sentidos, búsquedas (lookups), numeración
+        automática y los campos calculados de los que depende el guión
+        (SALDO, IMPORTE, MISMA-SEMANA, TIEMPO-DESDE-MOVIMIENTO,
+        CONCEPTO-LITERAL...). Sirve para probar y medir la simulación sin
+        conexión ni clave. Los campos calculados se obtienen al leer, campo a
+        campo, así que nunca se quedan desfasados. '''
+
+    def __init__(self, nombres=None):
+        nombres = nombres or TABLAS
+        self.registros = {nombre: dict() for nombre in nombres} # tabla: {id: Record}
+        self.contadores = {clave: 0 for clave in AUTONUMEROS_MEMORIA} # (tabla, campo): último número
+        self.cerrojo = threading.RLock()
+
+        # Enlaces en los dos sentidos: (tabla, campo): (tabla enlazada, campo contrario)
+        self.enlaces = dict()
+        for (tabla, campo), (destino, inverso) in ENLACES_MEMORIA.items():
+            self.enlaces[(tabla, campo)] = (destino, inverso)
+            self.enlaces[(destino, inverso)] = (tabla, campo)
+
+        # Campos calculados de cada tabla: campo: función(Record) -> valor
+        self.calculos = {nombre: dict() for nombre in nombres}
+        for (tabla, campo), (enlace, origen) in BUSQUEDAS_MEMORIA.items():
+            self.calculos[tabla][campo] = functools.partial(self.buscar, tabla, enlace, origen)
+        self.calculos["PERSONAS"]["NOMBRE COMPLETO"] = self.nombreCompleto
+        self.calculos["PERSONAJES"]["SALDO"] = self.saldoPersonaje
+        self.calculos["CUENTAS"]["SALDO"] = self.saldoCuenta
+        self.calculos["MOVIMIENTOS"]["IMPORTE"] = self.importe
+        self.calculos["MOVIMIENTOS"]["MISMA-SEMANA"] = self.mismaSemana
+        self.calculos["MOVIMIENTOS"]["TIEMPO-DESDE-MOVIMIENTO"] = self.tiempoDesdeMovimiento
+        self.calculos["PRODUCTOS-SERVICIOS"]["PRODUCTO-SERVICIO"] = self.productoServicio
+
+    def tablas(self):
+        ''' Diccionario de tablas como el que devuelve cargarBase. '''
+        return {nombre: TablaMemoria(self, nombre) for nombre in self.registros}
+
+    # Lectura
+
+    def valor(self, tabla, registro, campo):
+        ''' Valor de un campo, guardado o calculado; None si está vacío. '''
+        calculo = self.calculos[tabla].get(campo)
+        if calculo:
+            return calculo(registro)
+        return registro["fields"].get(campo)
+
+    def campos(self, tabla, registro):
+        ''' Campos guardados y calculados de un registro, sin los vacíos. '''
+        campos = copy.deepcopy(registro["fields"])
+        for campo in self.calculos[tabla]:
+            valor = self.valor(tabla, registro, campo)
+            if valor in (None, "", []):
+                campos.pop(campo, None)
+            else:
+                campos[campo] = valor
+        return campos
+
+    def leer(self, tabla, idReg):
+        ''' Registro completo, como lo devolvería Airtable. '''
+        registro = self.registros[tabla].get(idReg)
+        if not registro:
+            raise LookupError(f"No existe el registro {idReg} en {tabla}")
+        return {"id": idReg, "createdTime": registro["createdTime"], "fields": self.campos(tabla, registro)}
+
+    def enlazados(self, tabla, registro, campo):
+        ''' Registros enlazados desde un campo. '''
+        destino = self.enlaces[(tabla, campo)][0]
+        return [self.registros[destino][i] for i in registro["fields"].get(campo) or [] if i in self.registros[destino]]
+
+    # Campos calculados
+
+    def buscar(self, tabla, enlace, origen, registro):
+        ''' Búsqueda (lookup): lista de los valores del campo origen en los registros enlazados. '''
+        destino = self.enlaces[(tabla, enlace)][0]
+        valores = []
+        for enlazado in self.enlazados(tabla, registro, enlace):
+            valor = self.valor(destino, enlazado, origen)
+            if type(valor) == type(list()):
+                valores += valor
+            elif valor not in (None, ""):
+                valores.append(valor)
+        return valores or None
+
+    def nombreCompleto(self, registro):
+        ''' Como la fórmula de Airtable: APELLIDO1 APELLIDO2, NOMBRE. '''
+        campos = registro["fields"]
+        return f'{campos.get("APELLIDO1") or ""} {campos.get("APELLIDO2") or ""}, {campos.get("NOMBRE") or ""}'
+
+    def saldoCuenta(self, registro):
+        return sum(self.importe(mov) for mov in self.enlazados("CUENTAS", registro, "MOVIMIENTO"))
+
+    def saldoPersonaje(self, registro):
+        ''' Saldo de la cuenta corriente del personaje. '''
+        return sum(
+            self.saldoCuenta(cuenta) for cuenta in self.enlazados("PERSONAJES", registro, "CUENTA")
+            if cuenta["fields"].get("TIPO-CUENTA") == "CORRIENTE"
+        )
+
+    def importe(self, registro):
+        ''' Precio del concepto más el importe particular del movimiento. '''
+        precio = sum(self.precio(concepto) or 0 for concepto in self.enlazados("MOVIMIENTOS", registro, "CONCEPTO"))
+        return precio + (registro["fields"].get("IMPORTE-PARTICULAR") or 0)
+
+    def precio(self, registro):
+        ''' Precio guardado o, en los conceptos de un personaje sin precio
+            (la mensualidad), su salario. '''
+        precio = registro["fields"].get("PRECIO")
+        if precio is None and registro["fields"].get("PERSONAJE"):
+            precio = sum(p["fields"].get("SALARIO") or 0 for p in self.enlazados("PRODUCTOS-SERVICIOS", registro, "PERSONAJE"))
+        return precio
+
+    def productoServicio(self, registro):
+        ''' NOMBRE|PERSONAJE para los conceptos propios de un personaje, NOMBRE para el resto. '''
+        personajes = self.buscar("PRODUCTOS-SERVICIOS", "PERSONAJE", "PERSONAJE", registro)
+        nombre = registro["fields"].get("NOMBRE", "")
+        return f"{nombre}|{personajes[0]}" if personajes else nombre
+
+    def mismaSemana(self, registro):
+        anio, semana, dia = fechaDeRegistro(registro).isocalendar()
+        hoy = datetime.date.today().isocalendar()
+        return 1 if (anio, semana) == (hoy[0], hoy[1]) else 0
+
+    def tiempoDesdeMovimiento(self, registro):
+        ''' Períodos (meses o semanas, según la frecuencia del concepto) desde el
+            movimiento, contando el actual. 0 si no es periódico. '''
+        frecuencia = self.valor("MOVIMIENTOS", registro, "FRECUENCIA")
+        fecha = fechaDeRegistro(registro)
+        hoy = datetime.date.today()
+        if frecuencia == ["MENSUAL"]:
+            return (hoy.year - fecha.year) * 12 + hoy.month - fecha.month + 1
+        elif frecuencia == ["SEMANAL"]:
+            lunes = hoy - datetime.timedelta(days=hoy.weekday())
+            lunesMov = fecha - datetime.timedelta(days=fecha.weekday())
+            return (lunes - lunesMov).days // 7 + 1
+        return 0
+
+    # Escritura
+
+    def enlazar(self, tabla, idReg, campo, ids, quitar=False):
+        ''' Añade (o quita) idReg en el campo contrario de los registros enlazados. '''
+        destino, inverso = self.enlaces[(tabla, campo)]
+        for idEnlazado in ids:
+            enlazado = self.registros[destino].get(idEnlazado)
+            if not enlazado:
+                continue
+            if quitar:
+                actuales = [i for i in enlazado["fields"].get(inverso) or [] if i != idReg]
+                if actuales:
+                    enlazado["fields"][inverso] = actuales
+                else:
+                    enlazado["fields"].pop(inverso, None)
+            else:
+                # Quien llama solo pasa enlaces nuevos, así que no hay repetidos
+                enlazado["fields"].setdefault(inverso, []).append(idReg)
+
+    def cargar(self, datos):
+        ''' Añade registros ya hechos (con id y createdTime), por ejemplo de una
+            semilla o de una descarga de Airtable, y rehace los enlaces.
+
+            Argumentos:
+            - datos: {tabla: [Record]} '''
+        with self.cerrojo:
+            for tabla, registros in datos.items():
+                # Los campos calculados y los contrarios de los enlaces no se guardan
+                contrarios = {campo for (t, campo) in ENLACES_MEMORIA.values() if t == tabla}
+                for registro in registros:
+                    campos = {
+                        c: copy.deepcopy(v) for c, v in registro["fields"].items()
+                        if c not in contrarios and c not in self.calculos[tabla]
+                    }
+                    for (tablaNum, campo) in self.contadores:
+                        if tablaNum == tabla and campos.get(campo):
+                            self.contadores[(tabla, campo)] = max(self.contadores[(tabla, campo)], campos[campo])
+                    self.registros[tabla][registro["id"]] = {
+                        "id": registro["id"],
+                        "createdTime": registro.get("createdTime") or marcaDeTiempo(),
+                        "fields": campos,
+                    }
+            self.rehacerEnlaces()
+
+    def rehacerEnlaces(self):
+        ''' Vuelve a llenar los campos contrarios de todos los enlaces. '''
+        for (tabla, campo), (destino, inverso) in ENLACES_MEMORIA.items():
+            for registro in self.registros[destino].values():
+                registro["fields"].pop(inverso, None)
+        for (tabla, campo), (destino, inverso) in ENLACES_MEMORIA.items():
+            for registro in self.registros[tabla].values():
+                self.enlazar(tabla, registro["id"], campo, dict.fromkeys(registro["fields"].get(campo) or []))
+
+    def escribir(self, tabla, idReg, campos):
+        ''' Crea o modifica un registro y mantiene los enlaces contrarios.
+            Retorna: registro completo. '''
+        with self.cerrojo:
+            registro = self.registros[tabla].get(idReg)
+            if not registro:
+                registro = {"id": idReg, "createdTime": marcaDeTiempo(), "fields": dict()}
+                self.registros[tabla][idReg] = registro
+                for (tablaNum, campo) in self.contadores:
+                    if tablaNum == tabla:
+                        self.contadores[(tabla, campo)] += 1
+                        registro["fields"][campo] = self.contadores[(tabla, campo)]
+
+            for campo, valor in campos.items():
+                if campo in self.calculos[tabla] or (tabla, campo) in self.contadores:
+                    # Los campos calculados no se pueden escribir
+                    continue
+                if (tabla, campo) in self.enlaces:
+                    anteriores = set(registro["fields"].get(campo) or [])
+                    nuevos = set(valor or [])
+                    self.enlazar(tabla, idReg, campo, [i for i in anteriores if i not in nuevos], quitar=True)
+                    self.enlazar(tabla, idReg, campo, [i for i in dict.fromkeys(valor or []) if i not in anteriores])
+                if valor in (None, "", []):
+                    registro["fields"].pop(campo, None)
+                else:
+                    registro["fields"][campo] = copy.deepcopy(valor)
+
+            return self.leer(tabla, idReg)
+
+    def borrar(self, tabla, idReg):
+        with self.cerrojo:
+            registro = self.registros[tabla].pop(idReg, None)
+            if not registro:
+                raise LookupError(f"No existe el registro {idReg} en {tabla}")
+            for campo, valor in registro["fields"].items():
+                if (tabla, campo) in self.enlaces:
+                    self.enlazar(tabla, idReg, campo, valor, quitar=True)
+            return {"id": idReg, "deleted": True}
+
+
+# Vista perezosa de los campos de un registro en memoria
+class CamposMemoria(Mapping):
+    ''' Campos de un registro de BaseMemoria que se calculan solo cuando se
+        piden, para filtrar tablas grandes con fórmulas sin calcular todos
+        los campos de todos los registros. '''
+
+    def __init__(self, base, tabla, registro):
+        self.base = base
+        self.tabla = tabla
+        self.registro = registro
+
+    def __getitem__(self, campo):
+        valor = self.base.valor(self.tabla, self.registro, campo)
+        if valor in (None, "", []):
+            raise KeyError(campo)
+        return valor
+
+    def __iter__(self):
+        # Solo los campos que no están vacíos, como en Airtable
+        return iter(self.base.campos(self.tabla, self.registro))
+
+    def __len__(self):
+        return len(self.base.campos(self.tabla, self.registro))
+
+    def calcular(self):
+        ''' Todos los campos en un diccionario. '''
+        return self.base.campos(self.tabla, self.registro)
+
+
+# Tabla de la base de datos en memoria
+class TablaMemoria:
+    ''' Tabla con los mismos métodos que pyairtable.Table sobre una BaseMemoria. '''
+
+    def __init__(self, base, nombre):
+        self.base = base
+        self.nombre = nombre
+
+    def all(self, **options):
+        with self.base.cerrojo:
+            tabla = self.base.registros[self.nombre]
+            # Las consultas por id de traerRegistrosPorLotes no recorren la tabla
+            ids = idsDeFormula(options.get("formula"))
+            if ids is not None:
+                options = dict(options, formula=None)
+                fuente = [tabla[i] for i in dict.fromkeys(ids) if i in tabla]
+            else:
+                fuente = tabla.values()
+            registros = [
+                {"id": r["id"], "createdTime": r["createdTime"], "fields": CamposMemoria(self.base, self.nombre, r)}
+                for r in fuente
+            ]
+            registros = seleccionarRegistros(registros, **options)
+            return [
+                {
+                    "id": r["id"],
+                    "createdTime": r["createdTime"],
+                    "fields": r["fields"].calcular() if isinstance(r["fields"], CamposMemoria) else copy.deepcopy(r["fields"]),
+                }
+                for r in registros
+            ]
+
+    def iterate(self, **options):
+        registros = self.all(**options)
+        tamano = options.get("page_size") or 100
+        for i in range(0, len(registros), tamano):
+            yield registros[i:i + tamano]
+
+    def first(self, **options):
+        registros = self.all(max_records=1, **options)
+        return registros[0] if registros else None
+
+    def get(self, record_id, **options):
+        with self.base.cerrojo:
+            return self.base.leer(self.nombre, record_id)
+
+    def create(self, fields, **options):
+        return self.base.escribir(self.nombre, "rec" + os.urandom(7).hex(), fields)
+
+    def batch_create(self, records, **options):
+        return [self.create(fields) for fields in records]
+
+    def update(self, record_id, fields, **options):
+        if record_id not in self.base.registros[self.nombre]:
+            raise LookupError(f"No existe el registro {record_id} en {self.nombre}")
+        return self.base.escribir(self.nombre, record_id, fields)
+
+    def batch_update(self, records, **options):
+        return [self.update(r["id"], r["fields"]) for r in records]
+
+    def delete(self, record_id):
+        return self.base.borrar(self.nombre, record_id)
+
+    def batch_delete(self, record_ids):
+        return [self.delete(record_id) for record_id in record_ids]
+
+
+# Vista de una tabla del espejo local
+class VistaEspejo(Mapping):
+    ''' Registros de una tabla de un EspejoLocal por id, para que los cálculos
+        de BaseMemoria los lean como si fueran suyos. '''
+
+    def __init__(self, espejo, tabla):
+        self.espejo = espejo
+        self.tabla = tabla
+
+    def __getitem__(self, idReg):
+        registro, modificado = self.espejo.leerRegistro(self.tabla, idReg)
+        if not registro:
+            raise KeyError(idReg)
+        return registro
+
+    def __iter__(self):
+        return iter([registro["id"] for registro in self.espejo.leerTabla(self.tabla)])
+
+    def __len__(self):
+        return len(self.espejo.leerTabla(self.tabla))
+
+
+# Cálculos de Airtable sobre el espejo local
+class CalculosEspejo(BaseMemoria):
+    ''' Enlaces y campos calculados de BaseMemoria aplicados a los registros de
+        un EspejoLocal, para que lo escrito sin conexión se lea como lo
+        devolvería Airtable hasta que llegue la versión de verdad. '''
+
+    def __init__(self, espejo):
+        super().__init__()
+        self.registros = {nombre: VistaEspejo(espejo, nombre) for nombre in TABLAS}
+
+
 #
 # Globales
 #
 validador = Validacion()
 base = dict()
+instantaneas = dict() # id de cuenta: InstantaneaCuenta
+espejos = dict() # ruta del fichero: EspejoLocal
+metricas = Metricas()
+planificador = Planificador()
+configuracion = dict()
+menus = dict()
+
+# Número máximo de identificadores por consulta al recuperar registros por lotes
+LOTE_LECTURA = 50
+
+# Número máximo de registros por petición de escritura que admite Airtable
+LOTE_ESCRITURA = 10
+
+# Reintentos y esperas inicial y máxima (segundos) cuando Airtable responde 429 o 5xx
+REINTENTOS = 5
+ESPERA_INICIAL = 1
+ESPERA_MAXIMA = 30
+
+# Hilos que piden a la vez datos que no dependen unos de otros
+CONCURRENCIA = 4
+
+# Métodos de pyairtable.Table que usa el guión. Cualquier tabla que los tenga
+# sirve para cargarBase (Table, TablaEspejo o TablaMemoria); son los que se
+# anotan en las métricas y pasan por el planificador
+METODOS_ALMACEN = (
+    "all", "iterate", "first", "get", "create", "batch_create",
+    "update", "batch_update", "delete", "batch_delete",
+)
+
+# Métodos de las tablas que escriben en la base de datos
+METODOS_ESCRITURA = ("create", "batch_create", "update", "batch_update", "delete", "batch_delete")
+
+# Límites (segundos) de las cubetas del histograma de latencias
+LIMITES_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Tipos de participante, con la inicial que se acepta en lugar del nombre
+TIPOS_PARTICIPANTE = {"ESTUDIANTE": "E", "COMERCIANTE": "C"}
+
+# Columnas del fichero CSV de importación de participantes
+COLUMNAS_IMPORTACION = ("NOMBRE", "APELLIDO1", "APELLIDO2", "TIPO")
+
+# Campo que enlaza cada tipo de cuenta con el personaje, además de PERSONAJE
+CAMPOS_TIPO_CUENTA = {"TARJETA": "PERSONAJE-TARJETA", "AHORRO": "PERSONAJE-AHORRO", "JUBILACIÓN": "PERSONAJE-JUBILACIÓN"}
+
+# Tablas de la base de datos
+TABLAS = ("PERSONAS", "COMERCIOS", "PERSONAJES", "CUENTAS", "MOVIMIENTOS", "PRODUCTOS-SERVICIOS", "PROFESIONES")
+
+# Esquema de la base de datos en memoria
+# Campos enlazados: (tabla, campo): (tabla enlazada, campo contrario)
+ENLACES_MEMORIA = {
+    ("PERSONAS", "PERSONAJE"): ("PERSONAJES", "PARTICIPANTE"),
+    ("CUENTAS", "PERSONAJE"): ("PERSONAJES", "CUENTA"),
+    ("CUENTAS", "PERSONAJE-TARJETA"): ("PERSONAJES", "CUENTA-TARJETA"),
+    ("CUENTAS", "PERSONAJE-AHORRO"): ("PERSONAJES", "CUENTA-AHORRO"),
+    ("CUENTAS", "PERSONAJE-JUBILACIÓN"): ("PERSONAJES", "CUENTA-JUBILACIÓN"),
+    ("MOVIMIENTOS", "CUENTA"): ("CUENTAS", "MOVIMIENTO"),
+    ("MOVIMIENTOS", "CONCEPTO"): ("PRODUCTOS-SERVICIOS", "MOVIMIENTOS"),
+    ("PRODUCTOS-SERVICIOS", "COMERCIO"): ("COMERCIOS", "PRODUCTOS-SERVICIOS"),
+    ("PRODUCTOS-SERVICIOS", "PERSONAJE"): ("PERSONAJES", "PRODUCTOS-SERVICIOS"),
+    ("PERSONAJES", "OCUPACIÓN1"): ("PROFESIONES", "PERSONAJES"),
+}
+
+# Búsquedas (lookups): (tabla, campo): (campo enlazado, campo de la tabla enlazada)
+BUSQUEDAS_MEMORIA = {
+    **{
+        ("PERSONAS", campo): ("PERSONAJE", campo)
+        for campo in (
+            "SALDO", "PROFESIÓN", "SALARIO", "PROFESIÓN-CÓNYUGE", "SALARIO-CÓNYUGE",
+            "NOMBRE-HIJOS", "EDAD-HIJOS", "CRÉDITO-UNIVERSITARIO", "COPAGO-SEGURO-MÉDICO",
+            "DEUDA-TARJETA-CRÉDITO", "PAGO-MÍNIMO-TARJETA-CRÉDITO",
+        )
+    },
+    ("PRODUCTOS-SERVICIOS", "NOMBRE-COMERCIO"): ("COMERCIO", "NOMBRE"),
+    ("MOVIMIENTOS", "CONCEPTO-LITERAL"): ("CONCEPTO", "NOMBRE"),
+    ("MOVIMIENTOS", "FRECUENCIA"): ("CONCEPTO", "FRECUENCIA"),
+    ("MOVIMIENTOS", "GESTIÓN"): ("CONCEPTO", "GESTIÓN"),
+    ("MOVIMIENTOS", "MERCADER"): ("CONCEPTO", "NOMBRE-COMERCIO"),
+}
+
+# Enlaces por los que un cambio llega a los campos calculados de otra tabla:
+# (tabla, campo enlazado) cuyos registros se recalculan si cambia el enlazado
+DEPENDENCIAS_MEMORIA = {
+    *((tabla, enlace) for (tabla, campo), (enlace, origen) in BUSQUEDAS_MEMORIA.items()),
+    ("CUENTAS", "MOVIMIENTO"), # SALDO
+    ("PERSONAJES", "CUENTA"), # SALDO
+    ("MOVIMIENTOS", "CONCEPTO"), # IMPORTE
+    ("PRODUCTOS-SERVICIOS", "PERSONAJE"), # PRODUCTO-SERVICIO y precio de la mensualidad
+}
+
+# Campos con numeración automática
+AUTONUMEROS_MEMORIA = (("CUENTAS", "NÚMERO-CUENTA"), ("MOVIMIENTOS", "MOVIMIENTO"))
+
+# Vocales acentuadas que se igualan a la vocal sin acento en las búsquedas
+ACENTOS = {"Á": "A", "É": "E", "Í": "I", "Ó": "O", "Ú": "U", "Ü": "U", "À": "A", "È": "E", "Ì": "I", "Ò": "O", "Ù": "U"}
+
+# Funciones de fórmula de Airtable que entiende el espejo local
+FUNCIONES_FORMULA = {
+    "OR": lambda *a: any(a),
+    "AND": lambda *a: all(a),
+    "NOT": lambda a: not a,
+    "IF": lambda c, s, n="": s if c else n,
+    "FIND": lambda buscado, texto, inicio=1: textoDeCampo(texto).find(textoDeCampo(buscado), int(numeroDeCampo(inicio)) - 1) + 1,
+    "SEARCH": lambda buscado, texto, inicio=1: textoDeCampo(texto).lower().find(textoDeCampo(buscado).lower(), int(numeroDeCampo(inicio)) - 1) + 1,
+    "SUBSTITUTE": lambda texto, viejo, nuevo: textoDeCampo(texto).replace(textoDeCampo(viejo), textoDeCampo(nuevo)),
+    "UPPER": lambda texto: textoDeCampo(texto).upper(),
+    "LOWER": lambda texto: textoDeCampo(texto).lower(),
+    "TRIM": lambda texto: textoDeCampo(texto).strip(),
+    "LEN": lambda texto: len(textoDeCampo(texto)),
+    "LEFT": lambda texto, n: textoDeCampo(texto)[:int(numeroDeCampo(n))],
+    "ARRAYJOIN": lambda lista, separador=", ": separador.join(textoDeCampo(v) for v in (lista or [])),
+    "BLANK": lambda: "",
+    "TRUE": lambda: True,
+    "FALSE": lambda: False,
+}
+
+# Operadores binarios por nivel de precedencia, de menor a mayor
+OPERADORES_FORMULA = (
+    {
+        "=": lambda a, b: operator.eq(*compararValores(a, b)),
+        "!=": lambda a, b: operator.ne(*compararValores(a, b)),
+        "<": lambda a, b: operator.lt(*compararValores(a, b)),
+        ">": lambda a, b: operator.gt(*compararValores(a, b)),
+        "<=": lambda a, b: operator.le(*compararValores(a, b)),
+        ">=": lambda a, b: operator.ge(*compararValores(a, b)),
+    },
+    {"&": lambda a, b: textoDeCampo(a) + textoDeCampo(b)},
+    {"+": lambda a, b: numeroDeCampo(a) + numeroDeCampo(b), "-": lambda a, b: numeroDeCampo(a) - numeroDeCampo(b)},
+    {"*": lambda a, b: numeroDeCampo(a) * numeroDeCampo(b), "/": lambda a, b: numeroDeCampo(a) / numeroDeCampo(b)},
+)
 
 
 #
@@ -94,12 +1635,13 @@ base = dict()
 
 
 def cargarConfiguracion():
-    ''' Devuelve la configuración alojada en archivo toml'''
+    ''' Devuelve la configuración alojada en archivo toml, leída una sola vez'''
 
-    with open("conf.toml", mode="rb") as fichero:
-        conf = tomllib.load(fichero)
+    if not configuracion:
+        with open("conf.toml", mode="rb") as fichero:
+            configuracion.update(tomllib.load(fichero))
 
-    return conf
+    return configuracion
 
 
 def cargarMenus():
@@ -121,7 +1663,42 @@ def cargarMenus():
     return catalogo
 
 
-menus = cargarMenus()
+def obtenerMenus():
+    '''Devuelve los menús, cargándolos de conf.toml la primera vez'''
+
+    if not menus:
+        menus.update(cargarMenus())
+
+    return menus
+
+
+def comprobarArranque():
+    '''Compara el tiempo de arranque con el presupuesto de conf.toml
+
+    Retorna: segundos transcurridos desde el inicio del guión'''
+
+    transcurrido = time.perf_counter() - INICIO
+    presupuesto = cargarConfiguracion().get("arranque", dict()).get("presupuesto")
+
+    if presupuesto and transcurrido > presupuesto:
+        print(f"Aviso: el arranque ha tardado {transcurrido:.2f} s, por encima del presupuesto de {presupuesto:.2f} s.")
+
+    return transcurrido
+
+
+def nuevaTabla(cabecera, ajustes):
+    '''Crea una tabla de texto sin bordes con las columnas y alineaciones indicadas'''
+
+    from prettytable import PLAIN_COLUMNS, PrettyTable
+
+    tabla = PrettyTable()
+    tabla.field_names = cabecera
+    for i, ajuste in enumerate(ajustes):
+        col = cabecera[i]
+        tabla.align[col] = ajuste
+    tabla.set_style(PLAIN_COLUMNS)
+
+    return tabla
 
 
 def clear():
@@ -133,13 +1710,15 @@ def clear():
 def pedirClave():
     '''Pedir clave Airtable-API'''
     
+    from getch import getch
+
     print("\nIntroducir contraseña: ", end="")
 
     pw = ""
 
     while True:
-        try:    
-            x = getch.getch()
+        try:
+            x = getch()
             if x == "\r" or x == "\n":
                 break
             print("·", end="", flush=True)
@@ -153,53 +1732,458 @@ def pedirClave():
  
 
 def cargarBase():
-    '''Carga la base de datos de Airtable'''
+    '''Carga la base de datos de Airtable, o la base en memoria si así se
+    indica en la sección [almacen] de conf.toml
+
+    Las tablas se crean una sola vez por proceso y se guardan en el global
+    base, de modo que sus sesiones HTTP (y sus conexiones) se reutilizan
+    cada vez que se vuelve al menú principal.'''
+
+    if base:
+        return base
+
+    confAlmacen = cargarConfiguracion().get("almacen", dict())
+    tipo = confAlmacen.get("tipo", "airtable")
+
+    if tipo == "memoria":
+        tablas = abrirBaseMemoria(confAlmacen.get("semilla"))
+    else:
+        tablas = tablasAirtable()
+
+    if cargarConfiguracion().get("metricas", dict()).get("activo", True):
+        tablas = {nombre: TablaInstrumentada(tabla, nombre, metricas) for nombre, tabla in tablas.items()}
+
+    # Todas las peticiones a Airtable pasan por el planificador
+    if tipo == "airtable":
+        confPlanificador = cargarConfiguracion().get("planificador", dict())
+        planificador.ajustar(confPlanificador.get("peticionesPorSegundo", 5), confPlanificador.get("rafaga", 5))
+        tablas = {nombre: TablaPlanificada(tabla, planificador) for nombre, tabla in tablas.items()}
+
+    enLinea = comprobarConexion(tablas)
+    confEspejo = cargarConfiguracion().get("espejo", dict())
+
+    # El espejo local solo tiene sentido sobre Airtable
+    if confEspejo.get("activo") and tipo == "airtable":
+        tablas = abrirEspejo(tablas, confEspejo, enLinea)
+        enLinea = tablas is not None
+
+    if not enLinea:
+        print("No se han podido cargas las tablas.")
+        os._exit(1)
+
+    base.update(envolverConCache(tablas, cargarConfiguracion().get("cache", dict())))
+
+    return base
+
+
+def tablasAirtable():
+    '''Tablas de la base de datos de Airtable indicada en el entorno'''
+
+    from pyairtable import Table
 
     baseDatos = os.environ.get("DATABASE")
     atk = os.environ.get("PASSWORD")
 
-    tablas = {
-        "PERSONAS": Table(atk, baseDatos, "PERSONAS"),
-        "COMERCIOS": Table(atk, baseDatos, "COMERCIOS"),
-        "PERSONAJES": Table(atk, baseDatos, "PERSONAJES"),
-        "CUENTAS": Table(atk, baseDatos, "CUENTAS"),
-        "MOVIMIENTOS": Table(atk, baseDatos, "MOVIMIENTOS"),
-        "PRODUCTOS-SERVICIOS": Table(atk, baseDatos, "PRODUCTOS-SERVICIOS"),
-        "PROFESIONES": Table(atk, baseDatos, "PROFESIONES"),
+    return {nombre: Table(atk, baseDatos, nombre) for nombre in TABLAS}
+
+
+def abrirBaseMemoria(semilla=None):
+    '''Tablas de una BaseMemoria, llenas con los registros del fichero JSON
+    semilla ({tabla: [Record]}) si se indica'''
+
+    baseMemoria = BaseMemoria()
+
+    if semilla:
+        with open(semilla, encoding="utf-8") as fichero:
+            baseMemoria.cargar(json.load(fichero))
+
+    return baseMemoria.tablas()
+
+
+def marcaDeTiempo(instante=None):
+    '''Fecha y hora en el formato de createdTime de Airtable'''
+
+    instante = instante or datetime.datetime.now(datetime.timezone.utc)
+
+    return instante.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def fechaDeRegistro(registro):
+    '''Fecha de creación de un registro'''
+
+    return datetime.datetime.strptime(registro["createdTime"][:10], "%Y-%m-%d").date()
+
+
+def envolverConCache(tablas, confCache):
+    '''Envuelve cada tabla en una TablaEnCache según la sección [cache] de conf.toml'''
+
+    ttl = confCache.get("ttl", dict())
+    dependencias = confCache.get("dependencias", dict())
+    capacidad = confCache.get("capacidad", 256)
+
+    envueltas = {
+        nombre: TablaEnCache(tabla, nombre, ttl.get(nombre, 0), capacidad)
+        for nombre, tabla in tablas.items()
     }
 
+    for nombre, tabla in envueltas.items():
+        tabla.dependientes = [envueltas[dep] for dep in dependencias.get(nombre, [])]
+
+    return envueltas
+
+
+def abrirEspejo(tablas, confEspejo, enLinea):
+    '''Abre la copia local de la base de datos según la sección [espejo] de conf.toml
+
+    Con conexión, envía las escrituras pendientes y descarga las tablas antes
+    de empezar; sin conexión, trabaja con lo que haya en la copia local.
+
+    Retorna: diccionario de TablaEspejo, o None si no hay conexión ni copia local'''
+
+    ruta = confEspejo.get("ruta", "villarbolsillo.sqlite")
+
+    espejo = espejos.get(ruta)
+    if not espejo:
+        espejo = EspejoLocal(
+            ruta,
+            tablas,
+            confEspejo.get("campoModificado", ""),
+            confEspejo.get("intervalo", 30),
+            confEspejo.get("intervaloDescarga", 300),
+        )
+        espejos[ruta] = espejo
+    else:
+        espejo.tablasRemotas = tablas
+
+    if enLinea:
+        espejo.enviarDiario()
+        espejo.descargar()
+    elif espejo.vacio():
+        return None
+    else:
+        print("\nSin conexión: se trabaja con la copia local y los cambios se enviarán al recuperarla.")
+
+    # Sin la marca de modificación no se pueden detectar los conflictos
+    if not espejo.campoModificado:
+        print("\nFalta campoModificado en la sección [espejo] de conf.toml.")
+        os._exit(1)
+    sinMarca = espejo.tablasSinMarca()
+    if sinMarca:
+        print(f"\nFalta el campo {espejo.campoModificado} en las tablas {', '.join(sinMarca)} de Airtable: "
+              "añádelo con la fórmula LAST_MODIFIED_TIME() o desactiva [espejo] en conf.toml.")
+        os._exit(1)
+
+    mostrarAvisosEspejo()
+    conflictos = espejo.conflictos()
+    if conflictos:
+        print(f"\nHay {len(conflictos)} cambio(s) sin enviar por conflicto con Airtable o rechazados por ella.")
+
+    espejo.arrancar()
+
+    return {nombre: TablaEspejo(espejo, nombre, confEspejo.get("espera", 5)) for nombre in tablas}
+
+
+def mostrarAvisosEspejo():
+    '''Muestra las escrituras de la copia local que Airtable ha rechazado desde el último aviso'''
+
+    for espejo in espejos.values():
+        for aviso in espejo.tomarAvisos():
+            print(f"\n{aviso}")
+
+
+def comprobarConexion(tablas):
+    '''Comprueba que la base de datos responde con una consulta mínima'''
+
     try:
         tablas["PERSONAS"].all(max_records=1, fields=["NOMBRE"])
-    except:
-        print("No se han podido cargas las tablas.")
-        os.exit()
+        return True
+    except Exception:
+        return False
 
-    return tablas
+
+def reconectarBase():
+    '''Descarta las tablas guardadas y vuelve a cargar la base de datos'''
+
+    base.clear()
+
+    return cargarBase()
 
 
 def crearRegistroEnTabla(tabla, registro):
-    '''Crear un registro en una tabla de la base de datos'''
+    '''Crear un registro en una tabla de la base de datos
+
+    Retorna: Record, o None si no se ha podido crear'''
 
     try:
-        reg = tabla.create(registro)
-        return reg
-    except:
-        print("No se ha podido crear el registro")
-        os._exit(1)
+        return tabla.create(registro)
+    except Exception as error:
+        print(f"No se ha podido crear el registro ({describirError(error)}).")
+        return None
+
+
+def tamanoJson(datos):
+    '''Bytes que ocupan los datos en JSON, como aproximación a lo que viaja por la red'''
+
+    try:
+        return len(json.dumps(datos, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+def describirError(error):
+    '''Tipo de error y código HTTP, si lo hay, para las métricas'''
+
+    codigo = getattr(getattr(error, "response", None), "status_code", None)
+
+    if codigo:
+        return f"{type(error).__name__} {codigo}"
+
+    return type(error).__name__
+
+
+def mostrarMetricas():
+    '''Muestra el resumen de las peticiones de la sesión por acción del menú'''
+
+    filas = metricas.resumen()
+
+    if not filas:
+        print("\nNo se ha registrado ninguna petición.")
+        return
+
+    cabecera = ["ACCIÓN", "TABLA.MÉTODO", "LLAMADAS", "ERRORES", "MEDIA(ms)", "MÁX(ms)", "ENVIADO(KB)", "RECIBIDO(KB)"]
+    ajustes = ["l", "l", "r", "r", "r", "r", "r", "r"]
+    tabla = nuevaTabla(cabecera, ajustes)
+
+    for fila in filas:
+        tabla.add_row([
+            fila["accion"],
+            f'{fila["tabla"]}.{fila["metodo"]}',
+            fila["llamadas"],
+            fila["errores"],
+            "{0:.0f}".format(1000 * fila["segundos"] / fila["llamadas"]),
+            "{0:.0f}".format(1000 * fila["maximo"]),
+            "{0:.1f}".format(fila["enviados"] / 1024),
+            "{0:.1f}".format(fila["recibidos"] / 1024),
+        ])
+
+    print(tabla)
+
+    # Totales por acción, de más a menos peticiones
+    totales = dict()
+    for fila in filas:
+        totales[fila["accion"]] = totales.get(fila["accion"], 0) + fila["llamadas"]
+
+    print("\nPeticiones por acción:")
+    for accion, llamadas in sorted(totales.items(), key=lambda t: -t[1]):
+        print(f"{accion}: {llamadas}")
+
+    estado = planificador.estado()
+    if estado["peticiones"]:
+        print("\nPlanificador:")
+        print(f'Peticiones: {estado["peticiones"]}, en cola: {estado["enCola"]}, cola máxima: {estado["colaMaxima"]}')
+        print(f'Esperas: {estado["esperas"]} ({estado["segundosEsperando"]:.1f} s), reintentos: {estado["reintentos"]}, respuestas 429: {estado["limitesDeTasa"]}')
+
+
+def volcarMetricas():
+    '''Guarda las métricas de la sesión en el fichero indicado en [metricas] de conf.toml
+
+    Retorna: ruta del fichero, o None si no se ha guardado'''
+
+    conf = cargarConfiguracion().get("metricas", dict())
+
+    if not conf.get("activo", True) or not metricas.datos:
+        return None
+
+    ruta = time.strftime(conf.get("fichero", "metricas-%Y%m%d-%H%M%S.json"))
+
+    try:
+        metricas.volcar(ruta, {"planificador": planificador.estado()})
+    except OSError:
+        print("\nNo se han podido guardar las métricas de la sesión.")
+        return None
+
+    return ruta
+
+
+def esLimiteDeTasa(error):
+    '''Comprueba si el error es una respuesta 429 de Airtable'''
+
+    respuesta = getattr(error, "response", None)
+
+    return getattr(respuesta, "status_code", None) == 429
+
+
+def esErrorDeConexion(error):
+    '''Comprueba si el error es una caída de la conexión y no una respuesta de Airtable'''
+
+    import requests
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+def esReintentable(error, escritura=False):
+    '''Comprueba si merece la pena repetir la petición: 429 o error 5xx de Airtable
+
+    Una escritura que recibe un 5xx puede haberse guardado, así que solo se
+    repite tras un 429, que Airtable devuelve sin haber hecho nada'''
+
+    codigo = getattr(getattr(error, "response", None), "status_code", None) or 0
+
+    return codigo == 429 or (codigo >= 500 and not escritura)
+
+
+def crearTraspaso(tabla, salida, entrada):
+    '''Crea los dos movimientos de un traspaso entre cuentas en una sola petición
+
+    Airtable crea un lote entero o ninguno de sus registros, y el espejo local
+    lo envía también en un solo lote y, si Airtable lo rechaza, quita los dos
+    de la copia; si aun así no vuelven los dos, se borra el que se haya creado
+    para que ninguna de las cuentas quede descuadrada.
+
+    Argumentos:
+    - tabla: Table
+        Tabla MOVIMIENTOS
+    - salida, entrada: dict
+        Campos del movimiento de cada cuenta
+
+    Retorna: (Record, Record), o (None, None) si no se ha podido crear'''
+
+    try:
+        creados = tabla.batch_create([salida, entrada])
+    except Exception as error:
+        print(f"No se ha podido registrar el traspaso ({describirError(error)}).")
+        return (None, None)
+
+    if len(creados) == 2:
+        return (creados[0], creados[1])
+
+    # Movimiento de compensación: deshacer la mitad creada
+    print("No se ha podido registrar el traspaso completo; se deshace.")
+    idCreados = [registro["id"] for registro in creados]
+    borrados, noBorrados = borrarRegistrosDeTabla(tabla, idCreados, informar=False)
+
+    if noBorrados:
+        print(f"No se ha podido deshacer el movimiento {', '.join(noBorrados)}: hay que borrarlo a mano.")
+
+    return (None, None)
+
+
+def crearRegistrosEnTabla(tabla, registros, informar=True, paralelo=False):
+    '''Crear varios registros en una tabla en lotes del tamaño máximo de Airtable
+
+    Argumentos:
+    - tabla: Table
+    - registros: [dict]
+        Campos de cada registro que se quiere crear
+    - informar: bool
+        Mostrar el progreso después de cada lote
+    - paralelo: bool
+        Enviar los lotes a la vez, cuando no importa el orden de creación
+
+    Retorna:
+    - Lista de registros creados: [Record]
+    - Lista de campos de los registros que no se han podido crear: [dict]'''
+
+    creados = []
+    fallidos = []
+
+    def crearLote(lote):
+        try:
+            return tabla.batch_create(lote)
+        except Exception:
+            return None
+
+    lotes = [registros[i:i + LOTE_ESCRITURA] for i in range(0, len(registros), LOTE_ESCRITURA)]
+
+    if paralelo:
+        # El planificador mantiene el conjunto por debajo del límite de Airtable
+        resultados = enParalelo([functools.partial(crearLote, lote) for lote in lotes])
+    else:
+        resultados = map(crearLote, lotes)
+
+    for lote, resultado in zip(lotes, resultados):
+        if resultado is None:
+            fallidos += lote
+        else:
+            creados += resultado
+        if informar:
+            print(f"Creados {len(creados)} de {len(registros)} registros...")
+
+    if fallidos:
+        print(f"No se han podido crear {len(fallidos)} registro(s).")
+
+    return (creados, fallidos)
+
+
+def actualizarRegistrosEnTabla(tabla, registros, informar=True):
+    '''Modificar varios registros de una tabla en lotes del tamaño máximo de Airtable
+
+    Argumentos:
+    - tabla: Table
+    - registros: [dict]
+        Registros con las claves id y fields
+    - informar: bool
+        Mostrar el progreso después de cada lote
+
+    Retorna:
+    - Lista de registros modificados: [Record]
+    - Lista de registros que no se han podido modificar: [dict]'''
+
+    actualizados = []
+    fallidos = []
+
+    for i in range(0, len(registros), LOTE_ESCRITURA):
+        lote = registros[i:i + LOTE_ESCRITURA]
+        try:
+            actualizados += tabla.batch_update(lote)
+        except Exception:
+            fallidos += lote
+        if informar:
+            print(f"Modificados {len(actualizados)} de {len(registros)} registros...")
+
+    if fallidos:
+        print(f"No se han podido modificar {len(fallidos)} registro(s).")
+
+    return (actualizados, fallidos)
+
+
+def borrarRegistrosDeTabla(tabla, listaReg, informar=True):
+    '''Borrar varios registros de una tabla en lotes del tamaño máximo de Airtable
+
+    Argumentos:
+    - tabla: Table
+    - listaReg: [str]
+        Claves primarias de los registros que se quieren borrar
+    - informar: bool
+        Mostrar el progreso después de cada lote
+
+    Retorna:
+    - Lista de claves borradas: [str]
+    - Lista de claves que no se han podido borrar: [str]'''
+
+    borrados = []
+
+    for i in range(0, len(listaReg), LOTE_ESCRITURA):
+        lote = listaReg[i:i + LOTE_ESCRITURA]
+        try:
+            resultado = tabla.batch_delete(lote)
+            borrados += [r["id"] for r in resultado if r.get("deleted")]
+        except Exception:
+            pass
+        if informar:
+            print(f"Borrados {len(borrados)} de {len(listaReg)} registros...")
+
+    conjuntoBorrados = set(borrados)
+    noBorrados = [reg for reg in listaReg if reg not in conjuntoBorrados]
+
+    return (borrados, noBorrados)
 
 
 def mostrarRegistro(reg, conf):
     '''Muestra registro con los campos seleccionados'''
 
-    linea = PrettyTable()
-    linea.set_style(PLAIN_COLUMNS)
-    linea.field_names = conf["campos"]
-    for i, ajuste in enumerate(conf["ajuste"]):
-        col = conf["campos"][i]
-        linea.align[col] = ajuste       
-
     fila = []
-    
+
     for campo in conf["campos"]:
 
         columna = reg["fields"].get(campo)
@@ -213,14 +2197,16 @@ def mostrarRegistro(reg, conf):
             elif type(columna[0]) == type(str()):
                 fila.append(columna[0].upper())
 
-    serie = pd.Series(fila, index=conf["campos"])
-
-    linea.add_row(fila)
-
     if conf["orientacion"] == "h":
+        linea = nuevaTabla(conf["campos"], conf["ajuste"])
+        linea.add_row(fila)
         print(linea)
     elif conf["orientacion"] == "v":
-        print(serie)
+        # Un campo por línea: nombre a la izquierda y valor a la derecha
+        anchoCampo = max(len(campo) for campo in conf["campos"])
+        anchoValor = max(len(str(valor)) for valor in fila)
+        for campo, valor in zip(conf["campos"], fila):
+            print(f"{campo:<{anchoCampo}}    {str(valor):>{anchoValor}}")
 
 
 def mostrarParticipante(tabla, reg):
@@ -262,8 +2248,9 @@ def elegirPersonaje(tabla):
     - Registro de la tabla PERSONAJES elegido (dict)'''
 
     lista = tabla.all(sort = ["REFERENCIA"], fields = ["PERSONAJE", "REFERENCIA", "PARTICIPANTE"])
+    indice = IndiceTabla(lista, ["REFERENCIA"])
 
-    refNoDisponibles = []
+    refNoDisponibles = set()
     
     for reg in lista:
 
@@ -272,7 +2259,7 @@ def elegirPersonaje(tabla):
         if hayParticipante:
             # Participante ya asignado
             print(f'{reg["fields"]["REFERENCIA"]} ASIGNADO - NO DISPONIBLE.')
-            refNoDisponibles.append(reg["fields"]["REFERENCIA"])
+            refNoDisponibles.add(reg["fields"]["REFERENCIA"])
 
         else:
             # No está asignado todavía a un participante
@@ -290,7 +2277,7 @@ def elegirPersonaje(tabla):
             # Si es una letra, volver a pedirlo
             ref = 0
 
-    regElegido = buscarRegistroDeCampoEnTabla(lista, "REFERENCIA", ref)
+    regElegido = indice.buscar("REFERENCIA", ref)
     
     return regElegido
 
@@ -353,48 +2340,6 @@ def asignarPersonaje(tablas, reg):
                     
     else: print("No existe el registro.")
 
-def operacionesPersonaje(tablas, reg):
-    '''Menú de opciones del personaje y pedir opción'''
-
-    mostrarParticipante(tablas["PERSONAS"], reg)
-
-    muestraOpciones(menus.get("operacionesPersonaje"))
-
-    opcion = input("\n").upper()
-
-    if opcion == "A" or opcion == "M":
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            asignarPersonaje(tablas, reg)
-        operacionesPersonaje(tablas, reg)
-    elif opcion == "B":
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            borrarPersonaje(tablas, reg)
-        operacionesPersonaje(tablas, reg)
-    elif opcion == "P":
-        reg = buscarParticipante(tablas["PERSONAS"])
-        operacionesPersonaje(tablas, reg)
-    elif opcion == "O":
-        clave = pedirClave()
-        if reg:
-            try:
-                if clave == reg[0] or clave == "Joshua":
-                    operacionesCuenta(tablas, reg)
-            except IndexError:
-                print("\nNo se ha elegido participante.")
-        opcionesParticipante(tablas, reg)
-    elif opcion == "L":
-        operacionesPersonaje(tablas, reg)
-    elif opcion == "V":
-        # Volver al menú anterior
-        opcionesParticipante(tablas, reg)
-    else:
-        print('Comando inválido.')
-        time.sleep(1)
-        operacionesPersonaje(tablas, reg)
-
-
 def muestraOpciones(opciones):
     '''Muestra menús de opciones'''
 
@@ -405,156 +2350,54 @@ def muestraOpciones(opciones):
             print(opciones.get(linea))
 
 
-def opcionesParticipante(tablas, reg):
-    '''Muestra menú del participante y pide opción'''
-
-    mostrarParticipante(tablas["PERSONAS"], reg)
-
-    muestraOpciones(menus.get("participante"))
-
-    opcion = input("\n").upper()
-
-    if opcion == "M":
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            modificarParticipante(tablas["PERSONAS"], reg)
-        opcionesParticipante(tablas, reg)
-    elif opcion == "B":
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            borrarParticipante(tablas["PERSONAS"], reg)
-            reg = []
-            opcion = "V"
-    elif opcion == "R":
-        reg = buscarParticipante(tablas["PERSONAS"])
-        opcionesParticipante(tablas, reg)
-    elif opcion == "D":
-        mostrarParticipante(tablas["PERSONAS"], reg)
-        opcionesParticipante(tablas, reg)
-    elif opcion == "P":
-        clave = pedirClave()
-        try:
-            if clave == reg[0] or clave == "Joshua":
-                operacionesPersonaje(tablas, reg)
-        except IndexError:
-            print("\nNo se ha elegido participante.")
-        opcionesParticipante(tablas, reg)
-    elif opcion == "V":
-        # Volver al menú principal
-        comienzo(reg)
-    else:
-        print('Comando inválido.')
-        time.sleep(1)
-        opcionesParticipante(tablas, reg)
-
-
-def operacionesCuenta(tablas, reg):
-    '''Muestra opciones de la cuenta y pide opción'''
+def mostrarReglasComercio(reg):
+    ''' Muestra las reglas de un comercio'''
 
-    if comprobarPersonaje(tablas["PERSONAJES"], reg):
+    print("\nReglas del comercio:")
+    print(reg["fields"].get("REGLAS"))
 
-        mostrarParticipante(tablas["PERSONAS"], reg)
+def cargarCatalogo(tablas, regComercio):
+    '''Recupera de una vez todos los productos y servicios de un comercio
 
-        muestraOpciones(menus.get("cuenta"))
+    Argumentos:
+    - tablas: dict(Table)
+    - regComercio: Record
+        Registro del comercio con el campo PRODUCTOS-SERVICIOS
 
-        opcion = input("\n").upper()
+    Retorna:
+    - Lista de registros de productos en el orden del comercio con los campos
+      NOMBRE, PRECIO, OTROS-GASTOS-MENSUALES, GESTIÓN y COMERCIO: [Record]'''
 
-        if opcion == "N":
-            clave = pedirClave()
-            if clave == atk or clave == "Joshua":
-                nuevaCuenta(tablas, reg)
-            operacionesCuenta(tablas, reg)
-        elif opcion == "B":
-            clave = pedirClave()
-            if clave == atk or clave == "Joshua":
-                borrarCuenta(tablas, reg)
-            operacionesCuenta(tablas, reg)
-        elif opcion == "O":
-            clave = pedirClave()
-            if clave == reg[0] or clave == "Joshua":
-                opcionesMovimientos(tablas, reg)
-            operacionesCuenta(tablas, reg)
-        elif opcion == "V":
-            # Volver al menú anterior
-            opcionesParticipante(tablas, reg)
-        else:
-            print('Comando inválido.')
-            time.sleep(1)
-            operacionesCuenta(tablas, reg)
+    listaProductos = regComercio["fields"].get("PRODUCTOS-SERVICIOS", [])
 
-    else:
+    productos, fallidos = traerRegistrosPorLotes(
+        tablas["PRODUCTOS-SERVICIOS"],
+        listaProductos,
+        campos=["NOMBRE", "PRECIO", "OTROS-GASTOS-MENSUALES", "GESTIÓN", "COMERCIO"],
+    )
 
-        print("\nEs necesario primero asignar un personaje.")
-        time.sleep(1)
-        opcionesParticipante(tablas, reg)
-        
+    return productos
 
-def opcionesMovimientos(tablas, reg):
-    '''Muestra opciones de los movimientos un pide opción'''
-
-    mostrarParticipante(tablas["PERSONAS"], reg)
-
-    muestraOpciones(menus.get("movimientos"))
-
-    opcion = input("\n").upper()
-
-    if opcion == "N":
-        clave = pedirClave()
-        if clave == reg[0] or clave == "Joshua":
-            nuevoMovimiento(tablas, reg)
-        opcionesMovimientos(tablas, reg)
-    elif opcion == "B":
-        clave = pedirClave()
-        if clave == reg[0] or clave == "Joshua":
-            borrarMovimiento(tablas, reg)
-        opcionesMovimientos(tablas, reg)
-    elif opcion == "M":
-        clave = pedirClave()
-        if clave == reg[0] or clave == "Joshua":
-            modificarMovimiento(tablas, reg)
-        opcionesMovimientos(tablas, reg)
-    elif opcion == "L":
-        listaMovimientos(tablas, reg)
-        opcionesMovimientos(tablas, reg)
-    elif opcion == "T":
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            borrarTodosMovimientos(tablas, reg)
-        opcionesMovimientos(tablas, reg)
-    elif opcion == "V":
-        # Volver al menú anterior
-        operacionesCuenta(tablas, reg)
-    else:
-        print('Comando inválido.')
-        time.sleep(1)
-        operacionesCuenta(tablas, reg)
 
+def abrirPrecarga(tablas, listaComercios):
+    '''Empieza a traer en segundo plano los catálogos de los comercios
+    según la sección [precarga] de conf.toml
 
-def mostrarReglasComercio(reg):
-    ''' Muestra las reglas de un comercio'''
+    Retorna: PrecargaCatalogo'''
 
-    print("\nReglas del comercio:")
-    print(reg["fields"].get("REGLAS"))
+    conf = cargarConfiguracion().get("precarga", dict())
+    hilos = cargarConfiguracion().get("planificador", dict()).get("concurrencia", CONCURRENCIA)
 
-def pedirDatosMovimiento(tablas):
-    '''Pide el concepto y el medio de pago'''
+    # Sin precarga el catálogo se pide al elegir el comercio
+    capacidad = conf.get("capacidad", 500) if conf.get("activo", True) else 0
 
-    concepto = []
-    medio = ""
-    lineas = ""
+    return PrecargaCatalogo(tablas, listaComercios, capacidad, hilos)
 
-    listaComercios = tablas["COMERCIOS"].all(sort=["NOMBRE"], fields=["NOMBRE", "PRODUCTOS-SERVICIOS"])
 
-    for regComercio in listaComercios:
-        try:
-            regComercio["fields"]["PRODUCTOS-SERVICIOS"]
-            nombre = regComercio["fields"]["NOMBRE"]
-            lineas += f'{listaComercios.index(regComercio)+1}. {nombre}.\n'
-        except KeyError:
-            # Ayuntamiento
-            pass
+def pedirComercio(listaComercios):
+    '''Pide la referencia de un comercio de la lista y la valida
 
-    print(lineas)
+    Retorna: Record del comercio elegido'''
 
     ref = 0
 
@@ -573,51 +2416,64 @@ def pedirDatosMovimiento(tablas):
             # Si responde con una letra, volver a preguntar
             ref = 0
 
-    regElegido = buscarRegistroDeCampoEnTabla(listaComercios, "NOMBRE", listaComercios[ref-1]["fields"]["NOMBRE"])
-    regComercioElegido = traerRegistroDeTabla(tablas["COMERCIOS"], regElegido)
+    # La lista de comercios ya trae todos los campos que se necesitan
+    return listaComercios[ref - 1]
 
-    mostrarReglasComercio(regComercioElegido)
 
-    # Pedir concepto
-    listaProductos = regComercioElegido["fields"]["PRODUCTOS-SERVICIOS"]
+def pedirDatosMovimiento(tablas):
+    '''Pide el concepto y el medio de pago'''
 
+    concepto = []
+    medio = ""
     lineas = ""
-    sinGasto = True
-    sinOtroGasto = True
-    
+
+    listaComercios = tablas["COMERCIOS"].all(sort=["NOMBRE"], fields=["NOMBRE", "PRODUCTOS-SERVICIOS", "REGLAS"])
+
+    for i, regComercio in enumerate(listaComercios):
+        try:
+            regComercio["fields"]["PRODUCTOS-SERVICIOS"]
+            nombre = regComercio["fields"]["NOMBRE"]
+            lineas += f'{i+1}. {nombre}.\n'
+        except KeyError:
+            # Ayuntamiento
+            pass
+
+    print(lineas)
+
+    # Mientras se elige comercio se van trayendo los catálogos
+    precarga = abrirPrecarga(tablas, listaComercios)
+
+    try:
+        regComercioElegido = pedirComercio(listaComercios)
+    finally:
+        # Los demás catálogos ya no hacen falta en este movimiento
+        precarga.cancelar()
+
+    comercio = regComercioElegido["fields"].get("NOMBRE")
+
+    mostrarReglasComercio(regComercioElegido)
+
     print("\nReuniendo información de productos y servicios...")
 
+    # Pedir concepto
+    listaProductos = precarga.catalogo(regComercioElegido)
+
     cabecera = ["OPCIÓN", "PRODUCTO/SERVICIO", "IMPORTE(€)"]
     ajuste = ["c", "l", "r"]
-    cosas = PrettyTable()
-    cosas.field_names = cabecera
-    for i, ajuste in enumerate(ajuste):
-        col = cabecera[i]
-        cosas.align[col] = ajuste 
-    cosas.set_style(PLAIN_COLUMNS)
-    
-    for regProducto in listaProductos:
+    cosas = nuevaTabla(cabecera, ajuste)
+
+    for i, registro in enumerate(listaProductos):
 
-        registro = traerRegistroDeTabla(tablas["PRODUCTOS-SERVICIOS"], [regProducto])
         producto = registro["fields"].get("NOMBRE")
         importe1 = registro["fields"].get("PRECIO")
-        if importe1:
-            sinGasto = False
-        else:
-            sinGasto = True
-
         importe2 = registro["fields"].get("OTROS-GASTOS-MENSUALES")
-        if importe2:
-            sinOtroGasto = False
-        else:
-            sinOtroGasto = True
 
-        if sinGasto:
-            cosas.add_row([listaProductos.index(regProducto)+1, producto, "--"])
-        elif sinOtroGasto:
-            cosas.add_row([listaProductos.index(regProducto)+1, producto, "{0:.2f}".format(importe1)])
+        if not importe1:
+            cosas.add_row([i+1, producto, "--"])
+        elif not importe2:
+            cosas.add_row([i+1, producto, "{0:.2f}".format(importe1)])
         else:
-            cosas.add_row([listaProductos.index(regProducto)+1, producto, "{0:.2f}".format(importe1 + importe2)])
+            cosas.add_row([i+1, producto, "{0:.2f}".format(importe1 + importe2)])
 
     print(cosas)
 
@@ -630,9 +2486,7 @@ def pedirDatosMovimiento(tablas):
             # Si no es entero, volver a preguntar
             num = 0
 
-    prod = traerRegistroDeTabla(tablas["PRODUCTOS-SERVICIOS"], [listaProductos[num - 1]])
-    regComercio = traerRegistroDeTabla(tablas["COMERCIOS"], prod["fields"].get("COMERCIO"))
-    comercio = regComercio["fields"].get("NOMBRE")
+    prod = listaProductos[num - 1]
     concepto = (prod, comercio)
 
     tipo = 0
@@ -652,55 +2506,72 @@ def pedirDatosMovimiento(tablas):
     return (concepto, medio)
 
 
-def pilaMov(tablaMovimientos, regCuenta):
-    '''Carga los movimientos de una cuenta en una pila'''
+def periodoActual():
+    '''Año y semana ISO y mes de hoy, para saber si una instantánea sigue al día'''
 
-    listaMovimientos = regCuenta["fields"].get("MOVIMIENTO")
+    hoy = datetime.date.today()
+    anio, semana, dia = hoy.isocalendar()
 
-    pila = Pila()
+    return (anio, semana, hoy.month)
 
-    # Número máximo de gestiones disponibles esta semana
-    # Grandes, 2; Medianas, 4; Pequeñas, 8
-    gestionabilidad = {
-        "GRANDE": int(2),
-        "MEDIANA": int(4),
-        "PEQUEÑA": int(8),
-    }
 
-    # Número de movimientos periódicos registrados
-    periodicosRegistrados = []
+def instantaneasCuentas(tablaMovimientos, regCuentas):
+    '''Devuelve las instantáneas de varias cuentas trayendo a la vez los
+    movimientos añadidos después de la marca de agua de cada una
 
-    for reg in listaMovimientos:
-        
-        try:
-            registro = tablaMovimientos.get(reg)
-            pila.apilar(registro)
+    Argumentos:
+    - tablaMovimientos: Table
+    - regCuentas: [Record]
 
-            # Calcular número de gestiones que queda en la semana
-            if registro["fields"].get("MISMA-SEMANA") == 1:
-                if registro["fields"].get("GESTIÓN")[0] == "GRANDE":
-                    gestionabilidad["GRANDE"] -= 1
-                elif registro["fields"].get("GESTIÓN")[0]== "MEDIANA":
-                    gestionabilidad["MEDIANA"] -= 1
-                elif registro["fields"].get("GESTIÓN")[0] == "PEQUEÑA":
-                    gestionabilidad["PEQUEÑA"] -= 1
-                    
-            frec = registro["fields"].get("FRECUENCIA")[0]
-            concepto = registro["fields"].get("CONCEPTO-LITERAL")[0]
-            numPeriodos = int(registro["fields"].get("TIEMPO-DESDE-MOVIMIENTO"))
+    Retorna:
+    - {id de cuenta: InstantaneaCuenta}
+    - Lista de movimientos que no se han podido traer: [str]
+        Las instantáneas de sus cuentas están incompletas; se volverán a
+        pedir la próxima vez'''
 
-            # Recoger movimientos periódicos registrados en una lista de diccionarios
-            if frec:
-                periodicosRegistrados.append({
-                    "CONCEPTO": concepto,
-                    "PERÍODOS": numPeriodos,
-                    "FRECUENCIA": frec,
-                })
-                
-        except TypeError:
-            pass
+    resultado = dict()
+    nuevos = dict() # id de cuenta: [id de movimiento]
+    fallidos = []
+
+    for regCuenta in regCuentas:
+        listaMovimientos = regCuenta["fields"].get("MOVIMIENTO") or []
+
+        instantanea = instantaneas.get(regCuenta["id"])
+
+        if not instantanea or not instantanea.vigente(listaMovimientos):
+            instantanea = InstantaneaCuenta(regCuenta["id"])
+            instantaneas[regCuenta["id"]] = instantanea
+
+        resultado[regCuenta["id"]] = instantanea
+        nuevos[regCuenta["id"]] = [reg for reg in listaMovimientos if reg not in instantanea.vistos]
+
+    pendientes = [reg for lista in nuevos.values() for reg in lista]
+
+    if pendientes:
+        registros, fallidos = traerRegistrosPorLotes(tablaMovimientos, pendientes)
+        porId = {registro["id"]: registro for registro in registros}
+        for idCuenta, lista in nuevos.items():
+            for reg in lista:
+                if reg in porId:
+                    resultado[idCuenta].agregar(porId[reg])
 
-    return (pila, gestionabilidad, periodicosRegistrados)
+    return (resultado, fallidos)
+
+
+def estadoCuenta(tablaMovimientos, regCuenta):
+    '''Calcula lo que dicen los movimientos de una cuenta trayendo solo los
+    añadidos después de la marca de agua de su instantánea
+
+    Retorna:
+    - Gestiones que quedan esta semana y contador de movimientos
+      periódicos por concepto
+    - Lista de movimientos que no se han podido traer: [str]'''
+
+    instantaneasPorCuenta, fallidos = instantaneasCuentas(tablaMovimientos, [regCuenta])
+    instantanea = instantaneasPorCuenta[regCuenta["id"]]
+
+    # Copias, para que los cambios de quien las use no alteren la instantánea
+    return (dict(instantanea.gestionabilidad), copy.deepcopy(instantanea.periodicos), fallidos)
 
 
 def prepararCuentas(tablas, reg):
@@ -711,7 +2582,7 @@ def prepararCuentas(tablas, reg):
     - Registro del participante: [str]
 
     Retorna:
-    - Diccionario con registros del participante, personaje y cuentas y pila con últimos movimientos'''
+    - Diccionario con registros del participante, personaje y cuentas y estado de la cuenta corriente'''
 
     regParticipante = traerRegistroDeTabla(tablas["PERSONAS"], reg)
     regEnlazado = regParticipante["fields"].get("PERSONAJE")
@@ -745,15 +2616,20 @@ def prepararCuentas(tablas, reg):
         except IndexError:
             regAhorro = None
 
-    pila, gestionabilidad, periodicosRegistrados = pilaMov(tablas["MOVIMIENTOS"], regCorriente)
+    # Solo se usan los movimientos de la cuenta corriente
+    if regCorriente:
+        gestionabilidad, periodicosRegistrados, fallidos = estadoCuenta(tablas["MOVIMIENTOS"], regCorriente)
+    else:
+        gestionabilidad, periodicosRegistrados, fallidos = (None, ContadorConceptos(), [])
 
     return {
         "CUENTAS": regCuentas,
         "PARTICIPANTE": regParticipante,
         "PROFESIÓN": regProfesion,
-        "MOVIMIENTOS": pila,
         "GESTIONABILIDAD": gestionabilidad,
         "PERIÓDICOS": periodicosRegistrados,
+        # Sin todos los movimientos no se sabe qué periódicos faltan
+        "PERIÓDICOS-COMPLETOS": not fallidos,
         "CUENTA-CORRIENTE": regCorriente,
         "CUENTA-TARJETA": regTarjeta,
         "CUENTA-JUBILACIÓN": regJubilacion,
@@ -761,41 +2637,26 @@ def prepararCuentas(tablas, reg):
     }
 
 
-def contarConceptos(tablaMovPeriodicos):
-    ''' Contar el número de conceptos y el número máximo de períodos transcurridos'''
-
-    marco = pd.DataFrame(tablaMovPeriodicos)
-    
-    marcoMax = pd.pivot_table(
-        marco,
-        values="PERÍODOS",
-        index=["CONCEPTO", "FRECUENCIA"],
-        aggfunc=["count", np.max]
-    )
-    
-    return marcoMax.droplevel(1, axis=1).rename(columns={
-        "count": "CUENTA",
-        "amax": "PENDIENTES",
-    })
-
-
-def anadirUltimosMovPeriodicos(tablas, datosPersona, lista):
-    ''' Crear registros de movimientos periódicos que faltan según el tiempo transcurrido desde el último movimiento periódico.
+def movimientosPendientes(indice, regCuenta, ocupacion, lista, informar=True):
+    ''' Campos de los movimientos periódicos que faltan en una cuenta corriente.
 
         Argumentos:
-        - tablas: dict(Table)
-            Diccionario de tablas de la base de datos.
-        - datosPersona: dict
-            Datos del personaje.
+        - indice: IndiceTabla
+            Índice de PRODUCTOS-SERVICIOS por NOMBRE y PRODUCTO-SERVICIO.
+        - regCuenta: Record
+            Cuenta corriente del personaje.
+        - ocupacion: str
+            Campo PERSONAJE del personaje, para encontrar su MENSUALIDAD.
         - lista: dict(dict)
-            Diccionario con los diccionarios de cada concepto el número de períodos y máximo:
             {(concepto, frecuencia): {"CUENTA": int, "PENDIENTES": int}}
+        - informar: bool
+            Mostrar cuántos movimientos faltan de cada concepto.
+
+        Retorna: [dict]
     '''
 
-    tablaConceptos = tablas["PRODUCTOS-SERVICIOS"]
-    tablaMovimientos = tablas["MOVIMIENTOS"]
-    buscadero = tablaConceptos.all(fields = ["NOMBRE", "PRODUCTO-SERVICIO"])
-    
+    movimientos = []
+
     for mov in lista:
 
         numMov = lista[mov]["PENDIENTES"] - lista[mov]["CUENTA"]
@@ -804,26 +2665,53 @@ def anadirUltimosMovPeriodicos(tablas, datosPersona, lista):
             
             concepto, frecuencia = mov
 
-            print(f"Añadiendo {numMov} movimientos pendientes de {concepto}...")
+            if informar:
+                print(f"Preparando {numMov} movimientos pendientes de {concepto}...")
             
             if concepto == "MENSUALIDAD":
-                ocupacion = datosPersona["PROFESIÓN"].get("fields").get("PERSONAJE")
-                regConcepto = buscarRegistroDeCampoEnTabla(buscadero, "PRODUCTO-SERVICIO", concepto+"|"+ocupacion)
+                regConcepto = indice.buscar("PRODUCTO-SERVICIO", concepto+"|"+(ocupacion or ""))
                 medio = "INGRESO"
             else:
-                regConcepto = buscarRegistroDeCampoEnTabla(buscadero, "NOMBRE", concepto)
+                regConcepto = indice.buscar("NOMBRE", concepto)
                 medio = "TALÓN"
-            regProducto = traerRegistroDeTabla(tablaConceptos, regConcepto)
-            regCuenta = datosPersona["CUENTA-CORRIENTE"]
+
+            if not regConcepto:
+                print(f"No existe el concepto {concepto}.")
+                continue
 
             campoMov = {
                 "CUENTA": [regCuenta["id"]],
-                "CONCEPTO": [regProducto["id"]],
+                "CONCEPTO": [regConcepto[0]],
                 "MEDIO": medio,
             }
-    
-            for i in range(numMov):
-                crearRegistroEnTabla(tablaMovimientos, campoMov)
+
+            movimientos += [dict(campoMov) for i in range(numMov)]
+
+    return movimientos
+
+
+def anadirUltimosMovPeriodicos(tablas, datosPersona, lista):
+    ''' Crear registros de movimientos periódicos que faltan según el tiempo transcurrido desde el último movimiento periódico.
+
+        Argumentos:
+        - tablas: dict(Table)
+            Diccionario de tablas de la base de datos.
+        - datosPersona: dict
+            Datos del personaje.
+        - lista: dict(dict)
+            Diccionario con los diccionarios de cada concepto el número de períodos y máximo:
+            {(concepto, frecuencia): {"CUENTA": int, "PENDIENTES": int}}
+    '''
+
+    indice = tablas["PRODUCTOS-SERVICIOS"].indice(["NOMBRE", "PRODUCTO-SERVICIO"])
+    ocupacion = datosPersona["PROFESIÓN"].get("fields").get("PERSONAJE")
+
+    # Todos los movimientos pendientes se crean juntos al final
+    movimientos = movimientosPendientes(indice, datosPersona["CUENTA-CORRIENTE"], ocupacion, lista)
+
+    if movimientos:
+        print(f"Añadiendo {len(movimientos)} movimientos pendientes...")
+        crearRegistrosEnTabla(tablas["MOVIMIENTOS"], movimientos)
             
 
 def registrarMovPeriodicosPendientes(tablas, datosPersona):
@@ -831,32 +2719,85 @@ def registrarMovPeriodicosPendientes(tablas, datosPersona):
         periódicos que no se hayan registrado en la tabla MOVIMIENTOS. Comprobar y registrar
         movimientos pendientes.'''
 
-    tablaMovPeriodicos = datosPersona["PERIÓDICOS"]
+    # El número de cada concepto y el máximo de períodos transcurridos ya
+    # se han contado al cargar los movimientos en estadoCuenta
+    periodicosRegistrados = datosPersona["PERIÓDICOS"]
 
-    if not tablaMovPeriodicos:
+    if not datosPersona["PERIÓDICOS-COMPLETOS"]:
+        # Con movimientos sin contar se repetirían mensualidades y cargos
+        print("\nNo se han podido traer todos los movimientos; los periódicos pendientes se añadirán la próxima vez.")
         return
-    else:
 
-        # Contamos el número de cada concepto y el número máximo de períodos trasncurridos
-        marcoConceptos = contarConceptos(tablaMovPeriodicos)
+    if not periodicosRegistrados.conceptos:
+        return
+    else:
 
         # Comparamos con el número de meses o semanas del último movimiento periódico
         # Si coincide entonces no hay que hacer nada (nos quedamos con los distintos)
-        marcoDistintos = marcoConceptos[marcoConceptos.CUENTA != marcoConceptos.PENDIENTES]
-        
         # Si el número de meses o semanas desde el último movimiento es superior al número de conceptos
         # entonces hay que añadir tantos movimientos como la diferencia para igualarlo al número de conceptos
-        listaMovDistintos = marcoDistintos.to_dict("index")
+        listaMovDistintos = periodicosRegistrados.distintos()
 
         anadirUltimosMovPeriodicos(tablas, datosPersona, listaMovDistintos)
 
         
-def clonarMarco(marco):
-    '''Copia un marco (dataFrame)'''
+def nominaSemanal(tablas):
+    ''' Añade de una vez a todos los personajes las mensualidades y los cargos
+        periódicos pendientes, para que no tenga que hacerlo el primer
+        movimiento de cada participante.
+
+        Retorna: número de movimientos creados'''
+
+    print("\nReuniendo las cuentas corrientes de la clase...")
+
+    ocupaciones = {
+        reg["id"]: reg["fields"].get("PERSONAJE")
+        for reg in tablas["PERSONAJES"].all(fields=["PERSONAJE"])
+    }
+    regCorrientes = [
+        reg for reg in tablas["CUENTAS"].all(
+            formula="{TIPO-CUENTA}='CORRIENTE'",
+            fields=["TIPO-CUENTA", "PERSONAJE", "MOVIMIENTO"],
+        )
+        if reg["fields"].get("PERSONAJE")
+    ]
+
+    if not regCorrientes:
+        print("No hay ninguna cuenta corriente.")
+        return 0
+
+    # Los movimientos de todas las cuentas se traen juntos, en lotes paralelos
+    print(f"Calculando los movimientos pendientes de {len(regCorrientes)} cuenta(s)...")
+    instantaneasPorCuenta, fallidos = instantaneasCuentas(tablas["MOVIMIENTOS"], regCorrientes)
+    indice = tablas["PRODUCTOS-SERVICIOS"].indice(["NOMBRE", "PRODUCTO-SERVICIO"])
+
+    movimientos = []
+    omitidas = 0
+
+    for regCuenta in regCorrientes:
+        # Sin todos sus movimientos se contarían de menos las mensualidades
+        # y los cargos ya registrados, y se volverían a crear
+        if not set(regCuenta["fields"].get("MOVIMIENTO") or []).isdisjoint(fallidos):
+            omitidas += 1
+            continue
+        ocupacion = ocupaciones.get(regCuenta["fields"]["PERSONAJE"][0])
+        distintos = instantaneasPorCuenta[regCuenta["id"]].periodicos.distintos()
+        movimientos += movimientosPendientes(indice, regCuenta, ocupacion, distintos, informar=False)
+
+    if omitidas:
+        print(f"Se omiten {omitidas} cuenta(s) cuyos movimientos no se han podido traer; vuelve a ejecutar la nómina.")
+
+    if not movimientos:
+        print("No hay movimientos pendientes.")
+        return 0
+
+    print(f"Añadiendo {len(movimientos)} movimientos pendientes...")
+    creados, fallidos = crearRegistrosEnTabla(tablas["MOVIMIENTOS"], movimientos, informar=False, paralelo=True)
+    print(f"Creados {len(creados)} de {len(movimientos)} movimientos.")
+
+    return len(creados)
 
-    return pd.DataFrame(marco.values.copy(), marco.index.copy(), marco.columns.copy()).infer_objects()
 
-        
 def nuevoMovimiento(tablas, reg):
     '''Crea un nuevo movimiento en la cuenta'''
 
@@ -864,7 +2805,7 @@ def nuevoMovimiento(tablas, reg):
     datosPersona = prepararCuentas(tablas, reg)
     regCuentas = datosPersona.get("CUENTAS")
     regParticipante = datosPersona.get("PARTICIPANTE")
-    regProfesion = datosPersona.get("PROFESION")
+    regProfesion = datosPersona.get("PROFESIÓN")
 
     if not regCuentas:
         return
@@ -1022,10 +2963,10 @@ def nuevoMovimiento(tablas, reg):
                 "MEDIO": pago,
                 "IMPORTE-PARTICULAR": importe,
             }
-            # Crear movimientos
-            regMovCorriente = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoCorriente)
-            datosPersona["GESTIONABILIDAD"][gestion] -= 1
-            regMovTarjeta = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoTarjeta)
+            # Crear los dos movimientos en una sola petición
+            regMovCorriente, regMovTarjeta = crearTraspaso(tablas["MOVIMIENTOS"], campoMovimientoCorriente, campoMovimientoTarjeta)
+            if regMovCorriente:
+                datosPersona["GESTIONABILIDAD"][gestion] -= 1
 
         elif jubilacion:
 
@@ -1043,10 +2984,10 @@ def nuevoMovimiento(tablas, reg):
                 "MEDIO": pago,
                 "IMPORTE-PARTICULAR": importe,
             }
-            # Crear movimientos
-            regMovCorriente = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoCorriente)
-            datosPersona["GESTIONABILIDAD"][gestion] -= 1
-            regMovJubilacion = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoJubilacion)
+            # Crear los dos movimientos en una sola petición
+            regMovCorriente, regMovJubilacion = crearTraspaso(tablas["MOVIMIENTOS"], campoMovimientoCorriente, campoMovimientoJubilacion)
+            if regMovCorriente:
+                datosPersona["GESTIONABILIDAD"][gestion] -= 1
 
         elif ahorro:
             
@@ -1064,10 +3005,10 @@ def nuevoMovimiento(tablas, reg):
                 "MEDIO": pago,
                 "IMPORTE-PARTICULAR": importe,
             }
-            # Crear movimientos
-            regMovCorriente = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoCorriente)
-            datosPersona["GESTIONABILIDAD"][gestion] -= 1
-            regMovAhorro = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoAhorro)
+            # Crear los dos movimientos en una sola petición
+            regMovCorriente, regMovAhorro = crearTraspaso(tablas["MOVIMIENTOS"], campoMovimientoCorriente, campoMovimientoAhorro)
+            if regMovCorriente:
+                datosPersona["GESTIONABILIDAD"][gestion] -= 1
 
         else:
 
@@ -1079,9 +3020,11 @@ def nuevoMovimiento(tablas, reg):
             }
             # Crear registro
             regMovCorriente = crearRegistroEnTabla(tablas["MOVIMIENTOS"], campoMovimientoCorriente)
-            datosPersona["GESTIONABILIDAD"][gestion] -= 1
+            if regMovCorriente:
+                datosPersona["GESTIONABILIDAD"][gestion] -= 1
 
-        print("\nMovimiento registrado correctamente.")
+        if regMovCorriente:
+            print("\nMovimiento registrado correctamente.")
 
     return
 
@@ -1089,14 +3032,9 @@ def nuevoMovimiento(tablas, reg):
 def mostrarCuentas(regCuentas):
     '''Mostrar lista de cuentas'''
 
-    lista = PrettyTable()
     campos = ["OPCIÓN", "NÚMERO", "TIPO", "SALDO"]
-    lista.field_names = campos
     ajustes = ("c", "c", "c", "r")
-    for i, ajuste in enumerate(ajustes):
-        col = campos[i]
-        lista.align[col] = ajuste
-    lista.set_style(PLAIN_COLUMNS)
+    lista = nuevaTabla(campos, ajustes)
 
     for i, reg in enumerate(regCuentas):
         lista.add_row([i+1, reg["fields"].get("NÚMERO-CUENTA"), reg["fields"].get("TIPO-CUENTA"), "{0:.2f}".format(reg["fields"].get("SALDO"))])
@@ -1134,12 +3072,7 @@ def elegirMovimiento(tablas, regCuenta):
     # Preparar estilo de tabla
     cabecera = ["OPCIÓN", "MOVIMIENTO", "MEDIO", "COMERCIANTE", "CONCEPTO", "IMPORTE(€)", "SALDO(€)"]
     ajustes = ["c", "c", "c", "c", "l", "r", "r"]
-    mov = PrettyTable()
-    mov.field_names = cabecera
-    mov.set_style(PLAIN_COLUMNS)
-    for i, ajuste in enumerate(ajustes):
-        col = cabecera[i]
-        mov.align[col] = ajuste
+    mov = nuevaTabla(cabecera, ajustes)
 
     saldo: float = 0
 
@@ -1244,11 +3177,170 @@ def modificarMovimiento(tablas, reg):
             importe = regMovimiento["fields"].get("IMPORTE")
             importeDevuelto = importe - importe * 0.04
             modificarCampo(tablas["MOVIMIENTOS"], "IMPORTE-PARTICULAR", -importeDevuelto, [regMovimiento["id"]])
+            # El importe ha cambiado, la instantánea de la cuenta ya no sirve
+            instantaneas.pop(regCuentaElegida["id"], None)
             print("\nProducto devuelto con una penalización de un 4%.")
         else: print("\nRegistro no modificado.")
 
-def listaMovimientos(tablas, reg):
-    '''Mostrar todos los movimientos de una cuenta'''
+def pedirFecha(pregunta):
+    '''Pide una fecha AAAA-MM-DD; vacío si no se quiere indicar
+
+    Retorna: datetime.date o None'''
+
+    while True:
+        texto = input(pregunta).strip()
+        if not texto:
+            return None
+        try:
+            return datetime.date.fromisoformat(texto)
+        except ValueError:
+            print("La fecha debe tener el formato AAAA-MM-DD.")
+
+
+def pedirFiltroMovimientos():
+    '''Pide las fechas y el concepto por los que filtrar los movimientos
+
+    Retorna: {"desde": date, "hasta": date, "concepto": str}'''
+
+    return {
+        "desde": pedirFecha("Desde la fecha (AAAA-MM-DD, vacío sin límite): "),
+        "hasta": pedirFecha("Hasta la fecha (AAAA-MM-DD, vacío sin límite): "),
+        "concepto": normalizarTexto(input("Concepto que contiene (vacío para todos): ").strip()),
+    }
+
+
+def cumpleFiltro(registro, filtro):
+    '''Comprueba si un movimiento cumple el filtro de pedirFiltroMovimientos'''
+
+    if not filtro:
+        return True
+
+    if filtro.get("desde") or filtro.get("hasta"):
+        fecha = fechaDeRegistro(registro)
+        if filtro.get("desde") and fecha < filtro["desde"]:
+            return False
+        if filtro.get("hasta") and fecha > filtro["hasta"]:
+            return False
+
+    if filtro.get("concepto"):
+        concepto = textoDeCampo(registro["fields"].get("CONCEPTO-LITERAL"))
+        if filtro["concepto"] not in normalizarTexto(concepto):
+            return False
+
+    return True
+
+
+def lotesDeMovimientos(tablaMovimientos, listaReg):
+    '''Generador de lotes de movimientos en el orden de listaReg. Mientras
+    se usa un lote, el siguiente se va trayendo en segundo plano
+
+    Retorna: lista de no recuperados al terminar (valor de StopIteration)'''
+
+    lotes = [listaReg[i:i + LOTE_LECTURA] for i in range(0, len(listaReg), LOTE_LECTURA)]
+    fallidos = []
+
+    if not lotes:
+        return fallidos
+
+    accion = metricas.accionActual()
+
+    def traer(lote):
+        with metricas.enAccion(accion):
+            return traerRegistrosPorLotes(tablaMovimientos, lote)
+
+    grupo = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="extracto")
+
+    try:
+        siguiente = grupo.submit(traer, lotes[0])
+        for i in range(len(lotes)):
+            registros, noRecuperados = siguiente.result()
+            if i + 1 < len(lotes):
+                siguiente = grupo.submit(traer, lotes[i + 1])
+            fallidos += noRecuperados
+            yield registros
+    finally:
+        # Si se deja de leer, no se trae nada más
+        grupo.shutdown(wait=False, cancel_futures=True)
+
+    return fallidos
+
+
+def extractoMovimientos(tablaMovimientos, listaReg, filtro=None, tamanoPagina=20):
+    '''Muestra los movimientos por páginas con el saldo acumulado. La
+    primera página sale en cuanto llega su lote, sin esperar al resto
+
+    Argumentos:
+    - tablaMovimientos: Table
+    - listaReg: [str]
+        Movimientos de la cuenta en orden
+    - filtro: dict de pedirFiltroMovimientos o None
+        El saldo es el de la cuenta, aunque se oculten movimientos
+    - tamanoPagina: int
+
+    Retorna: número de movimientos mostrados'''
+
+    cabecera = ["MOVIMIENTO", "MEDIO", "MERCADER", "CONCEPTO-LITERAL", "IMPORTE(€)", "SALDO(€)"]
+    ajuste = ["c", "c", "l", "l", "r", "r"]
+
+    saldo = 0.0
+    filas = []
+    mostrados = 0
+    lotes = lotesDeMovimientos(tablaMovimientos, listaReg)
+
+    def mostrarPagina():
+        pagina = nuevaTabla(cabecera, ajuste)
+        pagina.add_rows(filas)
+        print(pagina)
+        filas.clear()
+
+    while True:
+        try:
+            registros = next(lotes)
+        except StopIteration as fin:
+            fallidos = fin.value
+            break
+
+        # Saldo acumulado del lote de una sola pasada, partiendo del anterior
+        importes = [registro["fields"].get("IMPORTE") or 0 for registro in registros]
+        saldos = list(itertools.accumulate(importes, initial=saldo))[1:]
+        saldo = saldos[-1] if saldos else saldo
+
+        for registro, importe, saldoLinea in zip(registros, importes, saldos):
+            if not cumpleFiltro(registro, filtro):
+                continue
+
+            # La página llena se muestra cuando se sabe que hay más movimientos,
+            # para no ofrecer una página siguiente vacía
+            if len(filas) == tamanoPagina:
+                mostrarPagina()
+                respuesta = input("\n[Intro] siguiente página, [S] salir: ").strip().upper()
+                if respuesta == "S":
+                    lotes.close()
+                    return mostrados
+
+            comercio = registro["fields"].get("MERCADER")
+            concepto = registro["fields"].get("CONCEPTO-LITERAL")
+            filas.append([
+                registro["fields"].get("MOVIMIENTO"),
+                registro["fields"].get("MEDIO"),
+                comercio[0] if comercio else None,
+                concepto[0] if concepto else None,
+                "{0:.2f}".format(importe),
+                "{0:.2f}".format(saldoLinea),
+            ])
+            mostrados += 1
+
+    if filas:
+        mostrarPagina()
+
+    if fallidos:
+        print(f"\nNo se han podido recuperar {len(fallidos)} movimiento(s); el saldo no los incluye.")
+
+    return mostrados
+
+
+def listaMovimientos(tablas, reg, filtro=None):
+    '''Mostrar todos los movimientos de una cuenta, o los que cumplan el filtro'''
 
     regParticipante = traerRegistroDeTabla(tablas["PERSONAS"], reg)
     regPersonaje = traerRegistroDeTabla(tablas["PERSONAJES"], regParticipante["fields"]["PERSONAJE"])
@@ -1260,39 +3352,20 @@ def listaMovimientos(tablas, reg):
 
     regCorriente = [r for r in regCuentas if r["fields"]["TIPO-CUENTA"] == "CORRIENTE"][0]
 
-    regMovimientos = traerRegistros(tablas["MOVIMIENTOS"], regCorriente["fields"].get("MOVIMIENTO"))
+    listaReg = regCorriente["fields"].get("MOVIMIENTO")
 
-    if not regMovimientos:
+    if not listaReg:
         print("\nLa cuenta no tiene ningún movimiento.")
         return
 
-    cabecera = ["MOVIMIENTO", "MEDIO", "MERCADER", "CONCEPTO-LITERAL", "IMPORTE(€)", "SALDO(€)"]
-    ajuste = ["c", "c", "l", "l", "r", "r"]
-    movimientos = PrettyTable()
-    movimientos.field_names = cabecera
-    for i, ajuste in enumerate(ajuste):
-        col = cabecera[i]
-        movimientos.align[col] = ajuste       
-    movimientos.set_style(PLAIN_COLUMNS)
-    
-    saldo: float = 0    
-
-    for linea in regMovimientos:
+    tamanoPagina = cargarConfiguracion().get("extracto", dict()).get("pagina", 20)
 
-        num = linea["fields"].get("MOVIMIENTO")
-        medio = linea["fields"].get("MEDIO")
-        comercio = linea["fields"].get("MERCADER")
-        if comercio: comercio = comercio[0]
-        concepto = linea["fields"].get("CONCEPTO-LITERAL")[0]
-        importe = linea["fields"].get("IMPORTE")
-        saldo += importe
-        
-        movimientos.add_row([num, medio, comercio, concepto, "{0:.2f}".format(importe), "{0:.2f}".format(saldo)])
+    if not extractoMovimientos(tablas["MOVIMIENTOS"], listaReg, filtro, tamanoPagina):
+        print("\nNingún movimiento cumple el filtro." if filtro else "\nLa cuenta no tiene ningún movimiento.")
 
-    print(movimientos)
     print("\n")
 
-    
+
 def borrarTodosMovimientos(tablas, reg):
     '''Borra todos los movimientos de una cuenta'''
 
@@ -1313,16 +3386,38 @@ def borrarTodosMovimientos(tablas, reg):
         
         respuesta = input("\n"+f'¿Seguro que quieres borrar todos los movimientos? (S/N): ').upper()
         if respuesta == "S":
-            for mov in listaCuentas:
-                borrarRegistroDeTabla(tablas["MOVIMIENTOS"], [mov])
-            print("Registros borrados.")
+            if vaciarCuenta(tablas, regCuenta):
+                print("Registros borrados.")
         else: print("Registros no borrados.")
+
+
+def vaciarCuenta(tablas, regCuenta):
+    '''Borra todos los movimientos de una cuenta en lotes
+
+    Retorna: True si se han borrado todos, False si queda alguno'''
+
+    listaMovimientos = regCuenta["fields"].get("MOVIMIENTO", [])
+
+    borrados, noBorrados = borrarRegistrosDeTabla(tablas["MOVIMIENTOS"], listaMovimientos)
+
+    if noBorrados:
+        print(f"\nSe han borrado {len(borrados)} movimientos, no se han podido borrar {len(noBorrados)}:")
+        for reg in noBorrados:
+            print(reg)
+        print("Vuelve a intentarlo para terminar de vaciar la cuenta.")
+        return False
+
+    return True
         
 
 def comprobarPersonaje(tabla, reg):
     ''' Comprueba si el participante tiene personaje asignado'''
 
     regParticipante = traerRegistroDeTabla(tabla, reg)
+
+    if not regParticipante:
+        return None
+
     regPersonaje = regParticipante["fields"].get("PERSONAJE")
 
     return regPersonaje
@@ -1332,7 +3427,7 @@ def nuevaCuenta(tablas, reg):
     '''Crear una nueva cuenta corriente y de tarjeta de crédito para un participante'''
     
     # Comprobar si ya tiene cuenta
-    regEnlazado = comprobarPersonaje(tablas["PERSONAJES"], reg)
+    regEnlazado = comprobarPersonaje(tablas["PERSONAS"], reg)
 
     # Comprobar que tiene personaje asignado
     if regEnlazado:
@@ -1351,18 +3446,15 @@ def nuevaCuenta(tablas, reg):
             for cuenta in regCuentas:
                 print(f'El personaje {regProfesion["fields"]["DENOMINACIÓN"]} ya tiene la cuenta {cuenta["fields"]["TIPO-CUENTA"]} número {cuenta["fields"]["NÚMERO-CUENTA"]}.')
                 if cuenta["fields"]["TIPO-CUENTA"] == "JUBILACIÓN":
-                    tieneCuentaJubilacion == True
+                    tieneCuentaJubilacion = True
                 elif cuenta["fields"]["TIPO-CUENTA"] == "AHORRO":
-                    tieneCuentaAhorro == True
+                    tieneCuentaAhorro = True
                     
         else:
 
             # Crear registro de nueva cuenta corriente y de tarjeta de crédito
 
-            campoCuenta = {
-                "PERSONAJE": [regProfesion["id"]],
-                "TIPO-CUENTA": "CORRIENTE",
-            }
+            campoCuenta = camposCuenta(regProfesion["id"], "CORRIENTE")
 
             try:
                 regCorriente = crearRegistroEnTabla(tablas["CUENTAS"], campoCuenta)
@@ -1371,11 +3463,7 @@ def nuevaCuenta(tablas, reg):
                 print("\nNo se ha podido crear el registro de la cuenta corriente.")
                 return
 
-            campoCuentaTarjeta = {
-                "PERSONAJE": [regProfesion["id"]],
-                "PERSONAJE-TARJETA": [regProfesion["id"]],
-                "TIPO-CUENTA": "TARJETA",
-            }
+            campoCuentaTarjeta = camposCuenta(regProfesion["id"], "TARJETA")
 
             try:
                 regTarjeta = crearRegistroEnTabla(tablas["CUENTAS"], campoCuentaTarjeta)
@@ -1397,17 +3485,19 @@ def nuevaCuenta(tablas, reg):
 
             regSalario = crearRegistroEnTabla(tablas["PRODUCTOS-SERVICIOS"], regMensualidad)
 
+            if not regSalario:
+                print("\nLas cuentas están creadas, pero falta la primera mensualidad y la deuda de la tarjeta.")
+                return
+
             regMes = {
                 "CUENTA": [regCorriente["id"]],
                 "CONCEPTO": [regSalario["id"]],
                 "MEDIO": "INGRESO",
             }
 
-            crearRegistroEnTabla(tablas["MOVIMIENTOS"], regMes)
-
             # Poner deuda en la cuenta de la tarjeta de crédito
-            buscadero = tablas["PRODUCTOS-SERVICIOS"].all(fields="NOMBRE")
-            regConcepto = buscarRegistroDeCampoEnTabla(buscadero, "NOMBRE", "PAGO DEUDA TARJETA")
+            indice = tablas["PRODUCTOS-SERVICIOS"].indice(["NOMBRE", "PRODUCTO-SERVICIO"])
+            regConcepto = indice.buscar("NOMBRE", "PAGO DEUDA TARJETA")
             importeDeuda = regOcupacion["fields"]["DEUDA-TARJETA-CRÉDITO"]
             
             regMov = {
@@ -1417,7 +3507,8 @@ def nuevaCuenta(tablas, reg):
                 "IMPORTE-PARTICULAR": -importeDeuda,
             }
 
-            crearRegistroEnTabla(tablas["MOVIMIENTOS"], regMov)
+            # Primera mensualidad y deuda de la tarjeta en una sola petición
+            crearRegistrosEnTabla(tablas["MOVIMIENTOS"], [regMes, regMov], informar=False)
 
         if not tieneCuentaAhorro:
 
@@ -1432,11 +3523,7 @@ def nuevaCuenta(tablas, reg):
 
             if ahorro == "S":
 
-                campoAhorro = {
-                    "PERSONAJE": [regProfesion["id"]],
-                    "PERSONAJE-AHORRO": [regProfesion["id"]],
-                    "TIPO-CUENTA": "AHORRO",
-                }
+                campoAhorro = camposCuenta(regProfesion["id"], "AHORRO")
 
                 try:
                     regAhorro = crearRegistroEnTabla(tablas["CUENTAS"], campoAhorro)
@@ -1458,11 +3545,7 @@ def nuevaCuenta(tablas, reg):
 
             if jubilacion == "S":
 
-                campoJubilacion = {
-                    "PERSONAJE": [regProfesion["id"]],
-                    "PERSONAJE-JUBILACIÓN": [regProfesion["id"]],
-                    "TIPO-CUENTA": "JUBILACIÓN",
-                }
+                campoJubilacion = camposCuenta(regProfesion["id"], "JUBILACIÓN")
 
                 try:
                     regJubilacion = crearRegistroEnTabla(tablas["CUENTAS"], campoJubilacion)
@@ -1476,41 +3559,159 @@ def nuevaCuenta(tablas, reg):
         print("\nEs necesario asignar primero un personaje.")
     
 
-def comienzo(regParticipante):
-    '''Pregunta comandos del menú principal y ejecuta las opciones'''
+def camposCuenta(idPersonaje, tipo):
+    '''Campos de una cuenta nueva del personaje según su tipo
 
-    tablas = cargarBase()
-    
-    muestraOpciones(menus.get("principal"))
+    Retorna: dict'''
 
-    opcion = input("\n").upper()
+    campos = {
+        "PERSONAJE": [idPersonaje],
+        "TIPO-CUENTA": tipo,
+    }
 
-    if opcion not in menus.get("principal").keys():
-        print('Comando inválido')
-        time.sleep(1)
-        comienzo(regParticipante)
-    elif opcion == 'C':
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            regParticipante = crearParticipante(tablas["PERSONAS"])
-            print("Registro creado correctamente.")
-        comienzo(regParticipante)
-    elif opcion == 'L':
-        listaParticipantes(tablas["PERSONAS"])
-        comienzo(regParticipante)
-    elif opcion == 'R':
-        regParticipante = buscarParticipante(tablas["PERSONAS"])
-        if regParticipante:
-            opcionesParticipante(tablas, regParticipante)
-        comienzo(regParticipante)
-    elif opcion == 'S':
-        # Validar salida y terminar guión
-        clave = pedirClave()
-        if clave == atk or clave == "Joshua":
-            os._exit(1)
-        else:
-            comienzo(regParticipante)
-        
+    if CAMPOS_TIPO_CUENTA.get(tipo):
+        campos[CAMPOS_TIPO_CUENTA[tipo]] = [idPersonaje]
+
+    return campos
+
+
+def prepararClase(tablas):
+    '''Asigna personajes libres a los participantes que no tienen y abre las
+    cuentas que les falten, todo con escrituras por lotes
+
+    Lo que hay que hacer se deduce en cada paso de lo que ya está en la base
+    de datos, así que si se interrumpe basta con volver a lanzarlo. Por eso
+    las cuentas se abren a todos los personajes con participante, no solo a
+    los asignados en esta vez.
+
+    Retorna: número de registros creados o modificados'''
+
+    hechos = 0
+    fallos = 0
+
+    # 1. Personajes libres para los participantes sin personaje
+    print("\nReuniendo participantes y personajes...")
+
+    participantes = tablas["PERSONAS"].all(sort=["NOMBRE COMPLETO"], fields=["NOMBRE COMPLETO", "PERSONAJE"])
+    personajes = tablas["PERSONAJES"].all(sort=["REFERENCIA"], fields=["REFERENCIA", "PARTICIPANTE", "OCUPACIÓN1"])
+
+    sinPersonaje = [reg for reg in participantes if not reg["fields"].get("PERSONAJE")]
+    libres = [reg for reg in personajes if not reg["fields"].get("PARTICIPANTE")]
+    asignados = {reg["id"] for reg in personajes if reg["fields"].get("PARTICIPANTE")}
+
+    if sinPersonaje and not libres:
+        print(f"No queda ningún personaje libre para {len(sinPersonaje)} participante(s).")
+    elif sinPersonaje:
+        if len(libres) < len(sinPersonaje):
+            print(f"Solo hay {len(libres)} personaje(s) libre(s) para {len(sinPersonaje)} participante(s).")
+        respuesta = input(f"\n¿Asignar personaje a {min(len(libres), len(sinPersonaje))} participante(s)? [S/N]: ").strip().upper()
+        if respuesta != "S":
+            print("Asignación cancelada.")
+            return hechos
+        cambios = [
+            {"id": regParticipante["id"], "fields": {"PERSONAJE": [regPersonaje["id"]]}}
+            for regParticipante, regPersonaje in zip(sinPersonaje, libres)
+        ]
+        actualizados, fallidos = actualizarRegistrosEnTabla(tablas["PERSONAS"], cambios)
+        hechos += len(actualizados)
+        fallos += len(fallidos)
+        asignados.update(reg["fields"]["PERSONAJE"][0] for reg in actualizados if reg["fields"].get("PERSONAJE"))
+    else:
+        print("Todos los participantes tienen personaje.")
+
+    if not asignados:
+        return hechos
+
+    # 2. Cuentas que faltan a los personajes asignados
+    print(f"\nSe abrirán las cuentas que falten a los {len(asignados)} personaje(s) con participante, no solo a los asignados ahora.")
+    tipos = ["CORRIENTE", "TARJETA"]
+    if input("\n¿Abrir también cuentas del plan de ahorro? [S/N]: ").strip().upper() == "S":
+        tipos.append("AHORRO")
+    if input("¿Abrir también cuentas del plan de jubilación? [S/N]: ").strip().upper() == "S":
+        tipos.append("JUBILACIÓN")
+
+    cuentas = tablas["CUENTAS"].all(fields=["PERSONAJE", "TIPO-CUENTA", "MOVIMIENTO"])
+    cuentaDe = dict() # (id del personaje, tipo): Record
+    for regCuenta in cuentas:
+        for idPersonaje in regCuenta["fields"].get("PERSONAJE") or []:
+            cuentaDe[(idPersonaje, regCuenta["fields"].get("TIPO-CUENTA"))] = regCuenta
+
+    nuevas = [
+        camposCuenta(idPersonaje, tipo)
+        for idPersonaje in sorted(asignados) for tipo in tipos
+        if (idPersonaje, tipo) not in cuentaDe
+    ]
+
+    if nuevas:
+        print(f"\nAbriendo {len(nuevas)} cuenta(s)...")
+        creadas, fallidas = crearRegistrosEnTabla(tablas["CUENTAS"], nuevas)
+        hechos += len(creadas)
+        fallos += len(fallidas)
+        for regCuenta in creadas:
+            cuentaDe[(regCuenta["fields"]["PERSONAJE"][0], regCuenta["fields"]["TIPO-CUENTA"])] = regCuenta
+
+    # 3. Concepto MENSUALIDAD de cada personaje con cuenta corriente
+    conCorriente = [idPersonaje for idPersonaje in sorted(asignados) if (idPersonaje, "CORRIENTE") in cuentaDe]
+
+    mensualidades = {
+        reg["fields"]["PERSONAJE"][0]: reg
+        for reg in tablas["PRODUCTOS-SERVICIOS"].all(formula="{NOMBRE}='MENSUALIDAD'", fields=["NOMBRE", "PERSONAJE"])
+        if reg["fields"].get("PERSONAJE")
+    }
+
+    faltan = [
+        {"PERSONAJE": [idPersonaje], "NOMBRE": "MENSUALIDAD", "PERIÓDICO": True, "FRECUENCIA": "MENSUAL"}
+        for idPersonaje in conCorriente if idPersonaje not in mensualidades
+    ]
+
+    if faltan:
+        print(f"\nCreando {len(faltan)} concepto(s) de mensualidad...")
+        creados, fallidos = crearRegistrosEnTabla(tablas["PRODUCTOS-SERVICIOS"], faltan)
+        hechos += len(creados)
+        fallos += len(fallidos)
+        for regSalario in creados:
+            mensualidades[regSalario["fields"]["PERSONAJE"][0]] = regSalario
+
+    # 4. Primera mensualidad y deuda de la tarjeta en las cuentas sin movimientos
+    deudas = {
+        reg["id"]: reg["fields"].get("DEUDA-TARJETA-CRÉDITO") or 0
+        for reg in tablas["PROFESIONES"].all(fields=["DEUDA-TARJETA-CRÉDITO"])
+    }
+    ocupaciones = {reg["id"]: (reg["fields"].get("OCUPACIÓN1") or [None])[0] for reg in personajes}
+    indice = tablas["PRODUCTOS-SERVICIOS"].indice(["NOMBRE", "PRODUCTO-SERVICIO"])
+    regConcepto = indice.buscar("NOMBRE", "PAGO DEUDA TARJETA")
+
+    movimientos = []
+
+    for idPersonaje in sorted(asignados):
+        regCorriente = cuentaDe.get((idPersonaje, "CORRIENTE"))
+        regTarjeta = cuentaDe.get((idPersonaje, "TARJETA"))
+        if regCorriente and not regCorriente["fields"].get("MOVIMIENTO") and idPersonaje in mensualidades:
+            movimientos.append({
+                "CUENTA": [regCorriente["id"]],
+                "CONCEPTO": [mensualidades[idPersonaje]["id"]],
+                "MEDIO": "INGRESO",
+            })
+        if regTarjeta and not regTarjeta["fields"].get("MOVIMIENTO") and regConcepto:
+            movimientos.append({
+                "CUENTA": [regTarjeta["id"]],
+                "CONCEPTO": regConcepto,
+                "MEDIO": "TARJETA-CRÉDITO",
+                "IMPORTE-PARTICULAR": -deudas.get(ocupaciones.get(idPersonaje), 0),
+            })
+
+    if movimientos:
+        print(f"\nAñadiendo {len(movimientos)} movimiento(s) iniciales...")
+        creados, fallidos = crearRegistrosEnTabla(tablas["MOVIMIENTOS"], movimientos)
+        hechos += len(creados)
+        fallos += len(fallidos)
+
+    if fallos:
+        print(f"\nNo se han podido guardar {fallos} registro(s): vuelve a preparar la clase para completarla.")
+    else:
+        print(f"\nClase preparada: {len(asignados)} personaje(s) con participante.")
+
+    return hechos
 
 
 def borrarPersonaje(tablas, reg):
@@ -1556,17 +3757,40 @@ def borrarCuenta(tablas, reg):
     
     if regCuenta["fields"].get("MOVIMIENTO"):
         
-        print("\nEs necesario eliminar los movimientos antes de borrar la cuenta.")
+        respuesta = input("\n"+f'¿Borrar los movimientos y la cuenta número {regCuenta["fields"]["NÚMERO-CUENTA"]}? (S/N): ').upper()
+        if respuesta == "S":
+            if vaciarCuenta(tablas, regCuenta):
+                borrarRegistroCuenta(tablas["CUENTAS"], regCuenta)
+        else: print("\nRegistro no borrado.")
 
     else:
 
         # Eliminar registro de la tabla CUENTAS
         respuesta = input("\n"+f'¿Seguro que quieres borrar la cuenta número {regCuenta["fields"]["NÚMERO-CUENTA"]}? (S/N): ').upper()
         if respuesta == "S":
-            tablas["CUENTAS"].delete(regCuenta["id"])
-            print("\nCuenta borrada.")
+            borrarRegistroCuenta(tablas["CUENTAS"], regCuenta)
         else: print("\nRegistro no borrado.")
 
+
+def borrarRegistroCuenta(tabla, regCuenta):
+    '''Borra el registro de una cuenta de la tabla CUENTAS e informa del resultado
+
+    Retorna: True si se ha borrado'''
+
+    try:
+        borrada = tabla.delete(regCuenta["id"]).get("deleted")
+    except Exception as error:
+        print(f"\nNo se ha podido borrar la cuenta ({describirError(error)}).")
+        return False
+
+    if borrada:
+        print("\nCuenta borrada.")
+    else:
+        print("\nNo se ha podido borrar la cuenta.")
+
+    return bool(borrada)
+
+
 def borrarRegistroDeTabla(tabla, reg):
     '''Borrar un registro de una tabla'''
 
@@ -1633,16 +3857,115 @@ def traerRegistroDeTabla(tabla, reg):
     - tabla: Table
     - reg: [str]
 
-    Retorna: Record'''
-    
-    if not reg: return False
+    Retorna: Record'''
+    
+    if not reg: return False
+
+    try:
+        registros, fallidos = traerRegistrosPorLotes(tabla, [reg[0]])
+    except TypeError:
+        return False
+
+    if registros:
+        return registros[0]
+    else:
+        return False
+
+
+def formulaPorIds(listaReg):
+    '''Fórmula de Airtable que selecciona los registros con los id indicados'''
+
+    condiciones = ",".join(f"RECORD_ID()='{reg}'" for reg in listaReg)
+
+    return f"OR({condiciones})"
+
+
+def idsDeFormula(formula):
+    '''Id de los registros de una fórmula hecha con formulaPorIds
+
+    Retorna: [str], o None si la fórmula es de otro tipo'''
+
+    encaje = re.fullmatch(r"OR\((RECORD_ID\(\)='[^',]*'(,RECORD_ID\(\)='[^',]*')*)\)", formula or "")
+
+    if not encaje:
+        return None
+
+    return re.findall(r"RECORD_ID\(\)='([^']*)'", encaje.group(1))
+
+
+def enParalelo(tareas):
+    '''Ejecuta tareas independientes en un grupo limitado de hilos
+
+    Las peticiones de cada hilo se anotan en las métricas con la acción
+    del hilo que las lanza.
+
+    Argumentos:
+    - tareas: [función sin argumentos]
+
+    Retorna: lista de resultados en el mismo orden que las tareas'''
+
+    if len(tareas) < 2:
+        return [tarea() for tarea in tareas]
+
+    accion = metricas.accionActual()
+    hilos = cargarConfiguracion().get("planificador", dict()).get("concurrencia", CONCURRENCIA)
+
+    def ejecutar(tarea):
+        with metricas.enAccion(accion):
+            return tarea()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(hilos, len(tareas))) as grupo:
+        return list(grupo.map(ejecutar, tareas))
+
+
+def traerRegistrosPorLotes(tabla, listaReg, campos=None):
+    '''Recupera varios registros de una tabla con una consulta por cada lote de id
+
+    Argumentos:
+    - tabla: Table
+    - listaReg: [str]
+        Lista de claves primarias, puede tener repetidos
+    - campos: [str] o None
+        Campos que se quieren recuperar, todos si es None
+
+    Retorna:
+    - Lista de registros encontrados en el mismo orden que listaReg: [Record]
+    - Lista de claves que no se han podido recuperar: [str]'''
+
+    # Cada id se pide una sola vez aunque aparezca repetido
+    encontrados = dict()
+    pendientes = []
+
+    # Los registros que ya están en la caché no se piden
+    for reg in dict.fromkeys(listaReg):
+        registro = tabla.buscarEnCache(reg)
+        if registro:
+            encontrados[reg] = registro
+        else:
+            pendientes.append(reg)
+
+    def traerLote(lote):
+        opciones = {"formula": formulaPorIds(lote)}
+        if campos:
+            opciones["fields"] = campos
+        try:
+            return tabla.all(**opciones)
+        except Exception as error:
+            # El lote fallido se informa en la lista de no recuperados
+            print(f"No se ha podido recuperar un lote de {len(lote)} registro(s) ({describirError(error)}).")
+            return []
+
+    # Los lotes no dependen unos de otros: se piden a la vez
+    lotes = [pendientes[i:i + LOTE_LECTURA] for i in range(0, len(pendientes), LOTE_LECTURA)]
+
+    for resultado in enParalelo([functools.partial(traerLote, lote) for lote in lotes]):
+        for registro in resultado:
+            encontrados[registro["id"]] = registro
+
+    registros = [encontrados[reg] for reg in listaReg if reg in encontrados]
+    fallidos = [reg for reg in pendientes if reg not in encontrados]
 
-    try:
-        return tabla.get(reg[0])
-    except TypeError:
-        return False
-    except ConnectionError:
-        return False
+    return (registros, fallidos)
 
 
 def traerRegistros(tabla, listaReg):
@@ -1655,14 +3978,11 @@ def traerRegistros(tabla, listaReg):
     Retorna: Lista de registros: [Record]'''
 
     if listaReg:
-        lista = []
 
-        for reg in listaReg:
-            try:
-                registro = tabla.get(reg)
-                lista.append(registro)
-            except:
-                pass
+        lista, fallidos = traerRegistrosPorLotes(tabla, listaReg)
+
+        if fallidos:
+            print(f"\nNo se han podido recuperar {len(fallidos)} registro(s).")
 
         if lista:
             return lista
@@ -1672,44 +3992,294 @@ def traerRegistros(tabla, listaReg):
         return False
 
 
-def buscarRegistroDeCampoEnTabla(buscadero, nombreCampo, dato):
-    ''' Buscar el registro que tenga el dato en el nombreCampo de la tabla
+def normalizarTexto(texto):
+    '''Pasa el texto a mayúsculas y quita los acentos de las vocales'''
 
-        Argumentos:
-        - buscadero: list(dict)
-            Tabla de la base de datos donde buscar
-        - nombreCampo: str
-            Nombre del campo de la tabla que se aporta
-        - dato: str
-            Valor del campo a partir del cual se busca
-
-        Retorna:
-        - lista con id del registro encontrado: [str]
-        - lista vacía si no lo encuentra'''
-
-    return [
-        reg["id"] for reg in buscadero if reg["fields"].get(nombreCampo) == dato
+    return texto.upper().translate(str.maketrans(ACENTOS))
+
+
+def escaparComillas(texto):
+    '''Escapa el texto para usarlo entre comillas simples en una fórmula'''
+
+    return texto.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def formulaPrefijo(campo, prefijo):
+    '''Fórmula de Airtable que comprueba si el campo empieza por el prefijo
+    sin distinguir mayúsculas ni acentos'''
+
+    expresion = f"UPPER({{{campo}}})"
+
+    for conAcento, sinAcento in ACENTOS.items():
+        expresion = f"SUBSTITUTE({expresion},'{conAcento}','{sinAcento}')"
+
+    return f"FIND('{escaparComillas(normalizarTexto(prefijo))}',{expresion})=1"
+
+
+def textoDeCampo(valor):
+    '''Valor de un campo tal como lo usa Airtable en una fórmula de texto'''
+
+    if valor is None:
+        return ""
+    if type(valor) == type(list()):
+        return ", ".join(textoDeCampo(v) for v in valor)
+    if isinstance(valor, bool):
+        return "1" if valor else ""
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+
+    return str(valor)
+
+
+def numeroDeCampo(valor):
+    '''Valor de un campo tal como lo usa Airtable en una fórmula numérica'''
+
+    if type(valor) == type(list()):
+        valor = valor[0] if len(valor) == 1 else textoDeCampo(valor)
+    if valor is None or valor == "":
+        return 0
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0
+
+
+def compararValores(a, b):
+    '''Normaliza dos valores de una fórmula para poder compararlos'''
+
+    if isinstance(a, (int, float)) and not isinstance(a, bool) or isinstance(b, (int, float)) and not isinstance(b, bool):
+        return (numeroDeCampo(a), numeroDeCampo(b))
+
+    return (textoDeCampo(a), textoDeCampo(b))
+
+
+def claveDeOrden(valor):
+    '''Clave para ordenar valores de un campo: primero los números y luego el texto'''
+
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return (0, valor, "")
+
+    return (1, 0, textoDeCampo(valor))
+
+
+def trocearFormula(formula):
+    '''Divide una fórmula de Airtable en piezas: (tipo, valor)'''
+
+    patron = re.compile(r"""
+        \s*(?:
+            (?P<texto>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+          | \{(?P<campo>[^}]*)\}
+          | (?P<numero>\d+(?:\.\d+)?)
+          | (?P<nombre>[A-Za-z_][A-Za-z_0-9]*)
+          | (?P<operador><=|>=|!=|[=<>&+\-*/(),])
+        )""", re.VERBOSE)
+
+    piezas = []
+    pos = 0
+    formula = formula.rstrip()
+
+    while pos < len(formula):
+        encaje = patron.match(formula, pos)
+        if not encaje:
+            raise ValueError(f"Fórmula no válida en la posición {pos}: {formula}")
+        tipo = encaje.lastgroup
+        valor = encaje.group(tipo)
+        if tipo == "texto":
+            valor = re.sub(r"\\(.)", r"\1", valor[1:-1])
+        elif tipo == "numero":
+            valor = float(valor)
+        piezas.append((tipo, valor))
+        pos = encaje.end()
+
+    return piezas
+
+
+@functools.lru_cache(maxsize=128)
+def compilarFormula(formula):
+    '''Convierte una fórmula de Airtable en una función que recibe un registro
+
+    Retorna: función(registro) -> valor de la fórmula'''
+
+    piezas = trocearFormula(formula)
+    pos = 0
+
+    def siguiente():
+        return piezas[pos] if pos < len(piezas) else (None, None)
+
+    def tomar(esperado=None):
+        nonlocal pos
+        pieza = siguiente()
+        if esperado and pieza != ("operador", esperado):
+            raise ValueError(f"Se esperaba '{esperado}' en la fórmula: {formula}")
+        pos += 1
+        return pieza
+
+    def expresion(nivel=0):
+        if nivel == len(OPERADORES_FORMULA):
+            return unario()
+        izquierda = expresion(nivel + 1)
+        while siguiente()[0] == "operador" and siguiente()[1] in OPERADORES_FORMULA[nivel]:
+            funcion = OPERADORES_FORMULA[nivel][tomar()[1]]
+            derecha = expresion(nivel + 1)
+            izquierda = (lambda f, i, d: lambda reg: f(i(reg), d(reg)))(funcion, izquierda, derecha)
+        return izquierda
+
+    def unario():
+        if siguiente() == ("operador", "-"):
+            tomar()
+            valor = unario()
+            return lambda reg: -numeroDeCampo(valor(reg))
+        return primario()
+
+    def primario():
+        tipo, valor = tomar()
+        if tipo in ("texto", "numero"):
+            return lambda reg: valor
+        if tipo == "campo":
+            return lambda reg: reg["fields"].get(valor)
+        if tipo == "operador" and valor == "(":
+            dentro = expresion()
+            tomar(")")
+            return dentro
+        if tipo == "nombre":
+            nombre = valor.upper()
+            argumentos = []
+            tomar("(")
+            if siguiente() != ("operador", ")"):
+                argumentos.append(expresion())
+                while siguiente() == ("operador", ","):
+                    tomar()
+                    argumentos.append(expresion())
+            tomar(")")
+            if nombre == "RECORD_ID":
+                return lambda reg: reg["id"]
+            if nombre not in FUNCIONES_FORMULA:
+                raise ValueError(f"Función {nombre} no disponible en el espejo local")
+            funcion = FUNCIONES_FORMULA[nombre]
+            return lambda reg: funcion(*[arg(reg) for arg in argumentos])
+        raise ValueError(f"Fórmula no válida: {formula}")
+
+    evaluar = expresion()
+
+    if pos != len(piezas):
+        raise ValueError(f"Sobra texto al final de la fórmula: {formula}")
+
+    return evaluar
+
+
+def evaluarFormula(formula, registro):
+    '''Evalúa una fórmula de Airtable sobre un registro local
+
+    Argumentos:
+    - formula: str
+    - registro: Record
+
+    Retorna: True si el registro cumple la fórmula'''
+
+    valor = compilarFormula(formula)(registro)
+
+    if isinstance(valor, str):
+        return valor != ""
+
+    return bool(valor)
+
+
+def seleccionarRegistros(registros, formula=None, fields=None, sort=None, max_records=None, **options):
+    '''Aplica a una lista de registros las opciones de consulta de Table.all
+
+    Argumentos:
+    - registros: [Record]
+    - formula: str, sort: [str] (con "-" delante para orden descendente),
+      fields: [str], max_records: int
+
+    Retorna: [Record]'''
+
+    if formula:
+        registros = [reg for reg in registros if evaluarFormula(formula, reg)]
+
+    for campo in reversed(sort or []):
+        descendente = campo.startswith("-")
+        campo = campo.lstrip("-")
+        registros = sorted(
+            registros,
+            key=lambda reg: claveDeOrden(reg["fields"].get(campo)),
+            reverse=descendente,
+        )
+
+    if max_records:
+        registros = registros[:max_records]
+
+    if fields:
+        registros = [
+            {**reg, "fields": {c: v for c, v in reg["fields"].items() if c in fields}}
+            for reg in registros
+        ]
+
+    return registros
+
+
+def buscarParticipantes(tabla, nombre, apellido1, apellido2):
+    '''Buscar en el servidor los participantes cuyos datos empiezan por los indicados
+
+    Argumentos:
+    - tabla: Table
+        Tabla PERSONAS
+    - nombre, apellido1, apellido2: str
+        Principio de cada dato, se ignoran los que están vacíos
+
+    Retorna:
+    - Lista de registros encontrados con el campo NOMBRE COMPLETO: [Record]'''
+
+    condiciones = [
+        formulaPrefijo(campo, dato)
+        for campo, dato in (("NOMBRE", nombre), ("APELLIDO1", apellido1), ("APELLIDO2", apellido2))
+        if dato
     ]
 
+    if not condiciones:
+        return []
+
+    return tabla.all(
+        formula=f'AND({",".join(condiciones)})',
+        sort=["NOMBRE COMPLETO"],
+        fields=["NOMBRE COMPLETO"],
+    )
+
 
 def buscarParticipante(tabla):
     '''Buscar un participante'''
 
-    nombre = input("Introduce nombre: ").upper()
-    apellido1 = input("Introduce primer apellido: ").upper()
-    apellido2 = input("Introduce segundo apellido: ").upper()
+    nombre = input("Introduce nombre: ").strip()
+    apellido1 = input("Introduce primer apellido: ").strip()
+    apellido2 = input("Introduce segundo apellido: ").strip()
 
-    nombreCompleto = f'{apellido1} {apellido2}, {nombre}'
-    buscadero = tabla.all(fields = ["NOMBRE COMPLETO"])
+    encontrados = buscarParticipantes(tabla, nombre, apellido1, apellido2)
 
-    encontrados = buscarRegistroDeCampoEnTabla(buscadero, "NOMBRE COMPLETO", nombreCompleto)
+    if not encontrados:
+        print("\nRegistro no encontrado.")
+        return []
 
-    if encontrados:
-        print("\n"+f'Encontrado: {encontrados[0]}')
+    if len(encontrados) == 1:
+        elegido = encontrados[0]
     else:
-        print("\nRegistro no encontrado.")
+        print("\n"+f'Encontrados {len(encontrados)} participantes:')
+        for i, registro in enumerate(encontrados):
+            print(f'{i+1}. {registro["fields"].get("NOMBRE COMPLETO")}')
+
+        opcion = 0
+
+        while opcion < 1 or opcion > len(encontrados):
+            try:
+                opcion = int(input("\nElige participante: "))
+            except ValueError:
+                # Si no es entero, volver a preguntar
+                opcion = 0
 
-    return encontrados
+        elegido = encontrados[opcion - 1]
+
+    print("\n"+f'Encontrado: {elegido["id"]}')
+
+    return [elegido["id"]]
 
 
 def pedirTipoParticipante():
@@ -1758,6 +4328,128 @@ def crearParticipante(tabla):
     }
 
     return crearRegistroEnTabla(tabla, esquemaPersonas.get("fields"))
+
+
+def claveParticipante(campos):
+    '''Nombre y apellidos normalizados para detectar participantes repetidos
+
+    Se usan los campos por separado y no NOMBRE COMPLETO para no depender
+    del formato de la fórmula de Airtable
+
+    Retorna: (str, str, str)'''
+
+    return tuple(" ".join(normalizarTexto(campos.get(c) or "").split()) for c in ("NOMBRE", "APELLIDO1", "APELLIDO2"))
+
+
+def leerParticipantesCsv(ruta):
+    '''Lee y valida de una vez todas las filas de un CSV de participantes,
+    con las columnas de COLUMNAS_IMPORTACION y separadas por coma o punto y coma
+
+    Retorna:
+    - Campos de PERSONAS de las filas válidas: [dict]
+    - Errores encontrados, uno por línea: [str]'''
+
+    with open(ruta, newline="", encoding="utf-8-sig") as fichero:
+        muestra = fichero.read(4096)
+        fichero.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;")
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.DictReader(fichero, dialect=dialecto)
+
+        faltan = [c for c in COLUMNAS_IMPORTACION if c not in [normalizarTexto(n.strip()) for n in lector.fieldnames or []]]
+        if faltan:
+            return ([], [f"Faltan las columnas: {', '.join(faltan)}."])
+
+        filas = []
+        errores = []
+
+        for fila in lector:
+            fila = {normalizarTexto(columna.strip()): (valor or "").strip().upper() for columna, valor in fila.items() if columna}
+            linea = lector.line_num
+            if not any(fila.values()):
+                continue
+
+            # Se acepta la inicial del tipo, como en pedirTipoParticipante
+            tipo = fila["TIPO"]
+            tipo = next((nombre for nombre, inicial in TIPOS_PARTICIPANTE.items() if tipo == inicial), tipo)
+
+            campos = {"NOMBRE": fila["NOMBRE"], "APELLIDO1": fila["APELLIDO1"], "APELLIDO2": fila["APELLIDO2"], "TIPO": tipo}
+            erroresFila = []
+
+            for campo in ("NOMBRE", "APELLIDO1", "TIPO"):
+                try:
+                    getattr(validador, f'validar{campo.capitalize()}')(campos[campo])
+                except ValueError as error:
+                    erroresFila.append(str(error))
+
+            if erroresFila:
+                errores += [f"Línea {linea}: {error}" for error in erroresFila]
+            else:
+                filas.append(campos)
+
+    return (filas, errores)
+
+
+def importarParticipantes(tabla, ruta):
+    '''Crea en PERSONAS los participantes de un fichero CSV en lotes,
+    saltando los que ya existen con el mismo nombre completo
+
+    Argumentos:
+    - tabla: Table
+        Tabla PERSONAS
+    - ruta: str
+
+    Retorna: [Record] con los participantes creados'''
+
+    try:
+        filas, errores = leerParticipantesCsv(ruta)
+    except (OSError, UnicodeDecodeError, csv.Error) as error:
+        print(f"No se ha podido leer el fichero: {error}")
+        return []
+
+    if errores:
+        print(f"\nSe han encontrado {len(errores)} error(es):")
+        for error in errores:
+            print(error)
+
+    # Los repetidos se buscan en la tabla y en el propio fichero
+    existentes = {
+        claveParticipante(registro["fields"])
+        for registro in tabla.all(fields=["NOMBRE", "APELLIDO1", "APELLIDO2"])
+    }
+    nuevos = []
+    repetidos = []
+
+    for campos in filas:
+        clave = claveParticipante(campos)
+        if clave in existentes:
+            repetidos.append(f'{campos["APELLIDO1"]} {campos["APELLIDO2"]}, {campos["NOMBRE"]}')
+        else:
+            existentes.add(clave)
+            nuevos.append(campos)
+
+    if repetidos:
+        print(f"\nSe saltan {len(repetidos)} participante(s) que ya existen:")
+        for nombre in repetidos:
+            print(nombre)
+
+    if not nuevos:
+        print("\nNo hay participantes nuevos que crear.")
+        return []
+
+    respuesta = input(f"\n¿Crear {len(nuevos)} participante(s)? [S/N]: ").strip().upper()
+
+    if respuesta != "S":
+        print("Importación cancelada.")
+        return []
+
+    creados, fallidos = crearRegistrosEnTabla(tabla, nuevos)
+
+    print(f"Creados {len(creados)} participante(s).")
+
+    return creados
     
 
 def comprobarDatosDelParticipante(mensaje, tipoDato):
@@ -1774,36 +4466,55 @@ def comprobarDatosDelParticipante(mensaje, tipoDato):
 
 
 def listaRegistrosEnTabla(tabla, conf, campoOrden):
-    '''Lista de registros en una tabla'''
-
-    lista = PrettyTable()
-    lista.field_names = conf["campos"]
-    for i, ajuste in enumerate(conf["ajuste"]):
-        col = conf["campos"][i]
-        lista.align[col] = ajuste       
-    lista.set_style(PLAIN_COLUMNS)
-    
-    for reg in tabla.all(sort = [campoOrden]):
-        
-        fila = []
-
-        for campo in conf["campos"]:
-            # Horizontal
-            columna = reg["fields"].get(campo)
-            if columna:
-                if type(columna) == type(str()):
-                    fila.append(columna)
-                elif type(columna) == type(list()):
-                    if type(columna[0]) == type(float()) or type(columna[0]) == type(int()):
-                        fila.append("{0:.2f} €".format(columna[0]))
-                    elif type(columna[0]) == type(str()):
-                        fila.append(columna[0].upper())
-            else:
-                fila.append("--")
+    '''Lista de registros en una tabla
 
-        lista.add_row(fila)
+    Solo se piden los campos que se muestran y cada página de registros se
+    imprime en cuanto llega, sin esperar a tener la tabla entera'''
 
-    print(lista)
+    lista = nuevaTabla(conf["campos"], conf["ajuste"])
+    anchos = {campo: len(campo) for campo in conf["campos"]}
+    primera = True
+
+    for pagina in tabla.iterate(sort=[campoOrden], fields=conf["campos"]):
+        # Las páginas siguientes se alinean con lo ya impreso
+        lista.clear_rows()
+        lista.header = primera
+        primera = False
+
+        for reg in pagina:
+            mostrarFilaDeLista(lista, reg, conf["campos"], anchos)
+
+        lista.min_width = anchos
+        print(lista)
+
+    if primera:
+        # Tabla vacía: solo la cabecera
+        print(lista)
+
+
+def mostrarFilaDeLista(lista, reg, campos, anchos):
+    '''Añade a la lista la fila de un registro y actualiza el ancho de las columnas'''
+
+    fila = []
+
+    for campo in campos:
+        # Horizontal
+        columna = reg["fields"].get(campo)
+        if columna:
+            if type(columna) == type(str()):
+                fila.append(columna)
+            elif type(columna) == type(list()):
+                if type(columna[0]) == type(float()) or type(columna[0]) == type(int()):
+                    fila.append("{0:.2f} €".format(columna[0]))
+                elif type(columna[0]) == type(str()):
+                    fila.append(columna[0].upper())
+        else:
+            fila.append("--")
+
+    lista.add_row(fila)
+
+    for campo, valor in zip(campos, fila):
+        anchos[campo] = max(anchos[campo], len(str(valor)))
 
 
 def listaParticipantes(tabla):
@@ -1832,60 +4543,10 @@ def modificarCampo(tabla, campo, nuevoDato, reg):
         return False
 
 
-def pedirModificacion(tabla, regParticipante):
-    '''Pedir nuevo dato para modificar'''
-
-    campo = str
-
-    muestraOpciones(menus.get("modificarParticipante"))
-
-    opcion = input("\n").upper()
-
-    if opcion == 'N':
-        campo = "NOMBRE"
-        nombre = input("Nuevo nombre: ").upper()
-        resultado = modificarCampo(tabla, campo, nombre, regParticipante)
-        if resultado:
-            print("Datos modificados correctamente.")
-        else: print("No se ha podido hacer la modificación.")
-        pedirModificacion(tabla, regParticipante)
-    elif opcion == 'R':
-        regParticipante = buscarParticipante(tabla)
-    elif opcion == 'P':
-        campo = "APELLIDO1"
-        nombre = input("Nuevo primer apellido: ").upper()
-        resultado = modificarCampo(tabla, campo, nombre, regParticipante)
-        if resultado:
-            print("Datos modificados correctamente.")
-        else: print("No se ha podido hacer la modificación.")
-        pedirModificacion(tabla, regParticipante)
-    elif opcion == 'S':
-        campo = "APELLIDO2"
-        nombre = input("Nuevo segundo apellido: ").upper()
-        resultado = modificarCampo(tabla, campo, nombre, regParticipante)
-        if resultado:
-            print("Datos modificados correctamente.")
-        else: print("No se ha podido hacer la modificación.")
-        pedirModificacion(tabla, regParticipante)
-    elif opcion == 'T':
-        campo = "TIPO"
-        nombre = input("Nuevo tipo (COMERCIANTE/ESTUDIANTE): ").upper()
-        resultado = modificarCampo(tabla, campo, nombre, regParticipante)
-        if resultado:
-            print("Datos modificados correctamente.")
-        else: print("No se ha podido hacer la modificación.")
-        pedirModificacion(tabla, regParticipante)
-    elif opcion == 'V':
-        # Volver al menú anterior
-        comienzo(regParticipante)
-    else:
-        print('Comando inválido')
-        time.sleep(1)
-        pedirModificacion(tabla, regParticipante)
-
-
 def modificarParticipante(tabla, regParticipante):
-    '''Pedir nuevos datos y modificar registro en la tabla PERSONAS'''
+    '''Comprueba que el participante se puede modificar en la tabla PERSONAS
+
+    Retorna: True si existe el registro del participante'''
 
     try:
         resultado = tabla.get(regParticipante[0])
@@ -1894,7 +4555,373 @@ def modificarParticipante(tabla, regParticipante):
 
     if not regParticipante: print("Es necesario primero buscar un participante.")
     elif not resultado: print("Registro ya borrado.")
-    else: pedirModificacion(tabla, regParticipante)
+    else: return True
+
+    return False
+
+
+#
+# Menús
+# -----
+#
+# Cada opción de un menú es una función que recibe la sesión (tablas y
+# participante elegido) y devuelve el nombre del menú al que hay que ir,
+# o None para quedarse en el mismo. El bucle de comienzo() las despacha
+# sin recursión, así que la pila no crece durante la sesión.
+#
+
+
+def esClaveProfesor():
+    '''Pide la clave y comprueba que es la del profesor'''
+
+    clave = pedirClave()
+
+    return clave == atk or clave == "Joshua"
+
+
+def esClaveParticipante(reg):
+    '''Pide la clave y comprueba que es la del participante elegido'''
+
+    clave = pedirClave()
+
+    try:
+        return clave == reg[0] or clave == "Joshua"
+    except IndexError:
+        print("\nNo se ha elegido participante.")
+        return False
+
+
+# Menú principal
+
+def opcionCrearParticipante(sesion):
+    if esClaveProfesor():
+        registro = crearParticipante(sesion["tablas"]["PERSONAS"])
+        if registro:
+            sesion["reg"] = [registro["id"]]
+            print("Registro creado correctamente.")
+
+
+def opcionImportarParticipantes(sesion):
+    if esClaveProfesor():
+        ruta = input("Fichero CSV con los participantes: ").strip()
+        importarParticipantes(sesion["tablas"]["PERSONAS"], ruta)
+
+
+def opcionPrepararClase(sesion):
+    if esClaveProfesor():
+        prepararClase(sesion["tablas"])
+
+
+def opcionNominaSemanal(sesion):
+    if esClaveProfesor():
+        nominaSemanal(sesion["tablas"])
+
+
+def opcionListaParticipantes(sesion):
+    listaParticipantes(sesion["tablas"]["PERSONAS"])
+
+
+def opcionBuscarParticipante(sesion):
+    sesion["reg"] = buscarParticipante(sesion["tablas"]["PERSONAS"])
+    if sesion["reg"]:
+        return "participante"
+
+
+def opcionOpcionesParticipante(sesion):
+    if sesion["reg"]:
+        return "participante"
+    print("Es necesario primero buscar un participante.")
+
+
+def opcionSalir(sesion):
+    # Validar salida y terminar guión
+    if esClaveProfesor():
+        return "salir"
+
+
+# Menú del participante
+
+def opcionModificarParticipante(sesion):
+    if esClaveProfesor() and modificarParticipante(sesion["tablas"]["PERSONAS"], sesion["reg"]):
+        return "modificarParticipante"
+
+
+def opcionBorrarParticipante(sesion):
+    if esClaveProfesor():
+        borrarParticipante(sesion["tablas"]["PERSONAS"], sesion["reg"])
+        sesion["reg"] = []
+        return "principal"
+
+
+def opcionBuscarOtroParticipante(sesion):
+    sesion["reg"] = buscarParticipante(sesion["tablas"]["PERSONAS"])
+
+
+def opcionDatosParticipante(sesion):
+    mostrarParticipante(sesion["tablas"]["PERSONAS"], sesion["reg"])
+
+
+def opcionOperacionesPersonaje(sesion):
+    if esClaveParticipante(sesion["reg"]):
+        return "operacionesPersonaje"
+
+
+def opcionVolverPrincipal(sesion):
+    return "principal"
+
+
+def opcionVolverParticipante(sesion):
+    return "participante"
+
+
+# Menú de operaciones con el personaje
+
+def opcionAsignarPersonaje(sesion):
+    if esClaveProfesor():
+        asignarPersonaje(sesion["tablas"], sesion["reg"])
+
+
+def opcionBorrarPersonaje(sesion):
+    if esClaveProfesor():
+        borrarPersonaje(sesion["tablas"], sesion["reg"])
+
+
+def opcionOperacionesCuenta(sesion):
+    if sesion["reg"] and esClaveParticipante(sesion["reg"]):
+        return "cuenta"
+    return "participante"
+
+
+def opcionNada(sesion):
+    pass
+
+
+# Menú de la cuenta
+
+def opcionNuevaCuenta(sesion):
+    if esClaveProfesor():
+        nuevaCuenta(sesion["tablas"], sesion["reg"])
+
+
+def opcionBorrarCuenta(sesion):
+    if esClaveProfesor():
+        borrarCuenta(sesion["tablas"], sesion["reg"])
+
+
+def opcionOperacionesMovimientos(sesion):
+    if esClaveParticipante(sesion["reg"]):
+        return "movimientos"
+
+
+# Menú de movimientos
+
+def opcionNuevoMovimiento(sesion):
+    if esClaveParticipante(sesion["reg"]):
+        nuevoMovimiento(sesion["tablas"], sesion["reg"])
+
+
+def opcionBorrarMovimiento(sesion):
+    if esClaveParticipante(sesion["reg"]):
+        borrarMovimiento(sesion["tablas"], sesion["reg"])
+
+
+def opcionModificarMovimiento(sesion):
+    if esClaveParticipante(sesion["reg"]):
+        modificarMovimiento(sesion["tablas"], sesion["reg"])
+
+
+def opcionListaMovimientos(sesion):
+    listaMovimientos(sesion["tablas"], sesion["reg"])
+
+
+def opcionListaMovimientosFiltrada(sesion):
+    listaMovimientos(sesion["tablas"], sesion["reg"], pedirFiltroMovimientos())
+
+
+def opcionBorrarTodosMovimientos(sesion):
+    if esClaveProfesor():
+        borrarTodosMovimientos(sesion["tablas"], sesion["reg"])
+
+
+def opcionVolverCuenta(sesion):
+    return "cuenta"
+
+
+# Menú para modificar el participante
+
+def opcionModificarCampo(campo, mensaje, sesion):
+    nuevoDato = input(mensaje).upper()
+    resultado = modificarCampo(sesion["tablas"]["PERSONAS"], campo, nuevoDato, sesion["reg"])
+    if resultado:
+        print("Datos modificados correctamente.")
+    else: print("No se ha podido hacer la modificación.")
+
+
+def opcionBuscarYVolver(sesion):
+    sesion["reg"] = buscarParticipante(sesion["tablas"]["PERSONAS"])
+    return "participante"
+
+
+# Opciones ocultas, que no aparecen en los menús
+
+def opcionMetricas(sesion):
+    if esClaveProfesor():
+        mostrarMetricas()
+
+
+# Acciones de cada opción de los menús [menu.*] de conf.toml
+ACCIONES = {
+    "principal": {
+        "C": opcionCrearParticipante,
+        "L": opcionListaParticipantes,
+        "R": opcionBuscarParticipante,
+        "O": opcionOpcionesParticipante,
+        "I": opcionImportarParticipantes,
+        "A": opcionPrepararClase,
+        "N": opcionNominaSemanal,
+        "S": opcionSalir,
+    },
+    "participante": {
+        "D": opcionDatosParticipante,
+        "M": opcionModificarParticipante,
+        "B": opcionBorrarParticipante,
+        "R": opcionBuscarOtroParticipante,
+        "P": opcionOperacionesPersonaje,
+        "V": opcionVolverPrincipal,
+    },
+    "operacionesPersonaje": {
+        "A": opcionAsignarPersonaje,
+        "M": opcionAsignarPersonaje,
+        "B": opcionBorrarPersonaje,
+        "O": opcionOperacionesCuenta,
+        "P": opcionBuscarOtroParticipante,
+        "L": opcionNada,
+        "V": opcionVolverParticipante,
+    },
+    "cuenta": {
+        "N": opcionNuevaCuenta,
+        "B": opcionBorrarCuenta,
+        "O": opcionOperacionesMovimientos,
+        "V": opcionVolverParticipante,
+    },
+    "movimientos": {
+        "N": opcionNuevoMovimiento,
+        "B": opcionBorrarMovimiento,
+        "M": opcionModificarMovimiento,
+        "L": opcionListaMovimientos,
+        "F": opcionListaMovimientosFiltrada,
+        "T": opcionBorrarTodosMovimientos,
+        "V": opcionVolverCuenta,
+    },
+    "modificarParticipante": {
+        "R": opcionBuscarYVolver,
+        "N": functools.partial(opcionModificarCampo, "NOMBRE", "Nuevo nombre: "),
+        "P": functools.partial(opcionModificarCampo, "APELLIDO1", "Nuevo primer apellido: "),
+        "S": functools.partial(opcionModificarCampo, "APELLIDO2", "Nuevo segundo apellido: "),
+        "T": functools.partial(opcionModificarCampo, "TIPO", "Nuevo tipo (COMERCIANTE/ESTUDIANTE): "),
+        "V": opcionVolverParticipante,
+    },
+}
+
+
+# Opciones que se pueden elegir sin que aparezcan en el menú
+ACCIONES_OCULTAS = {
+    "principal": {
+        "?": opcionMetricas,
+    },
+}
+
+
+def construirDespacho(catalogo):
+    '''Tabla de despacho con las opciones de cada menú de conf.toml que tienen acción,
+    más las opciones ocultas
+
+    Retorna: {menú: {opción: función}}'''
+
+    despacho = dict()
+
+    for nombre, opciones in catalogo.items():
+        acciones = ACCIONES.get(nombre, dict())
+        despacho[nombre] = {
+            opcion: acciones[opcion] for opcion in opciones if opcion in acciones
+        }
+        despacho[nombre].update(ACCIONES_OCULTAS.get(nombre, dict()))
+
+    return despacho
+
+
+def nombreAccion(accion):
+    '''Nombre de una acción para las métricas: opcionNuevoMovimiento -> nuevoMovimiento'''
+
+    funcion = getattr(accion, "func", accion)
+    nombre = funcion.__name__.removeprefix("opcion")
+
+    # Las acciones parciales llevan el campo que modifican
+    if isinstance(accion, functools.partial) and accion.args:
+        nombre += f":{accion.args[0]}"
+
+    return nombre[:1].lower() + nombre[1:]
+
+
+def entrarEnMenu(nombre, sesion):
+    '''Muestra los datos previos de un menú
+
+    Retorna: nombre del menú al que hay que ir si no se puede entrar, None si se puede'''
+
+    if nombre == "cuenta" and not comprobarPersonaje(sesion["tablas"]["PERSONAS"], sesion["reg"]):
+        print("\nEs necesario primero asignar un personaje.")
+        time.sleep(1)
+        return "participante"
+
+    if nombre in ("participante", "operacionesPersonaje", "cuenta", "movimientos"):
+        mostrarParticipante(sesion["tablas"]["PERSONAS"], sesion["reg"])
+
+    return None
+
+
+def comienzo(regParticipante, menu="principal"):
+    '''Pregunta comandos de los menús y ejecuta las opciones hasta salir'''
+
+    # Las tablas ya cargadas se reutilizan sin consultar la base de datos
+    sesion = {
+        "tablas": cargarBase(),
+        "reg": regParticipante,
+    }
+
+    menus = obtenerMenus()
+    despacho = construirDespacho(menus)
+
+    while menu != "salir":
+
+        mostrarAvisosEspejo()
+
+        with metricas.enAccion("entrarEnMenu"):
+            redireccion = entrarEnMenu(menu, sesion)
+        if redireccion:
+            menu = redireccion
+            continue
+
+        muestraOpciones(menus.get(menu))
+
+        opcion = input("\n").upper()
+
+        accion = despacho[menu].get(opcion)
+
+        if not accion:
+            print('Comando inválido.')
+            time.sleep(1)
+            continue
+
+        with metricas.enAccion(nombreAccion(accion)):
+            try:
+                menu = accion(sesion) or menu
+            except OSError as error:
+                # Las caídas de la conexión se tratan en la ejecución principal;
+                # un error de Airtable no hace perder el participante ni el menú
+                if esErrorDeConexion(error):
+                    raise
+                print(f"\nLa base de datos ha respondido con un error ({describirError(error)}).")
+                time.sleep(1)
 
 
 #
@@ -1910,6 +4937,8 @@ if __name__ == "__main__":
     print("\nSistema de Educación Financiera Escolar de Alborada")
     print("{:-^51}".format(""))
 
+    comprobarArranque()
+
     while not atk:
         atk = pedirClave()
     
@@ -1917,11 +4946,25 @@ if __name__ == "__main__":
 
     claveInterrupcion = ""
     
-    try:
-        comienzo([])
-    except KeyboardInterrupt:
-        claveInterrupcion = pedirClave()
-        if claveInterrupcion == atk or claveInterrupcion == "Joshua":
-            os._exit(1)
-        else:
+    while True:
+        try:
             comienzo([])
+            # Enviar lo que quede en el diario de la copia local
+            for espejo in espejos.values():
+                espejo.detener()
+            mostrarAvisosEspejo()
+            volcarMetricas()
+            break
+        except OSError as error:
+            # requests.HTTPError también deriva de OSError, pero es una
+            # respuesta de Airtable (403, 404, 422...) y no una caída de la conexión
+            if not esErrorDeConexion(error):
+                print(f"\nLa base de datos ha respondido con un error ({describirError(error)}).")
+                continue
+            print("\nSe ha perdido la conexión con la base de datos. Reconectando...")
+            reconectarBase()
+        except KeyboardInterrupt:
+            claveInterrupcion = pedirClave()
+            if claveInterrupcion == atk or claveInterrupcion == "Joshua":
+                volcarMetricas()
+                os._exit(1)